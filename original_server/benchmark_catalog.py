@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from catalog import DetectionCatalog
+
+# Configuration
+# Detection rows spread over a year; pass a smaller count as the first argument for a quick run
+NUM_ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+NUM_CAMERAS = 20
+NUM_DAYS = 365
+NAMES = {0: "animal", 1: "person", 2: "vehicle"}
+CLASS_WEIGHTS = [0.8, 0.15, 0.05]
+INSERT_BATCH = 500
+NUM_QUERIES = 200
+PAGE_SIZE = 100
+# Page size when checking that paging returns every row
+CHECK_PAGE_SIZE = 1000
+
+def cameras():
+    return [f"AABBCCDD{i:04X}" for i in range(NUM_CAMERAS)]
+
+def fill(catalog):
+    """Insert NUM_ROWS detections in batches, as the background writer does; returns rows/s."""
+    start = time.time() - NUM_DAYS * 86400
+    rows = []
+    start_time = time.perf_counter()
+    for i in range(NUM_ROWS):
+        camera = random.choice(cameras())
+        cls = random.choices(list(NAMES), CLASS_WEIGHTS)[0]
+        confidence = round(random.uniform(0.25, 1.0), 3)
+        rows.append((start + i * NUM_DAYS * 86400 / NUM_ROWS, camera, f"{camera}-{i // 3:08d}", cls, NAMES[cls],
+                     1, confidence, f"[[10.0, 20.0, 300.0, 400.0, {confidence}]]", f"{camera}-{i // 3:08d}-{i % 3 + 1}d.jpg",
+                     None))
+        if len(rows) == INSERT_BATCH:
+            catalog._write(rows)
+            rows = []
+    if rows:
+        catalog._write(rows)
+    return NUM_ROWS / (time.perf_counter() - start_time)
+
+def timed(queries):
+    """(p50, p99, max) milliseconds of running each query."""
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        query()
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], latencies[-1]
+
+def random_week():
+    end = time.time() - random.uniform(0, NUM_DAYS - 7) * 86400
+    return end - 7 * 86400, end
+
+def deep_pages(catalog, pages=10, **filters):
+    """Follow the cursor pages deep, as a client paging through results would."""
+    cursor = None
+    for _ in range(pages):
+        _, cursor = catalog.query(limit=PAGE_SIZE, cursor=cursor, **filters)
+        if cursor is None:
+            break
+
+def check_paging(catalog):
+    """Paging through one camera's animal detections returns each row exactly once, newest first."""
+    camera = cameras()[0]
+    seen, cursor, previous = [], None, None
+    while True:
+        rows, cursor = catalog.query(camera=camera, image_class="animal", limit=CHECK_PAGE_SIZE, cursor=cursor)
+        for row in rows:
+            key = (row["detected_at"], row["id"])
+            if previous is not None and key >= previous:
+                return False
+            previous = key
+            seen.append(row["id"])
+        if cursor is None:
+            break
+    expected = catalog._reader.execute(
+        "SELECT COUNT(*) FROM detections WHERE camera = ? AND class = 'animal'", (camera,)).fetchone()[0]
+    return len(seen) == len(set(seen)) == expected
+
+def main():
+    root = tempfile.mkdtemp(prefix="catalog_bench_")
+    random.seed(0)
+    try:
+        catalog = DetectionCatalog(os.path.join(root, "detections.sqlite3"))
+        print(f"{NUM_ROWS} detections, {NUM_CAMERAS} cameras over {NUM_DAYS} days")
+        print(f"insert: {fill(catalog):.0f} rows/s in batches of {INSERT_BATCH}")
+        print(f"database: {os.path.getsize(catalog.path) / 1e6:.1f} MB")
+        print(f"paging returns every row once, in order: {'PASS' if check_paging(catalog) else 'FAIL'}")
+
+        queries = {
+            "latest page": lambda: catalog.query(limit=PAGE_SIZE),
+            "camera, class, week": lambda: catalog.query(*random_week(), camera=random.choice(cameras()),
+                                                         image_class="animal", limit=PAGE_SIZE),
+            "class, week": lambda: catalog.query(*random_week(), image_class="vehicle", limit=PAGE_SIZE),
+            "camera, year": lambda: catalog.query(camera=random.choice(cameras()), limit=PAGE_SIZE),
+            "10 pages deep": lambda: deep_pages(catalog, camera=random.choice(cameras()), image_class="person"),
+        }
+        print(f"{'query':>20} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, query in queries.items():
+            p50, p99, worst = timed([query] * NUM_QUERIES)
+            print(f"{name:>20} {p50:>8.2f} {p99:>8.2f} {worst:>8.2f}")
+        catalog._writer.close()
+        catalog._reader.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
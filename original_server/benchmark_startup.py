@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import subprocess
+import httpx
+
+# Configuration
+PORT = 8766
+BASE_URL = f"http://127.0.0.1:{PORT}"
+IMAGE_FILE = "test.jpg"
+POLL_INTERVAL = 0.05
+TIMEOUT = 600
+
+def wait_for(predicate):
+    deadline = time.perf_counter() + TIMEOUT
+    while time.perf_counter() < deadline:
+        try:
+            if predicate():
+                return True
+        except httpx.TransportError:
+            pass
+        time.sleep(POLL_INTERVAL)
+    return False
+
+def main():
+    if not os.path.exists(IMAGE_FILE):
+        print(f"Error: '{IMAGE_FILE}' not found in current directory.")
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--port", str(PORT)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=BASE_URL, timeout=5.0) as client:
+            # Listening: /healthz answers (the model may still be loading)
+            if not wait_for(lambda: client.get("/healthz").status_code == 200):
+                print("Server did not start listening")
+                sys.exit(1)
+            listening = time.perf_counter() - start_time
+
+            # Upload straight away; it is processed once the model is ready
+            with open(IMAGE_FILE, "rb") as f:
+                response = client.post("/upload", files={"file": (os.path.basename(IMAGE_FILE), f, "image/jpeg")})
+            print(f"Upload during startup: HTTP {response.status_code}")
+
+            wait_for(lambda: client.get("/healthz").json()["ready"])
+            ready = time.perf_counter() - start_time
+            wait_for(lambda: client.get("/healthz").json()["first_inference_s"] is not None)
+            first_inference = time.perf_counter() - start_time
+            reported = client.get("/healthz").json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"time to listen:          {listening:6.2f}s")
+    print(f"time to model ready:     {ready:6.2f}s")
+    print(f"time to first inference: {first_inference:6.2f}s")
+    print(f"reported by the server (since import of server): {reported}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from inference_pool import InferencePool
+
+# Configuration
+MODEL_PATH = "md_v5a.0.0.pt"
+IMAGE_FILE = "test.jpg"
+MAX_WORKERS = os.cpu_count() or 1
+NUM_JOBS = 48  # Single-image jobs submitted concurrently, as the upload endpoint does
+
+def run(num_workers):
+    pool = InferencePool(MODEL_PATH, num_workers)
+    try:
+        # Load the model in every worker before timing
+        pool.warm_up()
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_workers * 2) as submitters:
+            list(submitters.map(lambda _: pool.infer([IMAGE_FILE]), range(NUM_JOBS)))
+        elapsed = time.perf_counter() - start_time
+    finally:
+        pool.shutdown()
+
+    return NUM_JOBS / elapsed
+
+def main():
+    for path in (MODEL_PATH, IMAGE_FILE):
+        if not os.path.exists(path):
+            print(f"Error: '{path}' not found in current directory.")
+            sys.exit(1)
+
+    print(f"{'workers':>7} {'images/sec':>12}")
+    for num_workers in range(1, MAX_WORKERS + 1):
+        throughput = run(num_workers)
+        print(f"{num_workers:>7} {throughput:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Largest page /detections returns
+MAX_PAGE = 1000
+
+
+def encode_cursor(detected_at, row_id):
+    return f"{detected_at!r}_{row_id}"
+
+def decode_cursor(cursor):
+    """(detected_at, id) of the last row of the previous page; ValueError if malformed."""
+    detected_at, row_id = cursor.rsplit("_", 1)
+    return float(detected_at), int(row_id)
+
+
+class DetectionCatalog:
+    """
+    Indexed record of every detection, so sightings can be queried by time,
+    camera and class instead of by grepping logs and scanning directories.
+
+    One row per image and detected class: camera, cycle, time, class, how many
+    boxes of the class the image had, the boxes with their confidences, the
+    highest confidence, and the received and annotated file names.
+    add() only queues the rows; a background task writes them in batches (one
+    transaction each, off the event loop), so inference never waits for the
+    database. add() is thread-safe, so inference code running in the threadpool
+    can call it. Queries read through their own connection (SQLite in WAL mode,
+    so they do not wait for the writer) and page by (detected_at, id), which
+    the indexes return in order without sorting or skipping rows.
+    """
+    def __init__(self, path, batch=500):
+        self.path = path
+        self.batch = max(1, batch)
+        self.counters = {"rows_written": 0, "batches": 0, "write_errors": 0}
+        self._writer = self._connect()
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            " id INTEGER PRIMARY KEY, detected_at REAL NOT NULL, camera TEXT NOT NULL, cycle_id TEXT,"
+            " class_id INTEGER NOT NULL, class TEXT NOT NULL, count INTEGER NOT NULL, confidence REAL NOT NULL,"
+            " boxes TEXT NOT NULL, filename TEXT NOT NULL, processed_filename TEXT)"
+        )
+        # Every query orders by (detected_at, id); id is the rowid, which each index carries
+        self._writer.execute("CREATE INDEX IF NOT EXISTS detections_time ON detections (detected_at)")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS detections_camera_time ON detections (camera, detected_at)")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS detections_class_time ON detections (class, detected_at)")
+        self._writer.execute(
+            "CREATE INDEX IF NOT EXISTS detections_camera_class_time ON detections (camera, class, detected_at)")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS detections_cycle ON detections (cycle_id)")
+        self._writer.commit()
+        self._reader = self._connect()
+        # Used from the threadpool, one query at a time
+        self._read_lock = threading.Lock()
+        self._queue = None
+        self._loop = None
+        self._task = None
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write whatever is still queued, then close the database."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        rows = []
+        while self._queue is not None and not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+        self._writer.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def pending(self):
+        """Rows queued but not written yet."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {**self.counters, "pending": self.pending()}
+
+    def add(self, camera, cycle_id, filename, detections, names, processed_filename=None, detected_at=None):
+        """
+        Record one image's detections ({'boxes', 'classes', 'confidences'}, as
+        returned by inference); names maps class ids to names. Safe to call from any thread.
+        """
+        detected_at = time.time() if detected_at is None else detected_at
+        by_class = {}
+        for box, cls, conf in zip(detections["boxes"], detections["classes"], detections["confidences"]):
+            by_class.setdefault(cls, []).append([round(v, 1) for v in box] + [round(conf, 3)])
+        rows = [
+            (detected_at, camera, cycle_id, cls, str(names.get(cls, cls)), len(boxes), max(b[4] for b in boxes),
+             json.dumps(boxes), filename, processed_filename)
+            for cls, boxes in by_class.items()
+        ]
+        if not rows:
+            return
+        if self._loop is None:
+            # Not started (e.g. a script using the catalog directly): write right away
+            self._write(rows)
+            return
+        for row in rows:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, row)
+
+    async def _run(self):
+        while True:
+            # Whatever queued up while the previous batch was being written goes in the next one
+            rows = [await self._queue.get()]
+            while len(rows) < self.batch and not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception as e:
+                self.counters["write_errors"] += 1
+                logger.error(f"Failed to write {len(rows)} detection(s) to the catalog: {e}")
+
+    def _write(self, rows):
+        """Blocking: insert rows in one transaction."""
+        with self._writer:
+            self._writer.executemany(
+                "INSERT INTO detections (detected_at, camera, cycle_id, class_id, class, count, confidence,"
+                " boxes, filename, processed_filename) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        self.counters["rows_written"] += len(rows)
+        self.counters["batches"] += 1
+
+    def query(self, start=None, end=None, camera=None, image_class=None, limit=100, cursor=None, cycle_id=None):
+        """
+        Detections in [start, end) (epoch seconds), optionally of one camera,
+        class (by name) and/or cycle, newest first. Blocking.
+        Returns (rows, next cursor or None if this was the last page); pass the
+        cursor back to get the following page.
+        """
+        limit = max(1, min(limit, MAX_PAGE))
+        conditions, params = [], []
+        if camera is not None:
+            conditions.append("camera = ?")
+            params.append(camera)
+        if image_class is not None:
+            conditions.append("class = ?")
+            params.append(image_class)
+        if cycle_id is not None:
+            conditions.append("cycle_id = ?")
+            params.append(cycle_id)
+        if start is not None:
+            conditions.append("detected_at >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("detected_at < ?")
+            params.append(end)
+        if cursor is not None:
+            conditions.append("(detected_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT id, detected_at, camera, cycle_id, class_id, class, count, confidence, boxes,"
+                f" filename, processed_filename FROM detections{where}"
+                " ORDER BY detected_at DESC, id DESC LIMIT ?",
+                params + [limit + 1],
+            ).fetchall()
+        detections = [
+            {"id": row[0], "detected_at": row[1], "camera": row[2], "cycle_id": row[3], "class_id": row[4],
+             "class": row[5], "count": row[6], "confidence": row[7], "boxes": json.loads(row[8]),
+             "filename": row[9], "processed_filename": row[10]}
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = detections[-1]
+            next_cursor = encode_cursor(last["detected_at"], last["id"])
+        return detections, next_cursor
@@ -0,0 +1,206 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+from wild_animals_shared.jpeg import REDUCED_DECODE_FLAGS, jpeg_size, reduction_for
+
+logger = logging.getLogger(__name__)
+
+# Input size the model is run at (ultralytics' default imgsz)
+INFERENCE_SIZE = 640
+
+# Loaded once per worker process by _init_worker
+_model = None
+
+
+def _init_worker(model_path: str, num_threads: int):
+    global _model
+    # Imported here so the front-end process never pays for torch/ultralytics
+    import torch
+    from ultralytics import YOLO
+    # Split the cores between workers instead of every worker using all of them
+    torch.set_num_threads(num_threads)
+    _model = YOLO(model_path)
+
+
+def download_model(model_path: str, url: str, cancel=None):
+    """
+    Download the model weights to model_path unless they are already there.
+    cancel, a threading.Event, stops the download (raising InterruptedError) once set.
+    """
+    if os.path.exists(model_path):
+        return
+    logger.info(f"Model not found. Downloading from {url}...")
+    import requests
+    # Downloaded under another name first, so an interrupted download is never taken for the model
+    part_path = f"{model_path}.part"
+    try:
+        with requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if cancel is not None and cancel.is_set():
+                        raise InterruptedError("Model download cancelled")
+                    f.write(chunk)
+        os.replace(part_path, model_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    logger.info("Model downloaded successfully.")
+
+
+def animal_classes(names: dict):
+    """
+    Class ids of the model's animal classes (MegaDetector v5: 0 animal, 1 person, 2 vehicle);
+    class 0 if no class is named like one.
+    """
+    classes = [k for k, v in names.items() if 'animal' in v.lower()]
+    if not classes:
+        logger.warning("'animal' class not found in model names. Defaulting to class 0.")
+        classes = [0]
+    return classes
+
+
+def _read(source):
+    """Bytes of an image given by path, or the bytes themselves (e.g. read from a packed segment)."""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def load_reduced(image_path, target: int = INFERENCE_SIZE):
+    """
+    Decode a JPEG at the smallest 1/2, 1/4 or 1/8 scale whose long side still
+    reaches target pixels, without building the full-size image first.
+    Returns (image, scale): multiply image coordinates by scale for full-resolution pixels.
+    """
+    data = _read(image_path)
+    size = jpeg_size(data)
+    factor = reduction_for(*size, target) if size else 1
+    flag = REDUCED_DECODE_FLAGS.get(factor, cv2.IMREAD_COLOR)
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if image is None:
+        raise ValueError(f"Could not read image {image_path if isinstance(image_path, str) else '(bytes)'}")
+    # Long sides, since EXIF orientation may have rotated the decoded image
+    scale = max(size) / max(image.shape[:2]) if size else 1.0
+    return image, scale
+
+
+def _model_names():
+    return dict(_model.names)
+
+
+def _warm_up(conf: float):
+    """Dummy inference so the first real one does not pay for setup."""
+    import numpy as np
+    _model(np.zeros((640, 640, 3), dtype=np.uint8), conf=conf, verbose=False)
+
+
+def _run_inference(image_paths: list, conf: float, reduced_decode: bool = True):
+    """
+    Run one batched inference in a worker and return plain, picklable detections:
+    one {'boxes': [[x1, y1, x2, y2], ...], 'classes': [int], 'confidences': [float], 'decode_s': float}
+    per image, in full-resolution pixels even when the images were decoded at reduced size.
+    Images are given by path or as JPEG bytes.
+    """
+    inputs, scales, decode_times = [], [], []
+    for path in image_paths:
+        start_time = time.perf_counter()
+        if reduced_decode:
+            image, scale = load_reduced(path)
+        else:
+            image, scale = cv2.imdecode(np.frombuffer(_read(path), dtype=np.uint8), cv2.IMREAD_COLOR), 1.0
+            if image is None:
+                raise ValueError("Could not read image")
+        decode_times.append(time.perf_counter() - start_time)
+        inputs.append(image)
+        scales.append(scale)
+    results = _model(inputs, conf=conf, batch=len(image_paths), verbose=False)
+    detections = []
+    for result, scale, decode_s in zip(results, scales, decode_times):
+        boxes = result.boxes
+        detections.append({
+            "decode_s": decode_s,
+            "boxes": (boxes.xyxy * scale).tolist(),
+            "classes": [int(c) for c in boxes.cls.tolist()],
+            "confidences": [float(c) for c in boxes.conf.tolist()],
+        })
+    return detections
+
+
+class InferencePool:
+    """
+    Pool of worker processes that each load the model once and run inference jobs.
+
+    Jobs are submitted from the FastAPI threadpool and run in parallel across
+    processes, so throughput scales with cores instead of being bound to one
+    process. If a worker dies, the pool is rebuilt and the interrupted job is
+    retried once. With reduced_decode, workers decode JPEGs at the smallest
+    DCT scale that still covers the model input instead of at full size.
+    """
+    def __init__(self, model_path: str, num_workers: int, conf: float = 0.25, reduced_decode: bool = True):
+        self.model_path = model_path
+        self.num_workers = max(1, num_workers)
+        self.conf = conf
+        self.reduced_decode = reduced_decode
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._names = None
+
+    def _new_executor(self):
+        # spawn: workers must not inherit the parent's threads or CUDA state
+        return ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_path, max(1, (os.cpu_count() or 1) // self.num_workers)),
+        )
+
+    def _restart(self, broken):
+        with self._lock:
+            # Another thread may already have replaced the broken executor
+            if self._executor is broken:
+                logger.error("Inference worker crashed, restarting the pool")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+                self.restarts += 1
+
+    def _call(self, fn, *args):
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                return executor.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._restart(executor)
+                if attempt == 1:
+                    raise
+
+    @property
+    def names(self):
+        """Class id -> name mapping of the loaded model."""
+        if self._names is None:
+            self._names = self._call(_model_names)
+        return self._names
+
+    def infer(self, image_paths: list):
+        """Blocking: run inference on a batch of images and return their detections."""
+        return self._call(_run_inference, list(image_paths), self.conf, self.reduced_decode)
+
+    def warm_up(self):
+        """Start every worker, load its model and run a dummy inference before the first real job."""
+        futures = [self._executor.submit(_warm_up, self.conf) for _ in range(self.num_workers)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        return {"workers": self.num_workers, "restarts": self.restarts}
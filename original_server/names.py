@@ -0,0 +1,21 @@
+import os
+import re
+
+# Camera (MAC) and cycle ("{MAC}-{SEQ}") parts of "{MAC}-{SEQ}[-{Index}{n|d}]". Stored names carry
+# a "YYYYMMDD_HHMMSS_ffffff_" prefix per hop: the gateway's, then ours for forwarded images
+CAMERA_PATTERN = re.compile(r"^(?:\d{8}_\d{6}_\d{6}_)*(?P<cycle>(?P<camera>[0-9A-Za-z]+)-\d+)")
+
+
+def camera_of(cycle_or_filename: str):
+    """
+    Camera (MAC) part of a Cycle ID "{MAC}-{SEQ}" or of an uploaded file name
+    "[TIMESTAMP_...]{MAC}-{SEQ}-{Index}{n|d}.jpg"; used to group notifications.
+    """
+    match = CAMERA_PATTERN.search(os.path.basename(cycle_or_filename))
+    return match.group("camera") if match else "unknown"
+
+
+def cycle_of(filename: str):
+    """Cycle ID "{MAC}-{SEQ}" of an uploaded file name, or None if it does not follow the naming."""
+    match = CAMERA_PATTERN.search(os.path.basename(filename))
+    return match.group("cycle") if match else None
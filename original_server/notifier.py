@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from email.message import EmailMessage
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+
+class Digest:
+    """Detections for one key (camera) waiting to be sent as one email."""
+    def __init__(self, key):
+        self.key = key
+        self.opened_at = time.monotonic()
+        self.counts = {}
+        self.attachments = []
+        self.details = []
+
+    def add(self, counts, attachments, details):
+        for label, count in counts.items():
+            # Report the largest count seen in any single detection
+            self.counts[label] = max(self.counts.get(label, 0), count)
+        self.attachments.extend(attachments)
+        if details:
+            self.details.append(details)
+
+
+class Notifier:
+    """
+    Email notifications, sent from a background task over one persistent SMTP session.
+
+    Detections reported with the same key (typically the camera) within
+    digest_window seconds are coalesced into a single email carrying all of their
+    images. At most max_per_hour emails are sent; digests that would exceed the
+    limit keep collecting detections until they can go out.
+    notify() is thread-safe, so inference code running in the threadpool can call it.
+    observe(stage, seconds), if given, receives the time taken by every email sent.
+    """
+    def __init__(self, host, port, sender, password, recipient, digest_window=60.0,
+                 max_per_hour=12, start_tls=True, timeout=30.0, observe=None):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.recipient = recipient
+        self.digest_window = digest_window
+        self.max_per_hour = max(1, max_per_hour)
+        self.start_tls = start_tls
+        self.timeout = timeout
+        self.observe = observe
+        self.counters = {"detections": 0, "emails_sent": 0, "emails_failed": 0, "rate_limited": 0}
+        self.digests = {}
+        self._sent_at = deque()
+        self._smtp = None
+        self._queue = None
+        self._loop = None
+        self._task = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Send whatever is still waiting in a digest, then close the SMTP session."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            self._add(*self._queue.get_nowait())
+        for key in list(self.digests):
+            await self._flush(key, force=True)
+        await self._disconnect()
+
+    def stats(self):
+        return {**self.counters, "open_digests": len(self.digests)}
+
+    def notify(self, key, counts, attachments, details=""):
+        """
+        Report a detection: counts is {label: count}, attachments are image paths.
+        Safe to call from any thread.
+        """
+        if self._loop is None:
+            logger.warning("Email configuration not set. Skipping email send.")
+            return
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (key, counts, list(attachments), details))
+
+    def _add(self, key, counts, attachments, details):
+        self.counters["detections"] += 1
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = Digest(key)
+        digest.add(counts, attachments, details)
+
+    async def _run(self):
+        while True:
+            # Wake up for new detections, or when the oldest digest is due
+            timeout = None
+            if self.digests:
+                oldest = min(d.opened_at for d in self.digests.values())
+                timeout = max(0.0, oldest + self.digest_window - time.monotonic())
+            try:
+                self._add(*await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.monotonic()
+            for key, digest in list(self.digests.items()):
+                if now - digest.opened_at >= self.digest_window:
+                    await self._flush(key)
+
+    def _rate_limited(self):
+        now = time.monotonic()
+        while self._sent_at and now - self._sent_at[0] > 3600:
+            self._sent_at.popleft()
+        return len(self._sent_at) >= self.max_per_hour
+
+    async def _flush(self, key, force=False):
+        digest = self.digests[key]
+        if not force and self._rate_limited():
+            # Keep collecting; try again one window later
+            self.counters["rate_limited"] += 1
+            logger.warning(f"Email rate limit reached ({self.max_per_hour}/h), holding digest for {key}")
+            digest.opened_at = time.monotonic()
+            return
+
+        del self.digests[key]
+        message = self._build_message(digest)
+        try:
+            start_time = time.monotonic()
+            await self._send(message)
+            if self.observe is not None:
+                self.observe("email", time.monotonic() - start_time)
+            self._sent_at.append(time.monotonic())
+            self.counters["emails_sent"] += 1
+            logger.info(f"Email sent to {self.recipient} ({len(digest.attachments)} image(s) for {key})")
+        except Exception as e:
+            self.counters["emails_failed"] += 1
+            logger.error(f"Failed to send email: {e}")
+
+    def _build_message(self, digest):
+        counts_str = ", ".join([f"{label}: {count}" for label, count in digest.counts.items()])
+        msg = EmailMessage()
+        msg['Subject'] = f"Wild Animal Detected: {counts_str}"
+        msg['From'] = self.sender
+        msg['To'] = self.recipient
+        details = "\n\n".join(digest.details)
+        msg.set_content(
+            f"Detected animals:\n{counts_str}\n\n"
+            f"Camera: {digest.key}\n\n"
+            f"{details}\n\n"
+            f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+
+        for attachment_path in digest.attachments:
+            try:
+                with open(attachment_path, 'rb') as f:
+                    file_data = f.read()
+                msg.add_attachment(file_data, maintype='image', subtype='jpeg', filename=os.path.basename(attachment_path))
+            except Exception as e:
+                logger.error(f"Failed to attach image: {e}")
+        return msg
+
+    async def _connect(self):
+        smtp = aiosmtplib.SMTP(hostname=self.host, port=self.port, start_tls=self.start_tls, timeout=self.timeout)
+        await smtp.connect()
+        if self.password:
+            await smtp.login(self.sender, self.password)
+        self._smtp = smtp
+
+    async def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                await self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    async def _send(self, message):
+        # Reuse the session; if the server dropped it in the meantime, reconnect once
+        for attempt in range(2):
+            if self._smtp is None or not self._smtp.is_connected:
+                await self._connect()
+            try:
+                await self._smtp.send_message(message)
+                return
+            except aiosmtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt == 1:
+                    raise
@@ -1,13 +1,26 @@
+import time
+
+# Process start, for the startup timings reported by /healthz
+STARTED_AT = time.perf_counter()
+
 import os
+import json
 import logging
-import smtplib
-from email.message import EmailMessage
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks, Header, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from ultralytics import YOLO
 import cv2
 import asyncio
+import threading
+from catalog import DetectionCatalog
+from inference_pool import InferencePool, download_model, animal_classes
+from names import camera_of, cycle_of
+from notifier import Notifier
+from wild_animals_shared.storage import ImageStore, CLASS_ANIMAL, CLASS_EMPTY
+from wild_animals_shared.telemetry import Registry, setup_logging, trace_id, traced
 
 # Load environment variables
 load_dotenv()
@@ -20,150 +33,333 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SENDER_EMAIL = os.getenv("SENDER_EMAIL", "your_email@example.com")
 SENDER_PASSWORD = os.getenv("SENDER_PASSWORD", "your_password")
 RECIPIENT_EMAIL = os.getenv("RECIPIENT_EMAIL", "recipient@example.com")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+# Detections from one camera within NOTIFY_DIGEST_SECONDS go out as one email;
+# at most NOTIFY_MAX_PER_HOUR emails are sent
+NOTIFY_DIGEST_SECONDS = float(os.getenv("NOTIFY_DIGEST_SECONDS", 60))
+NOTIFY_MAX_PER_HOUR = int(os.getenv("NOTIFY_MAX_PER_HOUR", 12))
 
 # MegaDetector v5a Configuration
 MODEL_URL = "https://github.com/ecology-tech/MegaDetector/releases/download/v5.0/md_v5a.0.0.pt"
 MODEL_PATH = "md_v5a.0.0.pt"
+CONFIDENCE_THRESHOLD = 0.25
+
+# Number of inference worker processes, each holding its own copy of the model
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Decode images at 1/2, 1/4 or 1/8 scale (whichever still covers the model input) instead of full size
+INFERENCE_REDUCED_DECODE = os.getenv("INFERENCE_REDUCED_DECODE", "true").lower() in ("1", "true", "yes")
+# Seconds shutdown waits for a model still loading in the workers (a download is stopped right away)
+MODEL_SHUTDOWN_TIMEOUT = 10
+
+# Received images are stored under UPLOAD_DIR/YYYYMMDD/<camera>/ (annotated ones likewise
+# under PROCESSED_DIR) and kept RETAIN_ANIMAL_DAYS if MegaDetector found animals in them,
+# RETAIN_EMPTY_HOURS if not, RETAIN_UNCLASSIFIED_DAYS if never analyzed (0 keeps them).
+# Below STORAGE_MIN_FREE_MB free, the oldest are deleted early, empty ones first.
+# Analyzed images older than STORAGE_PACK_AFTER_HOURS are packed into one segment file per day (0 disables packing)
+RETAIN_ANIMAL_DAYS = float(os.getenv("RETAIN_ANIMAL_DAYS", 365))
+RETAIN_EMPTY_HOURS = float(os.getenv("RETAIN_EMPTY_HOURS", 168))
+RETAIN_UNCLASSIFIED_DAYS = float(os.getenv("RETAIN_UNCLASSIFIED_DAYS", 30))
+STORAGE_MIN_FREE_MB = int(os.getenv("STORAGE_MIN_FREE_MB", 2048))
+STORAGE_PACK_AFTER_HOURS = float(os.getenv("STORAGE_PACK_AFTER_HOURS", 24))
+STORAGE_SWEEP_INTERVAL = int(os.getenv("STORAGE_SWEEP_INTERVAL", 600))
+
+# Every detection is recorded in this SQLite catalog (queried with /detections),
+# up to CATALOG_BATCH rows per transaction
+CATALOG_PATH = os.getenv("CATALOG_PATH", "detections.sqlite3")
+CATALOG_BATCH = int(os.getenv("CATALOG_BATCH", 500))
 
 # Ensure directories exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-# Logging setup
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+# Logging setup: records are queued and written by a background thread
+log_listener = setup_logging(logging.StreamHandler())
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-
-def download_model_if_needed():
-    """Download MegaDetector model if not present."""
-    if not os.path.exists(MODEL_PATH):
-        logger.info(f"Model not found. Downloading from {MODEL_URL}...")
-        import requests
-        try:
-            response = requests.get(MODEL_URL, stream=True)
-            response.raise_for_status()
-            with open(MODEL_PATH, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            logger.info("Model downloaded successfully.")
-        except Exception as e:
-            logger.error(f"Failed to download model: {e}")
-            raise
-
-# Load Model (MegaDetector)
-# Note: Ultralytics YOLOv8 can load valid YOLOv5 models.
-download_model_if_needed()
-try:
-    model = YOLO(MODEL_PATH) 
-    logger.info(f"Model loaded. Classes: {model.names}")
-except Exception as e:
-    logger.error(f"Failed to load model: {e}")
-    raise
-
-# MegaDetector v5 classes:
-# 0: animal (detection)
-# 1: person
-# 2: vehicle
-# dynamic check for 'animal' class
+
+def days(value):
+    """Seconds in value days; None (keep forever) for 0."""
+    return value * 86400 if value > 0 else None
+
+def image_store(root):
+    return ImageStore(root, os.path.join(root, "storage.sqlite3"), retain={
+        CLASS_ANIMAL: days(RETAIN_ANIMAL_DAYS),
+        CLASS_EMPTY: days(RETAIN_EMPTY_HOURS / 24),
+        None: days(RETAIN_UNCLASSIFIED_DAYS),
+    }, min_free_bytes=STORAGE_MIN_FREE_MB * 1024 * 1024, pack_after=days(STORAGE_PACK_AFTER_HOURS / 24))
+
+received_store = image_store(UPLOAD_DIR)
+processed_store = image_store(PROCESSED_DIR)
+
+# Detections by time, camera and class, written in batches by a background task
+catalog = DetectionCatalog(CATALOG_PATH, batch=CATALOG_BATCH)
+
+# Prometheus metrics, served on /metrics
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "wild_animals_server_stage_seconds", "Time spent per pipeline stage (upload, decode, inference, email)", ["stage"])
+IMAGES = metrics.counter("wild_animals_server_images_total", "Images analyzed, per camera", ["camera"])
+VERDICTS = metrics.counter("wild_animals_server_verdicts_total", "Images per camera and verdict (animal, empty)",
+                           ["camera", "verdict"])
+INFERENCE_INFLIGHT = metrics.gauge("wild_animals_server_inference_inflight", "Inference jobs submitted to the worker pool")
+INFERENCE_INFLIGHT.set(0)
+metrics.gauge("wild_animals_server_inference_workers", "Inference worker processes",
+              function=lambda: INFERENCE_WORKERS)
+metrics.gauge("wild_animals_server_open_digests", "Notification digests waiting to be emailed",
+              function=lambda: len(notifier.digests))
+metrics.gauge("wild_animals_server_storage_free_bytes", "Free space on the image storage volume",
+              function=lambda: received_store.free_bytes())
+metrics.gauge("wild_animals_server_catalog_pending", "Detections waiting to be written to the catalog",
+              function=lambda: catalog.pending())
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Listen right away; uploads are saved and wait for the model, which loads in the background
+    model_task = asyncio.create_task(asyncio.to_thread(load_model))
+    storage_task = asyncio.create_task(maintain_storage())
+    await catalog.start()
+    if SENDER_EMAIL == "your_email@example.com":
+        logger.warning("Email configuration not set. Notifications will not be sent.")
+    else:
+        await notifier.start()
+    startup["listening_s"] = round(time.perf_counter() - STARTED_AT, 3)
+    logger.info(f"Listening after {startup['listening_s']}s, loading model in the background")
+    yield
+    storage_task.cancel()
+    try:
+        await storage_task
+    except asyncio.CancelledError:
+        pass
+    shutting_down.set()
+    try:
+        await asyncio.wait_for(asyncio.shield(model_task), MODEL_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Model still loading after {MODEL_SHUTDOWN_TIMEOUT}s, shutting down without it")
+    if inference_pool is not None:
+        inference_pool.shutdown()
+    await notifier.stop()
+    await catalog.stop()
+    received_store.close()
+    processed_store.close()
+    log_listener.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+async def maintain_storage():
+    """Periodically apply image retention and pack analyzed images, off the event loop."""
+    while True:
+        for store in (received_store, processed_store):
+            try:
+                await asyncio.to_thread(store.sweep)
+            except Exception as e:
+                logger.error(f"Storage sweep of {store.root} failed: {e}")
+        await asyncio.sleep(STORAGE_SWEEP_INTERVAL)
+
+# Email notifications, coalesced per camera and sent over one SMTP session
+notifier = Notifier(SMTP_SERVER, SMTP_PORT, SENDER_EMAIL, SENDER_PASSWORD, RECIPIENT_EMAIL,
+                    digest_window=NOTIFY_DIGEST_SECONDS, max_per_hour=NOTIFY_MAX_PER_HOUR, start_tls=SMTP_STARTTLS,
+                    observe=observe)
+
+# Set by load_model() at startup
+inference_pool = None
+MODEL_NAMES = {}
 ANIMAL_CLASSES = []
-for k, v in model.names.items():
-    if 'animal' in v.lower():
-        ANIMAL_CLASSES.append(k)
-        
-if not ANIMAL_CLASSES:
-    logger.warning("'animal' class not found in model names. Defaulting to class 0.")
-    ANIMAL_CLASSES = [0]
-    
-logger.info(f"Animal classes set to: {ANIMAL_CLASSES}")
+# Set once load_model() has finished, successfully or not
+model_loaded = threading.Event()
+# Set at shutdown, so a model download still running stops
+shutting_down = threading.Event()
+# Model state ("loading", "ready" or "failed") and startup timings, in seconds since process start
+startup = {"model": "loading", "listening_s": None, "model_ready_s": None, "first_inference_s": None}
 
-def send_email(subject: str, body: str, attachment_path: str = None):
+def load_model():
     """
-    Send an email notification with an optional image attachment.
+    Load Model (MegaDetector) in the inference worker processes.
+    Runs at startup rather than import time: with the spawn start method the
+    workers re-import this module, and must not start pools of their own.
     """
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = SENDER_EMAIL
-    msg['To'] = RECIPIENT_EMAIL
-    msg.set_content(body)
-
-    if attachment_path:
-        try:
-            with open(attachment_path, 'rb') as f:
-                file_data = f.read()
-                file_name = os.path.basename(attachment_path)
-            
-            msg.add_attachment(file_data, maintype='image', subtype='jpeg', filename=file_name)
-        except Exception as e:
-            logger.error(f"Failed to attach image: {e}")
+    global inference_pool, MODEL_NAMES, ANIMAL_CLASSES
 
     try:
-        if SENDER_EMAIL == "your_email@example.com":
-            logger.warning("Email configuration not set. Skipping email send.")
-            return
-
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-            smtp.starttls()
-            smtp.login(SENDER_EMAIL, SENDER_PASSWORD)
-            smtp.send_message(msg)
-        logger.info(f"Email sent to {RECIPIENT_EMAIL}")
+        # Note: Ultralytics YOLOv8 can load valid YOLOv5 models.
+        download_model(MODEL_PATH, MODEL_URL, cancel=shutting_down)
+        if shutting_down.is_set():
+            raise InterruptedError("Shutting down")
+        inference_pool = InferencePool(MODEL_PATH, INFERENCE_WORKERS, conf=CONFIDENCE_THRESHOLD,
+                                       reduced_decode=INFERENCE_REDUCED_DECODE)
+        MODEL_NAMES = inference_pool.names
+        # Loads the model and runs a dummy inference in every worker
+        inference_pool.warm_up()
+        logger.info(f"Model loaded in {INFERENCE_WORKERS} worker(s). Classes: {MODEL_NAMES}")
     except Exception as e:
-        logger.error(f"Failed to send email: {e}")
+        logger.error(f"Failed to load model: {e}")
+        startup["model"] = "failed"
+        model_loaded.set()
+        return
+
+    ANIMAL_CLASSES = animal_classes(MODEL_NAMES)
+    logger.info(f"Animal classes set to: {ANIMAL_CLASSES}")
+    startup["model"] = "ready"
+    startup["model_ready_s"] = round(time.perf_counter() - STARTED_AT, 3)
+    model_loaded.set()
+
+def infer(image_paths: list):
+    """
+    Run inference in the worker pool, first waiting for the model if it is still loading.
+    Called from the threadpool (background tasks), so blocking here is fine.
+    """
+    model_loaded.wait()
+    if startup["model"] != "ready":
+        raise RuntimeError("Model failed to load")
+    INFERENCE_INFLIGHT.inc()
+    start_time = time.perf_counter()
+    try:
+        detections = inference_pool.infer(image_paths)
+    finally:
+        INFERENCE_INFLIGHT.dec()
+    observe("inference", time.perf_counter() - start_time)
+    for image_detections in detections:
+        observe("decode", image_detections["decode_s"])
+    if startup["first_inference_s"] is None:
+        startup["first_inference_s"] = round(time.perf_counter() - STARTED_AT, 3)
+    return detections
 
-def process_and_notify(image_path: str, filename: str):
+def parse_time(value: Optional[str]):
+    """Epoch seconds from epoch seconds or an ISO 8601 date/time (local time unless it has an offset)."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def draw_detections(image_path: str, detections: dict, output_path: str):
+    """
+    Draw every detection (including people/vehicles, which are useful context)
+    onto the image and save it.
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not read image {image_path}")
+
+    for (x1, y1, x2, y2), cls, conf in zip(detections["boxes"], detections["classes"], detections["confidences"]):
+        color = (0, 0, 255) if cls in ANIMAL_CLASSES else (255, 128, 0)
+        top_left, bottom_right = (int(x1), int(y1)), (int(x2), int(y2))
+        cv2.rectangle(image, top_left, bottom_right, color, 2)
+        text = f"{MODEL_NAMES.get(cls, cls)} {conf:.2f}"
+        cv2.putText(image, text, (top_left[0], max(top_left[1] - 6, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+    cv2.imwrite(output_path, image)
+
+def analyze_detections(detections: dict, image_path: str, filename: str, camera: str, cycle_id: str = None):
+    """
+    Count the animals in one image's detections, record them in the catalog and,
+    if there are animals, save the annotated image. Returns (detected_animals, processed_path or None).
+    camera labels the per-camera metrics and picks the storage shard; camera and
+    cycle_id (None if unknown) are recorded with the detections as given.
+    """
+    detected_animals = {}
+
+    for cls in detections["classes"]:
+        if cls in ANIMAL_CLASSES:
+            label = MODEL_NAMES[cls]
+            detected_animals[label] = detected_animals.get(label, 0) + 1
+
+    IMAGES.inc(camera=camera)
+    VERDICTS.inc(camera=camera, verdict="animal" if detected_animals else "empty")
+    received_store.classify([filename], CLASS_ANIMAL if detected_animals else CLASS_EMPTY)
+
+    if not detected_animals:
+        logger.info(f"No animals detected in {filename}")
+        # People and vehicles are still worth finding later
+        catalog.add(camera, cycle_id, filename, detections, MODEL_NAMES)
+        return detected_animals, None
+
+    # Save annotated image if animal found
+    processed_filename = f"processed_{filename}"
+    processed_path = processed_store.path_for(processed_filename, camera)
+    draw_detections(image_path, detections, processed_path)
+    processed_store.add(processed_filename, processed_path, camera, CLASS_ANIMAL)
+    catalog.add(camera, cycle_id, filename, detections, MODEL_NAMES, processed_filename)
+    logger.info(f"Animal detected! Saved annotated image to {processed_path}")
+    return detected_animals, processed_path
+
+def process_and_notify(image_path: str, filename: str, trace: str = None):
     """
     Perform inference on the image and send notification if animals are detected.
     """
+    with traced(trace):
+        _process_and_notify(image_path, filename)
+
+def _process_and_notify(image_path: str, filename: str):
     logger.info(f"Processing {filename}...")
     
-    # Run inference with confidence threshold
-    results = model(image_path, conf=0.25)
-    
-    detected_animals = {}
-    animal_found = False
+    # Run inference (in a worker process) with confidence threshold
+    detections = infer([image_path])
     
-    for result in results:
-        boxes = result.boxes
-        for box in boxes:
-            cls = int(box.cls[0])
-            if cls in ANIMAL_CLASSES:
-                animal_found = True
-                label = model.names[cls]
-                detected_animals[label] = detected_animals.get(label, 0) + 1
-        
-        # Save annotated image if animal found
-        if animal_found:
-            processed_filename = f"processed_{filename}"
-            processed_path = os.path.join(PROCESSED_DIR, processed_filename)
-            
-            # plot() returns the image as a numpy array. 
-            # We filter by passing only the classes we want to visualize? 
-            # Ultralytics plot() doesn't always support class filtering directly in all versions, 
-            # but we can try to rely on the fact that result contains all boxes.
-            # To be safe and clean, we just plot all detections (including people/vehicles) as that can be useful context.
-            annotated_frame = result.plot()
-            
-            cv2.imwrite(processed_path, annotated_frame)
-            logger.info(f"Animal detected! Saved annotated image to {processed_path}")
-            
-            # Prepare email body
-            counts_str = ", ".join([f"{label}: {count}" for label, count in detected_animals.items()])
-            subject = f"Wild Animal Detected: {counts_str}"
-            body = f"Detected animals:\n{counts_str}\n\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            
-            # Send email
-            send_email(subject, body, processed_path)
-        else:
-            logger.info(f"No animals detected in {filename}")
+    camera, cycle_id = camera_of(filename), cycle_of(filename)
+    for image_detections in detections:
+        detected_animals, processed_path = analyze_detections(image_detections, image_path, filename, camera, cycle_id)
+        if processed_path:
+            # Coalesced with other detections from the same camera into one email
+            notifier.notify(camera, detected_animals, [processed_path], f"Image: {filename}")
+
+def process_cycle_and_notify(cycle_id: str, image_paths: list, filenames: list, gateway_verdicts: list, trace: str = None):
+    """
+    Run MegaDetector over all images of a cycle as one batch and send a single
+    notification for the cycle if any of them contains animals.
+    """
+    with traced(trace or cycle_id):
+        _process_cycle_and_notify(cycle_id, image_paths, filenames, gateway_verdicts)
+
+def _process_cycle_and_notify(cycle_id: str, image_paths: list, filenames: list, gateway_verdicts: list):
+    logger.info(f"Processing cycle {cycle_id} ({len(image_paths)} images)...")
+
+    detections = infer(image_paths)
+
+    # The manifest's Cycle ID names the camera, whatever the file names look like
+    camera = camera_of(cycle_id)
+    cycle_animals = {}
+    attachments = []
+    for image_detections, image_path, filename in zip(detections, image_paths, filenames):
+        detected_animals, processed_path = analyze_detections(image_detections, image_path, filename, camera, cycle_id)
+        for label, count in detected_animals.items():
+            # Report the largest count seen in any single frame of the cycle
+            cycle_animals[label] = max(cycle_animals.get(label, 0), count)
+        if processed_path:
+            attachments.append(processed_path)
+
+    if not attachments:
+        logger.info(f"No animals detected in cycle {cycle_id}")
+        return
+
+    gateway_lines = "\n".join(
+        f"  {v.get('filename')}: {'animal' if v.get('is_animal') else ('skipped' if v.get('is_animal') is None else 'none')}"
+        + (f" ({v['label']})" if v.get('label') else "")
+        for v in gateway_verdicts
+    )
+    details = (
+        f"Cycle: {cycle_id} ({len(attachments)}/{len(image_paths)} images with animals)\n"
+        f"Gateway (YOLOv8n) verdicts:\n{gateway_lines}"
+    )
+    notifier.notify(camera, cycle_animals, attachments, details)
 
 @app.post("/upload")
-async def upload_image(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_image(background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                       x_trace_id: Optional[str] = Header(None)):
     """
     Receive image, save it, and trigger processing.
+    X-Trace-Id is the gateway's Cycle ID; it tags every log line about the image.
     """
+    start_time = time.perf_counter()
+    trace_id.set(x_trace_id or "-")
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     filename = f"{timestamp}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    camera = camera_of(filename)
+    file_path = received_store.path_for(filename, camera)
     
     logger.info(f"Receiving image: {filename}")
     
@@ -171,15 +367,98 @@ async def upload_image(background_tasks: BackgroundTasks, file: UploadFile = Fil
         with open(file_path, "wb") as buffer:
             while content := await file.read(1024 * 1024):
                 buffer.write(content)
+        received_store.add(filename, file_path, camera)
+        observe("upload", time.perf_counter() - start_time)
         
         # Trigger background processing
-        background_tasks.add_task(process_and_notify, file_path, filename)
+        background_tasks.add_task(process_and_notify, file_path, filename, x_trace_id)
         
         return {"status": "ok", "message": "Image received and processing started"}
     except Exception as e:
         logger.error(f"Failed to save image: {e}")
         return {"status": "error", "message": str(e)}
 
+@app.post("/upload_cycle")
+async def upload_cycle(background_tasks: BackgroundTasks, manifest: str = Form(...), files: List[UploadFile] = File(...),
+                       x_trace_id: Optional[str] = Header(None)):
+    """
+    Receive every image of a cycle in one request, together with the gateway's
+    verdicts, and trigger one batched inference for the whole cycle.
+
+    manifest is JSON: {"cycle_id": str, "images": [{"filename", "index", "is_animal", "label"}, ...]}
+    X-Trace-Id (the Cycle ID, if absent) tags every log line about the cycle.
+    """
+    start_time = time.perf_counter()
+    try:
+        info = json.loads(manifest)
+        cycle_id = str(info["cycle_id"])
+        gateway_verdicts = list(info.get("images", []))
+    except (ValueError, KeyError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": f"Invalid manifest: {e}"})
+    trace_id.set(x_trace_id or cycle_id)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    camera = camera_of(cycle_id)
+    image_paths = []
+    filenames = []
+
+    logger.info(f"Receiving cycle {cycle_id}: {len(files)} images")
+
+    try:
+        for file in files:
+            filename = f"{timestamp}_{os.path.basename(file.filename)}"
+            file_path = received_store.path_for(filename, camera)
+            with open(file_path, "wb") as buffer:
+                while content := await file.read(1024 * 1024):
+                    buffer.write(content)
+            received_store.add(filename, file_path, camera)
+            image_paths.append(file_path)
+            filenames.append(filename)
+    except Exception as e:
+        logger.error(f"Failed to save cycle {cycle_id}: {e}")
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+    observe("upload", time.perf_counter() - start_time)
+
+    background_tasks.add_task(process_cycle_and_notify, cycle_id, image_paths, filenames, gateway_verdicts, x_trace_id)
+
+    return {"status": "ok", "message": f"Cycle {cycle_id} received and processing started"}
+
+@app.get("/detections")
+async def detections(start: Optional[str] = None, end: Optional[str] = None, camera: Optional[str] = None,
+                     image_class: Optional[str] = Query(None, alias="class"), cycle: Optional[str] = None,
+                     limit: int = 100, cursor: Optional[str] = None):
+    """
+    Recorded detections, newest first, in pages of up to limit (at most 1000).
+    start/end bound the detection time (epoch seconds or ISO 8601; end excluded),
+    camera is the MAC, class a model class name (e.g. "animal") and cycle a Cycle ID "{MAC}-{SEQ}".
+    Pass the returned next_cursor as cursor for the following page; it is null on the last page.
+    """
+    try:
+        start_s, end_s = parse_time(start), parse_time(end)
+        rows, next_cursor = await asyncio.to_thread(catalog.query, start_s, end_s, camera, image_class, limit, cursor,
+                                                    cycle)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": f"Invalid query: {e}"})
+    return {"detections": rows, "next_cursor": next_cursor}
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Uploads are accepted while the model is still loading; "ready" tells
+    whether inference is running yet. Fails only if the model could not be loaded.
+    """
+    if startup["model"] == "failed":
+        return JSONResponse(status_code=503, content={"status": "error", "ready": False, **startup})
+    return {"status": "ok", "ready": startup["model"] == "ready", **startup}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Metrics in the Prometheus text format: per-stage latency histograms,
+    per-camera image/verdict counters and inference saturation gauges.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
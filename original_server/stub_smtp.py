@@ -0,0 +1,78 @@
+import sys
+import asyncio
+import email
+from email import policy
+
+
+class StubSMTPServer:
+    """
+    Minimal local SMTP sink for tests and benchmarks: accepts every message
+    (no TLS, any AUTH) and keeps the parsed messages in memory.
+    """
+    def __init__(self, host="127.0.0.1", port=1025):
+        self.host = host
+        self.port = port
+        self.messages = []
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+
+        async def reply(line):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 stub ESMTP")
+        try:
+            while line := await reader.readline():
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    writer.write(b"250-stub\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                    await writer.drain()
+                elif verb == "AUTH":
+                    await reply("235 Authentication successful")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = bytearray()
+                    while (chunk := await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        # Undo dot-stuffing
+                        data.extend(chunk[1:] if chunk.startswith(b"..") else chunk)
+                    self.messages.append(email.message_from_bytes(bytes(data), policy=policy.default))
+                    await reply("250 OK: queued")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    # HELO, MAIL, RCPT, RSET, NOOP, ...
+                    await reply("250 OK")
+        finally:
+            writer.close()
+
+
+async def main(port):
+    server = StubSMTPServer(port=port)
+    await server.start()
+    print(f"Stub SMTP server listening on {server.host}:{server.port}")
+    last = 0
+    while True:
+        await asyncio.sleep(1)
+        for msg in server.messages[last:]:
+            attachments = [part.get_filename() for part in msg.iter_attachments()]
+            print(f"{msg['Subject']} ({len(attachments)} attachment(s))")
+        last = len(server.messages)
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1025))
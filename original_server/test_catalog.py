@@ -0,0 +1,52 @@
+import os
+import asyncio
+import tempfile
+from catalog import DetectionCatalog
+from names import camera_of, cycle_of
+from wild_animals_shared.checks import Checks
+
+# Configuration
+NAMES = {0: "animal", 1: "person", 2: "vehicle"}
+# As stored here for an image the gateway forwarded: our timestamp, then the gateway's
+FORWARDED_NAME = "20250101_120000_123456_20250101_115959_000001_AABBCCDDEEFF-00000001-{index}n.jpg"
+check = Checks()
+
+async def main():
+    catalog = DetectionCatalog(os.path.join(tempfile.mkdtemp(), "detections.sqlite3"), batch=2)
+    await catalog.start()
+
+    # Recorded the way analyze_detections does for /upload: camera and cycle parsed from the stored name
+    for index in range(1, 4):
+        filename = FORWARDED_NAME.format(index=index)
+        detections = {"boxes": [[10.0, 20.0, 300.0, 400.0], [5.0, 5.0, 50.0, 50.0]], "classes": [0, 1],
+                      "confidences": [0.9, 0.4]}
+        catalog.add(camera_of(filename), cycle_of(filename), filename, detections, NAMES)
+    # Another camera's detection must not show up under the first one
+    catalog.add("112233445566", "112233445566-00000007", "112233445566-00000007-1d.jpg",
+                {"boxes": [[1.0, 2.0, 3.0, 4.0]], "classes": [0], "confidences": [0.8]}, NAMES)
+    await asyncio.sleep(0.2)
+
+    rows, _ = catalog.query(camera="AABBCCDDEEFF")
+    check("forwarded images are filed under their camera", len(rows) == 6)
+    check("and under their cycle", all(row["cycle_id"] == "AABBCCDDEEFF-00000001" for row in rows))
+    rows, _ = catalog.query(camera="AABBCCDDEEFF", image_class="animal")
+    check("camera and class filters combine", len(rows) == 3 and rows[0]["count"] == 1)
+    rows, _ = catalog.query(cycle_id="AABBCCDDEEFF-00000001", image_class="person")
+    check("cycle filter", len(rows) == 3 and rows[0]["confidence"] == 0.4)
+    check("nothing is filed as unknown", not catalog.query(camera="unknown")[0])
+
+    # Paging returns every row once
+    seen, cursor = [], None
+    while True:
+        rows, cursor = catalog.query(limit=2, cursor=cursor)
+        seen.extend(row["id"] for row in rows)
+        if cursor is None:
+            break
+    check("paging returns every row once", sorted(seen) == list(range(1, 8)))
+
+    await catalog.stop()
+    print(f"\nStats: {catalog.stats()}")
+
+if __name__ == "__main__":
+    with check:
+        asyncio.run(main())
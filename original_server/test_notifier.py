@@ -0,0 +1,68 @@
+import os
+import asyncio
+import tempfile
+from names import camera_of
+from notifier import Notifier
+from stub_smtp import StubSMTPServer
+from wild_animals_shared.checks import Checks
+
+# Configuration
+DIGEST_WINDOW = 0.5  # Seconds; short so the test finishes quickly
+MAX_PER_HOUR = 2
+# Images forwarded by the gateway carry its timestamp, then ours: digests are keyed by camera_of(name)
+FORWARDED_NAME = "20250101_120000_123456_20250101_115959_000001_{camera}-00000001-{index}n.jpg"
+check = Checks()
+
+async def main():
+    smtp = StubSMTPServer(port=0)
+    await smtp.start()
+
+    # Small placeholder images to attach
+    tmp_dir = tempfile.mkdtemp()
+    names = [FORWARDED_NAME.format(camera="AABBCCDDEEFF", index=i) for i in range(3)]
+    names.append(FORWARDED_NAME.format(camera="112233445566", index=0))
+    images = []
+    for name in names:
+        path = os.path.join(tmp_dir, f"processed_{name}")
+        with open(path, "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
+        images.append(path)
+
+    notifier = Notifier("127.0.0.1", smtp.port, "sender@example.com", "", "recipient@example.com",
+                        digest_window=DIGEST_WINDOW, max_per_hour=MAX_PER_HOUR, start_tls=False)
+    await notifier.start()
+
+    check("camera is parsed from a double-prefixed forwarded name",
+          [camera_of(name) for name in names[2:]] == ["AABBCCDDEEFF", "112233445566"])
+
+    # Three detections from one camera within the window -> one email, three images
+    for i in range(3):
+        notifier.notify(camera_of(names[i]), {"animal": i + 1}, [images[i]], f"Image: {names[i]}")
+    await asyncio.sleep(DIGEST_WINDOW * 3)
+    check("detections within the window are sent as one email", len(smtp.messages) == 1)
+    if smtp.messages:
+        attachments = list(smtp.messages[0].iter_attachments())
+        check("digest email carries every image", len(attachments) == 3)
+        check("digest reports the largest count", "animal: 3" in smtp.messages[0]["Subject"])
+
+    # Another camera gets its own email over the same SMTP session
+    notifier.notify(camera_of(names[3]), {"animal": 1}, [images[3]])
+    await asyncio.sleep(DIGEST_WINDOW * 3)
+    check("other cameras get their own email", len(smtp.messages) == 2)
+    check("SMTP session is reused", smtp.connections == 1)
+
+    # Rate limit reached: the next digest is held back until shutdown
+    notifier.notify(camera_of(names[0]), {"animal": 1}, [images[0]])
+    await asyncio.sleep(DIGEST_WINDOW * 3)
+    check("rate limit holds back further emails", len(smtp.messages) == 2)
+    check("rate-limited digest is counted", notifier.stats()["rate_limited"] > 0)
+
+    await notifier.stop()
+    check("pending digest is sent on shutdown", len(smtp.messages) == 3)
+    await smtp.stop()
+
+    print(f"\nStats: {notifier.stats()}")
+
+if __name__ == "__main__":
+    with check:
+        asyncio.run(main())
@@ -0,0 +1,216 @@
+import os
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Raspberry Pi OS: SoC temperature in millidegrees, and CPU frequencies in kHz
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+CPUFREQ_DIR = "/sys/devices/system/cpu/cpu0/cpufreq"
+
+# Weight of the newest batch in the per-image latency average
+LATENCY_ALPHA = 0.3
+
+# Order in which settings are stepped down when hot (accuracy last) and up when behind
+COOL_DOWN_ORDER = ("concurrency", "threads", "image_size")
+SPEED_UP_ORDER = ("batch_size", "threads", "concurrency")
+# Order in which settings return to their configured value once neither applies
+RESTORE_ORDER = ("image_size", "threads", "concurrency", "batch_size")
+
+
+def _read_number(path):
+    try:
+        with open(path) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+class ThermalSource:
+    """
+    CPU temperature and frequency from sysfs. The paths can point anywhere,
+    so tests can drive the controller with files of their own. Values that
+    cannot be read (e.g. not on a Pi) are None.
+    """
+    def __init__(self, thermal_zone=THERMAL_ZONE, cpufreq_dir=CPUFREQ_DIR):
+        self.thermal_zone = thermal_zone
+        self.cpufreq_dir = cpufreq_dir
+
+    def read(self):
+        """{'temp_c', 'freq_khz', 'max_freq_khz'}. Blocking."""
+        millidegrees = _read_number(self.thermal_zone)
+        return {
+            "temp_c": millidegrees / 1000 if millidegrees is not None else None,
+            "freq_khz": _read_number(os.path.join(self.cpufreq_dir, "scaling_cur_freq")),
+            "max_freq_khz": _read_number(os.path.join(self.cpufreq_dir, "cpuinfo_max_freq")),
+        }
+
+
+class Knob:
+    """
+    One inference setting the controller may change: values are the allowed
+    settings in ascending order, baseline the configured one, apply(value)
+    puts a new one in effect (in a worker thread if blocking).
+    """
+    def __init__(self, name, values, baseline, apply, blocking=False):
+        self.name = name
+        self.values = sorted(set(values) | {baseline})
+        self.baseline = baseline
+        self.value = baseline
+        self.apply = apply
+        self.blocking = blocking
+
+    def step(self, direction):
+        """The next value up (direction 1) or down (-1), or None at the bound."""
+        index = self.values.index(self.value) + direction
+        return self.values[index] if 0 <= index < len(self.values) else None
+
+    def toward_baseline(self):
+        if self.value == self.baseline:
+            return None
+        return self.step(1 if self.value < self.baseline else -1)
+
+
+class AdaptiveController:
+    """
+    Adjusts inference settings at runtime from CPU temperature and frequency,
+    queue depth and per-image inference latency.
+
+    Every interval seconds, at most one setting moves one step:
+    - hot (temp_high degrees or more, or the CPU running below freq_ratio of
+      its maximum frequency while inferring, i.e. throttled): concurrency,
+      then threads, then inference resolution go down;
+    - cool (temp_low or less) with a backlog (queue at least queue_high full,
+      or per-image latency above latency_target with images waiting): batch
+      size, then threads, then concurrency go up;
+    - cool otherwise: settings move back toward their configured values,
+      resolution first.
+    Between temp_low and temp_high nothing changes, so the settings do not
+    oscillate around one threshold. Settings never leave the values their knob
+    allows. Every change is logged and reported to on_adjust(name, old, new, reason).
+    queue() returns (images waiting, queue capacity).
+    """
+    def __init__(self, source, knobs, queue, interval=15.0, temp_high=75.0, temp_low=65.0, freq_ratio=0.9,
+                 queue_high=0.5, latency_target=None, on_adjust=None):
+        self.source = source
+        self.knobs = {knob.name: knob for knob in knobs}
+        self.queue = queue
+        self.interval = interval
+        self.temp_high = temp_high
+        self.temp_low = temp_low
+        self.freq_ratio = freq_ratio
+        self.queue_high = queue_high
+        self.latency_target = latency_target
+        self.on_adjust = on_adjust
+        self.sample = {}
+        self.adjustments = 0
+        # Per-image inference seconds (moving average), and images inferred since the last tick
+        self.latency = None
+        self._inferred = 0
+        # record() is called from the inference threads
+        self._lock = threading.Lock()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record(self, images, seconds):
+        """A batch of images was inferred in seconds. Thread-safe."""
+        if not images:
+            return
+        per_image = seconds / images
+        with self._lock:
+            self._inferred += images
+            self.latency = per_image if self.latency is None else (
+                LATENCY_ALPHA * per_image + (1 - LATENCY_ALPHA) * self.latency)
+
+    def settings(self):
+        return {name: knob.value for name, knob in self.knobs.items()}
+
+    def stats(self):
+        freq, max_freq = self.sample.get("freq_khz"), self.sample.get("max_freq_khz")
+        return {
+            "temp_c": self.sample.get("temp_c"),
+            "freq_ratio": round(freq / max_freq, 3) if freq and max_freq else None,
+            "throttled": self.sample.get("throttled", False),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "adjustments": self.adjustments,
+            "settings": self.settings(),
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Adaptive inference controller failed: {e}")
+
+    async def tick(self):
+        """Take a sample and make at most one adjustment; returns it as (name, old, new, reason) or None."""
+        sample = await asyncio.to_thread(self.source.read)
+        with self._lock:
+            busy, self._inferred = self._inferred > 0, 0
+        freq, max_freq = sample.get("freq_khz"), sample.get("max_freq_khz")
+        # Idle CPUs clock down on their own; a low clock only means throttling while inferring
+        sample["throttled"] = bool(busy and freq and max_freq and freq < self.freq_ratio * max_freq)
+        self.sample = sample
+
+        change = self.decide(sample, *self.queue())
+        if change is None:
+            return None
+        name, value, reason = change
+        knob = self.knobs[name]
+        old = knob.value
+        if knob.blocking:
+            await asyncio.to_thread(knob.apply, value)
+        else:
+            knob.apply(value)
+        knob.value = value
+        self.adjustments += 1
+        logger.info(f"Adaptive inference: {name} {old} -> {value} ({reason})")
+        if self.on_adjust is not None:
+            self.on_adjust(name, old, value, reason)
+        return name, old, value, reason
+
+    def decide(self, sample, depth, capacity):
+        """(setting, new value, reason) for the next step, or None to keep everything as it is."""
+        temp = sample.get("temp_c")
+        if sample.get("throttled"):
+            return self._first(COOL_DOWN_ORDER, -1, "CPU throttled")
+        if temp is not None and temp >= self.temp_high:
+            return self._first(COOL_DOWN_ORDER, -1, f"CPU {temp:.1f}C >= {self.temp_high:g}C")
+        if temp is not None and temp > self.temp_low:
+            return None
+
+        if depth >= self.queue_high * capacity:
+            return self._first(SPEED_UP_ORDER, 1, f"{depth}/{capacity} images waiting")
+        latency = self.latency
+        if self.latency_target and latency is not None and latency > self.latency_target and depth:
+            return self._first(SPEED_UP_ORDER, 1,
+                               f"{latency * 1000:.0f} ms per image > {self.latency_target * 1000:.0f} ms")
+        for name in RESTORE_ORDER:
+            knob = self.knobs.get(name)
+            value = knob.toward_baseline() if knob is not None else None
+            if value is not None:
+                return name, value, "back to configured value"
+        return None
+
+    def _first(self, order, direction, reason):
+        for name in order:
+            knob = self.knobs.get(name)
+            value = knob.step(direction) if knob is not None else None
+            if value is not None:
+                return name, value, reason
+        return None
@@ -0,0 +1,120 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from backends import Detections
+from detector import draw_detections, load_image
+
+logger = logging.getLogger(__name__)
+
+# Detections of this many recent images are kept in memory for rendering
+MAX_CACHED_RECORDS = 1024
+
+
+class AnnotationStore:
+    """
+    Raw detections per uploaded image, with annotated JPEGs rendered on demand.
+
+    The inference path only appends one compact JSON line per image to a daily
+    sidecar file in record_dir (no JPEG encode, no image write). An annotated
+    image is drawn from the original and those detections when somebody asks
+    for it, and cached in cache_dir. names (class id -> label) may be set once
+    the model is loaded.
+    """
+    def __init__(self, record_dir, cache_dir, names=None):
+        self.record_dir = record_dir
+        self.cache_dir = cache_dir
+        self.names = names or {}
+        self.counters = {"recorded": 0, "rendered": 0, "cache_hits": 0}
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.record_dir, exist_ok=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _record_path(self, filename):
+        # Uploads are named "YYYYMMDD_HHMMSS_ffffff_..."; one sidecar per day
+        day = filename[:8] if filename[:8].isdigit() else "undated"
+        return os.path.join(self.record_dir, f"detections-{day}.jsonl")
+
+    def cached_path(self, filename):
+        return os.path.join(self.cache_dir, f"{os.path.splitext(filename)[0]}_result.jpg")
+
+    def record(self, filenames, detections):
+        """Append the detections of a batch of images (called from the inference thread)."""
+        lines = {}
+        with self._lock:
+            for filename, result in zip(filenames, detections):
+                if filename is None:
+                    continue
+                self._remember(filename, result)
+                line = json.dumps({
+                    "f": filename,
+                    "b": np.round(result.boxes).astype(int).tolist(),
+                    "c": [int(c) for c in result.classes],
+                    "s": [round(float(s), 3) for s in result.confidences],
+                }, separators=(",", ":"))
+                lines.setdefault(self._record_path(filename), []).append(line)
+            for path, batch in lines.items():
+                with open(path, "a") as f:
+                    f.write("\n".join(batch) + "\n")
+            self.counters["recorded"] += sum(len(batch) for batch in lines.values())
+
+    def _remember(self, filename, result):
+        self._recent[filename] = result
+        self._recent.move_to_end(filename)
+        while len(self._recent) > MAX_CACHED_RECORDS:
+            self._recent.popitem(last=False)
+
+    def lookup(self, filename):
+        """Detections recorded for an image, or None if it was never inferred."""
+        with self._lock:
+            if filename in self._recent:
+                return self._recent[filename]
+        path = self._record_path(filename)
+        if not os.path.exists(path):
+            return None
+        found = None
+        with open(path) as f:
+            for line in f:
+                # Cheap substring test before parsing
+                if filename not in line:
+                    continue
+                record = json.loads(line)
+                if record["f"] == filename:
+                    found = record
+        if found is None:
+            return None
+        return Detections(
+            np.array(found["b"], dtype=np.float32).reshape(-1, 4),
+            np.array(found["s"], dtype=np.float32),
+            np.array(found["c"], dtype=int),
+        )
+
+    def cached(self, filename):
+        """Path of the already rendered annotated image, or None."""
+        path = self.cached_path(filename)
+        if not os.path.exists(path):
+            return None
+        self.counters["cache_hits"] += 1
+        return path
+
+    def render(self, filename, source):
+        """
+        Draw the annotated image for filename from source (path or bytes of the
+        original) and cache it. Returns its path, or None if the image has no
+        recorded detections. Blocking; run it in a thread.
+        """
+        detections = self.lookup(filename)
+        if detections is None:
+            return None
+        path = self.cached_path(filename)
+        image = load_image(source)
+        cv2.imwrite(path, draw_detections(image, detections, self.names))
+        self.counters["rendered"] += 1
+        return path
+
+    def stats(self):
+        return dict(self.counters)
@@ -0,0 +1,244 @@
+import os
+import ast
+import shutil
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Inference backends for Detector
+BACKEND_TORCH = "torch"        # ultralytics + PyTorch on the .pt weights
+BACKEND_ONNX = "onnx"          # exported ONNX model served by ONNX Runtime, no torch at runtime
+BACKEND_OPENVINO = "openvino"  # exported OpenVINO model, served through ultralytics
+BACKENDS = (BACKEND_TORCH, BACKEND_ONNX, BACKEND_OPENVINO)
+
+# Same defaults as ultralytics predict()
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+IMAGE_SIZE = 640
+
+
+class Detections:
+    """Detections for one image, in original image pixels, highest confidence first."""
+    def __init__(self, boxes, confidences, classes):
+        self.boxes = boxes              # (N, 4) float32 x1, y1, x2, y2
+        self.confidences = confidences  # (N,) float32
+        self.classes = classes          # (N,) int
+
+    def __len__(self):
+        return len(self.classes)
+
+
+class UltralyticsBackend:
+    """
+    PyTorch .pt weights, or an exported model ultralytics can serve (OpenVINO).
+    With PyTorch, the input size and thread count can be changed between
+    batches; the OpenVINO export has a fixed input size and its own threads.
+    """
+    def __init__(self, model_path, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, num_threads=0):
+        self.name = BACKEND_TORCH if model_path.endswith(".pt") else BACKEND_OPENVINO
+        # Imported here so the ONNX backend never pays for torch/ultralytics
+        from ultralytics import YOLO
+        self.model = YOLO(model_path, task="detect")
+        self.names = dict(self.model.names)
+        self.conf = conf
+        self.iou = iou
+        self.image_size = IMAGE_SIZE
+        self.resizable = self.name == BACKEND_TORCH
+        self.threads_adjustable = self.name == BACKEND_TORCH
+        # 0 keeps PyTorch's default (every core)
+        self.num_threads = 0
+        self.set_num_threads(num_threads)
+
+    def set_num_threads(self, num_threads):
+        """Takes effect from the next batch."""
+        if self.threads_adjustable and num_threads:
+            import torch
+            # Sizes the process-wide intra-op pool, whichever thread runs the batches
+            torch.set_num_threads(num_threads)
+        self.num_threads = num_threads
+
+    def predict(self, images):
+        results = self.model(images, batch=len(images), imgsz=self.image_size, conf=self.conf, iou=self.iou,
+                             verbose=False)
+        detections = []
+        for result in results:
+            boxes = result.boxes
+            detections.append(Detections(
+                boxes.xyxy.cpu().numpy().astype(np.float32),
+                boxes.conf.cpu().numpy().astype(np.float32),
+                boxes.cls.cpu().numpy().astype(int),
+            ))
+        return detections
+
+
+class OnnxBackend:
+    """
+    YOLOv8 ONNX model on ONNX Runtime, with letterboxing and NMS done in numpy/OpenCV
+    the way ultralytics does them, so results match the PyTorch backend.
+    The input size can be changed between batches if the model was exported
+    with dynamic axes; a new thread count rebuilds the session.
+    """
+    threads_adjustable = True
+
+    def __init__(self, model_path, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, num_threads=0):
+        self.name = BACKEND_ONNX
+        self.model_path = model_path
+        self.session = self._new_session(num_threads)
+        inputs = self.session.get_inputs()[0]
+        self.input_name = inputs.name
+        # Named (not fixed) height and width: exported with dynamic=True
+        self.resizable = not isinstance(inputs.shape[2], int)
+
+        # ultralytics stores class names and input size in the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+        self.image_size = ast.literal_eval(metadata["imgsz"])[0] if "imgsz" in metadata else IMAGE_SIZE
+        self.conf = conf
+        self.iou = iou
+
+    def _new_session(self, num_threads):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 lets ONNX Runtime use every core
+        options.intra_op_num_threads = num_threads
+        return ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+
+    def set_num_threads(self, num_threads):
+        """
+        ONNX Runtime fixes the thread count per session, so this builds a new one
+        (blocking, well under a second for YOLOv8n); batches already running finish on the old one.
+        """
+        self.session = self._new_session(num_threads)
+
+    def predict(self, images):
+        # One size for the whole batch, even if image_size changes meanwhile
+        size = self.image_size
+        session = self.session
+        batch, transforms = [], []
+        for image in images:
+            tensor, transform = self._letterbox(image, size)
+            batch.append(tensor)
+            transforms.append(transform)
+        outputs = session.run(None, {self.input_name: np.stack(batch)})[0]
+        return [self._postprocess(output, image.shape, transform)
+                for output, image, transform in zip(outputs, images, transforms)]
+
+    def _letterbox(self, image, size):
+        """Resize keeping the aspect ratio and pad to a square of size, as ultralytics' LetterBox."""
+        h, w = image.shape[:2]
+        ratio = min(size / h, size / w)
+        new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+        pad_w, pad_h = (size - new_w) / 2, (size - new_h) / 2
+
+        if (new_w, new_h) != (w, h):
+            image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+        left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+
+        # BGR HWC uint8 -> RGB CHW float32 in [0, 1]
+        tensor = image[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+        return np.ascontiguousarray(tensor), (ratio, left, top)
+
+    def _postprocess(self, output, shape, transform):
+        # output: (4 + num_classes, anchors) with cx, cy, w, h then per-class scores
+        predictions = output.T
+        scores = predictions[:, 4:]
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        keep = confidences > self.conf
+        predictions, classes, confidences = predictions[keep], classes[keep], confidences[keep]
+
+        cx, cy, bw, bh = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+        xywh = np.stack([cx - bw / 2, cy - bh / 2, bw, bh], axis=1)
+        # Per-class NMS, like ultralytics with agnostic=False
+        indices = cv2.dnn.NMSBoxesBatched(xywh.tolist(), confidences.tolist(), classes.tolist(), self.conf, self.iou)
+        indices = np.asarray(indices, dtype=int).reshape(-1)
+        indices = indices[np.argsort(-confidences[indices], kind="stable")][:MAX_DETECTIONS]
+
+        # Undo the letterbox: back to original image pixels
+        ratio, left, top = transform
+        boxes = xywh[indices].copy()
+        boxes[:, 2:] += boxes[:, :2]
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - left) / ratio).clip(0, shape[1])
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - top) / ratio).clip(0, shape[0])
+        return Detections(boxes.astype(np.float32), confidences[indices].astype(np.float32), classes[indices].astype(int))
+
+
+def exported_path(weights, backend, int8=False, cache_dir="models"):
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    if backend == BACKEND_ONNX:
+        return os.path.join(cache_dir, f"{stem}.int8.onnx" if int8 else f"{stem}.onnx")
+    return os.path.join(cache_dir, f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model")
+
+
+def export_model(weights, backend, int8=False, cache_dir="models", image_size=IMAGE_SIZE):
+    """
+    Export the .pt weights for backend once and cache the artifact in cache_dir.
+    Returns the cached path; later calls return it without exporting again
+    (unless the weights are newer than the export).
+    """
+    target = exported_path(weights, backend, int8, cache_dir)
+    if os.path.exists(target) and (not os.path.exists(weights) or os.path.getmtime(target) >= os.path.getmtime(weights)):
+        return target
+
+    os.makedirs(cache_dir, exist_ok=True)
+    from ultralytics import YOLO
+    logger.info(f"Exporting {weights} to {target}...")
+    model = YOLO(weights)
+
+    if backend == BACKEND_ONNX:
+        # Dynamic axes so a whole micro-batch goes through one session.run()
+        exported = model.export(format="onnx", dynamic=True, imgsz=image_size)
+        if int8:
+            _quantize_onnx(exported, target)
+            os.remove(exported)
+        else:
+            os.replace(exported, target)
+    elif backend == BACKEND_OPENVINO:
+        exported = model.export(format="openvino", int8=int8, imgsz=image_size)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(exported, target)
+    else:
+        raise ValueError(f"Nothing to export for backend {backend!r}")
+
+    logger.info(f"Exported {target}")
+    return target
+
+
+def _quantize_onnx(source, target):
+    """Dynamic INT8 quantization of the weights; keeps the metadata (class names, input size)."""
+    import onnx
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+    metadata = onnx.load(source, load_external_data=False).metadata_props
+    quantized = onnx.load(target)
+    existing = {prop.key for prop in quantized.metadata_props}
+    for prop in metadata:
+        if prop.key not in existing:
+            quantized.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized, target)
+
+
+def load_backend(backend, weights="yolov8n.pt", int8=False, cache_dir="models", conf=CONF_THRESHOLD, num_threads=0):
+    """
+    Create the requested backend, exporting the weights first if needed.
+    Falls back to PyTorch if the backend cannot be exported or loaded
+    (e.g. onnxruntime / openvino not installed).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend {backend!r}, expected one of {BACKENDS}")
+    if backend != BACKEND_TORCH:
+        try:
+            path = export_model(weights, backend, int8, cache_dir)
+            if backend == BACKEND_ONNX:
+                return OnnxBackend(path, conf=conf, num_threads=num_threads)
+            return UltralyticsBackend(path, conf=conf)
+        except Exception as e:
+            logger.warning(f"Detector backend {backend!r} unavailable ({e}), falling back to PyTorch")
+    return UltralyticsBackend(weights, conf=conf, num_threads=num_threads)
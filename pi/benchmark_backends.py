@@ -0,0 +1,96 @@
+import time
+
+# Taken before any other import so the cold start includes loading torch/onnxruntime
+PROCESS_START = time.perf_counter()
+
+import os
+import sys
+import json
+import resource
+import subprocess
+
+# Benchmark on CPU, as on the Pi
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+# Configuration
+IMAGE_FILE = "test.jpg"
+WEIGHTS = "yolov8n.pt"
+CACHE_DIR = "models"
+NUM_RUNS = 20
+# (backend, int8) combinations to compare
+CANDIDATES = [("torch", False), ("onnx", False), ("onnx", True), ("openvino", False)]
+
+def rss_mb():
+    """Current resident set size of this process."""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def measure(backend, int8):
+    """Runs in a fresh process so import time and memory are not shared between backends."""
+    from detector import Detector, load_image
+
+    detector = Detector(backend, WEIGHTS, int8=int8, cache_dir=CACHE_DIR)
+    loaded = time.perf_counter()
+    image = load_image(IMAGE_FILE)
+    detector.detect_batch([image])
+    first = time.perf_counter()
+
+    latencies = []
+    for _ in range(NUM_RUNS):
+        start_time = time.perf_counter()
+        detector.detect_batch([image])
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    latencies.sort()
+
+    return {
+        "backend": detector.backend.name,
+        "load_s": loaded - PROCESS_START,
+        "cold_start_s": first - PROCESS_START,
+        "latency_ms": sum(latencies) / len(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "rss_mb": rss_mb(),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def export_all():
+    from backends import export_model
+    for backend, int8 in CANDIDATES:
+        if backend != "torch":
+            try:
+                export_model(WEIGHTS, backend, int8, CACHE_DIR)
+            except Exception as e:
+                print(f"Cannot export {backend}{' int8' if int8 else ''}: {e}")
+
+def main():
+    for path in (IMAGE_FILE, WEIGHTS):
+        if not os.path.exists(path):
+            print(f"Error: '{path}' not found in current directory.")
+            sys.exit(1)
+
+    # Export up front so the one-off export is not counted as cold start.
+    # In a child process too: peak RSS would otherwise carry over from this one
+    subprocess.run([sys.executable, __file__, "export"])
+
+    print(f"{'backend':>13} {'cold start s':>12} {'load s':>7} {'mean ms':>8} {'p50 ms':>7} {'RSS MB':>7} {'peak MB':>8}")
+    for backend, int8 in CANDIDATES:
+        name = f"{backend}{' int8' if int8 else ''}"
+        child = subprocess.run([sys.executable, __file__, backend, str(int(int8))], capture_output=True, text=True)
+        if child.returncode != 0:
+            print(f"{name:>13} failed: {child.stderr.strip().splitlines()[-1:]}")
+            continue
+        stats = json.loads(child.stdout.strip().splitlines()[-1])
+        if stats["backend"] != backend:
+            print(f"{name:>13} not available (fell back to {stats['backend']})")
+            continue
+        print(f"{name:>13} {stats['cold_start_s']:>12.2f} {stats['load_s']:>7.2f} {stats['latency_ms']:>8.1f} "
+              f"{stats['p50_ms']:>7.1f} {stats['rss_mb']:>7.0f} {stats['peak_rss_mb']:>8.0f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        print(json.dumps(measure(sys.argv[1], sys.argv[2] == "1")))
+    elif sys.argv[1:] == ["export"]:
+        export_all()
+    else:
+        main()
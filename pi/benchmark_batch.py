@@ -0,0 +1,49 @@
+import time
+import os
+import sys
+
+# Benchmark on CPU, as on the Pi
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+from detector import Detector
+
+# Configuration
+IMAGE_FILE = "test.jpg"
+BATCH_SIZES = [1, 2, 4, 8]
+NUM_IMAGES = 32  # Images pushed through the detector per batch size
+WARMUP_BATCHES = 2
+
+def run(detector, batch_size):
+    paths = [IMAGE_FILE] * batch_size
+
+    # Warm up so graph/allocator setup is not counted
+    for _ in range(WARMUP_BATCHES):
+        detector.detect_batch(paths)
+
+    num_batches = max(1, NUM_IMAGES // batch_size)
+    start_time = time.perf_counter()
+    for _ in range(num_batches):
+        results = detector.detect_batch(paths)
+    elapsed = time.perf_counter() - start_time
+
+    images = num_batches * batch_size
+    return images / elapsed, results[0]
+
+def main():
+    if not os.path.exists(IMAGE_FILE):
+        print(f"Error: '{IMAGE_FILE}' not found in current directory.")
+        sys.exit(1)
+
+    detector = Detector()
+
+    # Per-image results must match the single-image path
+    expected = detector.detect(IMAGE_FILE)
+    print(f"Single-image result: {expected}")
+
+    print(f"{'batch':>5} {'images/sec':>12} {'match':>6}")
+    for batch_size in BATCH_SIZES:
+        throughput, result = run(detector, batch_size)
+        print(f"{batch_size:>5} {throughput:>12.2f} {str(result == expected):>6}")
+
+if __name__ == "__main__":
+    main()
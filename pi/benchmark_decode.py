@@ -0,0 +1,69 @@
+import time
+import os
+import sys
+import json
+import resource
+import subprocess
+
+# Configuration
+IMAGE_FILE = "test.jpg"
+# Model input size the reduced decode has to cover
+TARGET_SIZE = 640
+NUM_RUNS = 50
+MODES = ["full", "reduced"]
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(mode):
+    """Runs in a fresh process so peak memory is not shared between modes."""
+    from detector import decode_image, decode_reduced
+
+    with open(IMAGE_FILE, "rb") as f:
+        data = f.read()
+    baseline = peak_rss_mb()
+
+    latencies = []
+    for _ in range(NUM_RUNS):
+        start_time = time.perf_counter()
+        if mode == "full":
+            image, scale = decode_image(data), 1.0
+        else:
+            image, scale = decode_reduced(data, TARGET_SIZE)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        del image
+    latencies.sort()
+
+    image, scale = decode_reduced(data, TARGET_SIZE) if mode == "reduced" else (decode_image(data), 1.0)
+    return {
+        "shape": list(image.shape),
+        "scale": scale,
+        "latency_ms": sum(latencies) / len(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "array_mb": image.nbytes / (1024 * 1024),
+        # Growth of the peak over what the process needed before decoding anything
+        "peak_mb": peak_rss_mb() - baseline,
+    }
+
+def main():
+    if not os.path.exists(IMAGE_FILE):
+        print(f"Error: '{IMAGE_FILE}' not found in current directory.")
+        sys.exit(1)
+
+    print(f"{'decode':>8} {'size':>10} {'scale':>6} {'mean ms':>8} {'p50 ms':>7} {'array MB':>9} {'peak MB':>8}")
+    for mode in MODES:
+        child = subprocess.run([sys.executable, __file__, mode], capture_output=True, text=True)
+        if child.returncode != 0:
+            print(f"{mode:>8} failed: {child.stderr.strip().splitlines()[-1:]}")
+            continue
+        stats = json.loads(child.stdout.strip().splitlines()[-1])
+        size = f"{stats['shape'][1]}x{stats['shape'][0]}"
+        print(f"{mode:>8} {size:>10} {stats['scale']:>6.2f} {stats['latency_ms']:>8.1f} {stats['p50_ms']:>7.1f} "
+              f"{stats['array_mb']:>9.1f} {stats['peak_mb']:>8.1f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        print(json.dumps(measure(sys.argv[1])))
+    else:
+        main()
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import hashlib
+import smtplib
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+from email.message import EmailMessage
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+# The SMTP sink is shared with the analysis server's tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "original_server"))
+from stub_smtp import StubSMTPServer
+
+PI_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGES_PER_CYCLE = 3
+# How ESP32 PIR triggers are spread over time, per camera
+PATTERNS = ("steady", "poisson", "burst", "storm")
+
+
+def percentiles(values):
+    values = sorted(values)
+
+    def at(p):
+        return round(values[min(len(values) - 1, int(len(values) * p / 100))], 4) if values else None
+    return {"count": len(values), "p50": at(50), "p95": at(95), "p99": at(99), "max": round(values[-1], 4) if values else None}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def trigger_times(pattern, cycles, interval, burst_size, burst_gap, rng):
+    """Seconds from the start at which one camera's PIR fires, for each of its cycles."""
+    if pattern == "storm":
+        # Every camera at once (wind, a herd passing all cameras)
+        return [i * interval for i in range(cycles)]
+    times, t = [], rng.uniform(0, interval)
+    for i in range(cycles):
+        times.append(t)
+        if pattern == "steady":
+            t += interval * rng.uniform(0.8, 1.2)
+        elif pattern == "poisson":
+            t += rng.expovariate(1 / interval)
+        else:
+            # burst_size cycles in quick succession (an animal lingering), then quiet
+            t += burst_gap if (i + 1) % burst_size else interval
+    return times
+
+
+class AnalysisStub:
+    """
+    Stand-in for the analysis server: accepts the gateway's forwards (bundle or
+    per image), records when each cycle arrived, and after a simulated
+    inference delay emails the SMTP sink as the real server would.
+    """
+    def __init__(self, smtp_port, delay):
+        self.smtp_port = smtp_port
+        self.delay = delay
+        # cycle_id -> seconds (perf_counter) at arrival / at notification
+        self.forwarded = {}
+        self.notified = {}
+        self.bytes = 0
+        self.app = FastAPI()
+        self.app.post("/upload_cycle")(self.upload_cycle)
+        self.app.post("/upload")(self.upload)
+
+    async def upload_cycle(self, request: Request):
+        form = await request.form()
+        cycle_id = json.loads(form["manifest"])["cycle_id"]
+        for file in form.getlist("files"):
+            self.bytes += len(await file.read())
+        self._arrived(cycle_id)
+        return {"status": "ok"}
+
+    async def upload(self, request: Request):
+        form = await request.form()
+        self.bytes += len(await form["file"].read())
+        # Per-image forwards carry the Cycle ID as their trace ID
+        self._arrived(request.headers.get("x-trace-id", "unknown"))
+        return {"status": "ok"}
+
+    def _arrived(self, cycle_id):
+        if cycle_id not in self.forwarded:
+            self.forwarded[cycle_id] = time.perf_counter()
+            asyncio.get_running_loop().create_task(self._notify(cycle_id))
+
+    async def _notify(self, cycle_id):
+        await asyncio.sleep(self.delay)
+        await asyncio.to_thread(self._send, cycle_id)
+        self.notified[cycle_id] = time.perf_counter()
+
+    def _send(self, cycle_id):
+        message = EmailMessage()
+        message["Subject"] = f"Animal detected: {cycle_id}"
+        message["From"] = "gateway@example.com"
+        message["To"] = "benchmark@example.com"
+        message.set_content(f"Cycle {cycle_id}")
+        with smtplib.SMTP("127.0.0.1", self.smtp_port) as smtp:
+            smtp.send_message(message)
+
+
+class Camera:
+    """One simulated ESP32: captures 3-image cycles on PIR triggers and uploads them over the raw protocol."""
+    def __init__(self, number, images, night_share, rng):
+        self.mac = f"{0x24A160000000 + number:012X}"
+        self.images = images
+        self.night_share = night_share
+        self.rng = rng
+        self.seq = rng.randrange(1, 10000)
+
+    async def run(self, client, url, triggers, started, results):
+        for trigger in triggers:
+            await asyncio.sleep(max(0.0, started + trigger - time.perf_counter()))
+            await self.upload_cycle(client, url, results)
+
+    async def upload_cycle(self, client, url, results):
+        self.seq += 1
+        cycle_id = f"{self.mac}-{self.seq:08d}"
+        suffix = "n" if self.rng.random() < self.night_share else "d"
+        jpeg = self.rng.choice(self.images)
+        cycle = {"first_upload": time.perf_counter(), "acked": 0}
+        results["cycles"][cycle_id] = cycle
+        for index in range(1, IMAGES_PER_CYCLE + 1):
+            # Bytes after the JPEG end marker are ignored by decoders, but make every upload distinct
+            body = jpeg + f"{cycle_id}-{index}".encode()
+            headers = {
+                "Content-Type": "image/jpeg",
+                "X-Cycle-Id": cycle_id,
+                "X-Img-Index": str(index),
+                "X-File-Name": f"{cycle_id}-{index}{suffix}.jpg",
+                "X-Content-SHA256": hashlib.sha256(body).hexdigest(),
+            }
+            start_time = time.perf_counter()
+            try:
+                response = await client.post(url, content=body, headers=headers, timeout=30.0)
+            except Exception as e:
+                results["errors"].append(f"{cycle_id}-{index}: {e}")
+                return
+            if response.status_code == 503:
+                # The firmware keeps the cycle and retries it on a later wake-up
+                results["rejected"] += 1
+                return
+            if response.status_code != 200:
+                results["errors"].append(f"{cycle_id}-{index}: HTTP {response.status_code}")
+                return
+            results["upload_ack_s"].append(time.perf_counter() - start_time)
+            cycle["acked"] += 1
+            cycle["last_ack"] = time.perf_counter()
+
+
+def start_gateway(port, stub_url, upload_dir):
+    """The gateway (main.py) in a subprocess, with its state in upload_dir and forwarding to the stub."""
+    env = {**os.environ, "UPLOAD_DIR": upload_dir, "MAIN_SERVER_URL": f"{stub_url}/upload"}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=PI_DIR, env=env,
+    )
+
+
+async def wait_ready(client, gateway_url, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            response = await client.get(f"{gateway_url}/healthz")
+            if response.status_code == 200 and response.json().get("ready"):
+                return
+            if response.status_code == 503:
+                raise SystemExit("The gateway failed to load its model")
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"The gateway was not ready within {timeout}s")
+
+
+async def decided(client, gateway_url):
+    cycles = (await client.get(f"{gateway_url}/stats")).json()["cycles"]
+    return cycles["decided"] + cycles["expired"] + cycles["evicted"]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    images = []
+    for path in args.image:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    smtp = StubSMTPServer(port=0)
+    await smtp.start()
+    stub = AnalysisStub(smtp.port, args.analysis_delay)
+    stub_port = args.stub_port or free_port()
+    stub_server = uvicorn.Server(uvicorn.Config(stub.app, host=args.stub_host, port=stub_port, log_level="warning"))
+    stub_task = asyncio.create_task(stub_server.serve())
+    stub_url = f"http://{'127.0.0.1' if args.stub_host == '0.0.0.0' else args.stub_host}:{stub_port}"
+
+    gateway, upload_dir = None, None
+    gateway_url = args.gateway
+    if gateway_url is None:
+        upload_dir = tempfile.mkdtemp(prefix="benchmark_e2e_")
+        port = free_port()
+        gateway = start_gateway(port, stub_url, upload_dir)
+        gateway_url = f"http://127.0.0.1:{port}"
+    else:
+        print(f"Using the gateway at {gateway_url}; its MAIN_SERVER_URL must point at http://<this host>:{stub_port}/upload")
+
+    results = {"cycles": {}, "upload_ack_s": [], "rejected": 0, "errors": []}
+    complete, decided_cycles = 0, 0
+    try:
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.cameras)) as client:
+            await wait_ready(client, gateway_url, args.startup_timeout)
+            before = await decided(client, gateway_url)
+
+            cameras = [Camera(number, images, args.night_share, random.Random(rng.random())) for number in range(args.cameras)]
+            triggers = [trigger_times(args.pattern, args.cycles, args.interval, args.burst_size, args.burst_gap,
+                                      random.Random(rng.random())) for _ in cameras]
+            print(f"{args.cameras} cameras x {args.cycles} cycles ({args.pattern}) against {gateway_url}...", flush=True)
+            started = time.perf_counter()
+            await asyncio.gather(*(camera.run(client, f"{gateway_url}/upload", camera_triggers, started, results)
+                                   for camera, camera_triggers in zip(cameras, triggers)))
+            upload_s = time.perf_counter() - started
+
+            # Decisions, forwards and notifications happen after the uploads are acknowledged
+            complete = sum(1 for cycle in results["cycles"].values() if cycle["acked"] == IMAGES_PER_CYCLE)
+            deadline = time.perf_counter() + args.drain_timeout
+            while time.perf_counter() < deadline:
+                if await decided(client, gateway_url) - before >= complete and len(stub.notified) == len(stub.forwarded):
+                    break
+                await asyncio.sleep(0.5)
+            total_s = time.perf_counter() - started
+            stats = (await client.get(f"{gateway_url}/stats")).json()
+            decided_cycles = await decided(client, gateway_url) - before
+    finally:
+        if gateway is not None:
+            gateway.terminate()
+            gateway.wait(timeout=30)
+            shutil.rmtree(upload_dir, ignore_errors=True)
+        stub_server.should_exit = True
+        await stub_task
+        await smtp.stop()
+
+    cycles = results["cycles"]
+    forward_s = [stub.forwarded[cycle_id] - cycle["last_ack"] for cycle_id, cycle in cycles.items()
+                 if cycle_id in stub.forwarded and "last_ack" in cycle]
+    notify_s = [stub.notified[cycle_id] - cycle["first_upload"] for cycle_id, cycle in cycles.items()
+                if cycle_id in stub.notified]
+    uploads = len(results["upload_ack_s"])
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "image")},
+        "images": [os.path.basename(path) for path in args.image],
+        "duration_s": round(total_s, 3),
+        "uploads": {
+            "acked": uploads,
+            "rejected": results["rejected"],
+            "errors": len(results["errors"]),
+            "per_s": round(uploads / upload_s, 2) if upload_s else None,
+            "ack_s": percentiles(results["upload_ack_s"]),
+        },
+        "cycles": {
+            "sent": len(cycles),
+            "complete": complete,
+            "forwarded": len(stub.forwarded),
+            "decided": decided_cycles,
+            "decided_per_s": round(decided_cycles / total_s, 2) if total_s else None,
+            # Measured by the gateway, from a cycle's first upload to its decision
+            "decision_s": {key: stats["cycles"][f"decision_{key}_s"] for key in ("p50", "p95", "p99")},
+            # Last image acknowledged -> cycle received by the analysis server
+            "forward_s": percentiles(forward_s),
+            # First image sent -> notification email accepted by the SMTP sink
+            "notify_s": percentiles(notify_s),
+        },
+        "emails": len(smtp.messages),
+        "forwarded_bytes": stub.bytes,
+        "gateway": {name: stats.get(name) for name in ("scheduler", "prefilter", "transcoder", "startup")},
+        "error_samples": results["errors"][:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end benchmark: simulated ESP32 cameras -> gateway -> stub analysis server -> stub SMTP.")
+    parser.add_argument("--cameras", type=int, default=24)
+    parser.add_argument("--cycles", type=int, default=5, help="Cycles per camera")
+    parser.add_argument("--pattern", choices=PATTERNS, default="steady", help="PIR trigger pattern")
+    parser.add_argument("--interval", type=float, default=10.0, help="Mean seconds between a camera's triggers (or bursts)")
+    parser.add_argument("--burst-size", type=int, default=3, help="Cycles per burst (burst pattern)")
+    parser.add_argument("--burst-gap", type=float, default=1.0, help="Seconds between the cycles of a burst")
+    parser.add_argument("--night-share", type=float, default=0.3, help="Share of night (n) cycles")
+    parser.add_argument("--image", action="append", help="JPEG(s) the cameras send (default: test.jpg)")
+    parser.add_argument("--gateway", help="URL of a running gateway (default: start main.py locally)")
+    parser.add_argument("--stub-host", default="127.0.0.1", help="Bind address of the stub (0.0.0.0 for a remote gateway)")
+    parser.add_argument("--stub-port", type=int, help="Port of the stub (default: a free one)")
+    parser.add_argument("--analysis-delay", type=float, default=0.5, help="Simulated MegaDetector time per cycle")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--drain-timeout", type=float, default=300, help="Wait this long for decisions after the uploads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="Results are appended here, one JSON line per run")
+    args = parser.parse_args()
+    args.image = args.image or [os.path.join(PI_DIR, "test.jpg")]
+
+    result = asyncio.run(run(args))
+    with open(args.output, "a") as f:
+        f.write(json.dumps(result) + "\n")
+
+    uploads, cycles = result["uploads"], result["cycles"]
+    print(f"Uploads: {uploads['acked']} acked ({uploads['per_s']}/s), {uploads['rejected']} rejected, {uploads['errors']} errors")
+    for name, stats in (("upload ack", uploads["ack_s"]), ("decision", cycles["decision_s"]),
+                        ("forward", cycles["forward_s"]), ("notify", cycles["notify_s"])):
+        print(f"{name:>10}: " + ", ".join(f"{key} {value}s" for key, value in stats.items() if key.startswith("p")))
+    print(f"Cycles: {cycles['sent']} sent, {cycles['complete']} complete, {cycles['forwarded']} forwarded; "
+          f"{result['emails']} emails")
+    print(f"Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
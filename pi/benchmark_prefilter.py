@@ -0,0 +1,117 @@
+import csv
+import time
+import os
+import sys
+import numpy as np
+
+# Benchmark on CPU, as on the Pi
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+import cv2
+from detector import Detector, load_image
+from prefilter import MotionPrefilter
+
+# Configuration
+# Labeled sample set: SAMPLE_DIR/<camera>/<frame>.jpg, frames in capture order,
+# with optional SAMPLE_DIR/labels.csv rows "<camera>/<frame>.jpg,<1 if animal else 0>".
+# Without labels, the verdicts of the detector on whole frames are the reference.
+SAMPLE_DIR = "samples"
+# Used to synthesize a sample set if SAMPLE_DIR does not exist
+IMAGE_FILE = "test.jpg"
+# Sensitivity settings compared: (MOTION_THRESHOLD, MOTION_MIN_AREA)
+SETTINGS = [(15, 0.001), (25, 0.002), (40, 0.005)]
+
+def load_samples():
+    """[(camera, name, image)] in capture order per camera, and {name: is_animal} labels."""
+    samples = []
+    for camera in sorted(os.listdir(SAMPLE_DIR)):
+        camera_dir = os.path.join(SAMPLE_DIR, camera)
+        if not os.path.isdir(camera_dir):
+            continue
+        for frame in sorted(os.listdir(camera_dir)):
+            if frame.lower().endswith((".jpg", ".jpeg")):
+                samples.append((camera, f"{camera}/{frame}", load_image(os.path.join(camera_dir, frame))))
+
+    labels = {}
+    labels_file = os.path.join(SAMPLE_DIR, "labels.csv")
+    if os.path.exists(labels_file):
+        with open(labels_file, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) >= 2:
+                    labels[row[0]] = row[1].strip() in ("1", "true", "yes")
+    return samples, labels
+
+def synthesize_samples(num_cameras=4, num_frames=12):
+    """
+    Still frames (sensor noise and exposure drift, as on a windy day with nothing
+    there) with the scene shifting in on every fourth frame.
+    """
+    base = load_image(IMAGE_FILE)
+    h, w = base.shape[:2]
+    rng = np.random.default_rng(0)
+    samples = []
+    for camera in range(num_cameras):
+        for frame in range(num_frames):
+            image = base.astype(np.int16) + int(rng.integers(-10, 10))
+            image += rng.normal(0, 3, base.shape).astype(np.int16)
+            if frame % 4 == 3:
+                # Something moves through part of the scene
+                y, x = h // 4, w // 4
+                image[y:y + h // 2, x:x + w // 2] = cv2.flip(base[y:y + h // 2, x:x + w // 2], 1)
+            samples.append((f"CAM{camera}", f"CAM{camera}/{frame:02d}.jpg", np.clip(image, 0, 255).astype(np.uint8)))
+    return samples, {}
+
+def run(detector, samples, prefilter=None):
+    detector.prefilter = prefilter
+    verdicts = {}
+    start_time = time.perf_counter()
+    for camera, name, image in samples:
+        result = detector.predict([image], [camera] if prefilter else None)[0]
+        verdicts[name] = detector.verdict(result)[0]
+    return verdicts, time.perf_counter() - start_time
+
+def agreement(verdicts, reference):
+    names = [name for name in reference if name in verdicts]
+    return sum(verdicts[name] == reference[name] for name in names) / len(names) if names else 0.0
+
+def missed(verdicts, reference):
+    """Animal frames of the reference that the prefiltered run did not see as animals."""
+    return sum(1 for name, is_animal in reference.items() if is_animal and not verdicts[name])
+
+def main():
+    if os.path.isdir(SAMPLE_DIR):
+        samples, labels = load_samples()
+    elif os.path.exists(IMAGE_FILE):
+        print(f"'{SAMPLE_DIR}' not found, synthesizing a sample set from '{IMAGE_FILE}'")
+        samples, labels = synthesize_samples()
+    else:
+        print(f"Error: neither '{SAMPLE_DIR}' nor '{IMAGE_FILE}' found in current directory.")
+        sys.exit(1)
+    if not samples:
+        print(f"Error: no images in '{SAMPLE_DIR}'.")
+        sys.exit(1)
+
+    detector = Detector()
+    detector.warm_up()
+
+    reference, full_time = run(detector, samples)
+    print(f"{len(samples)} frames, {sum(reference.values())} with animals (whole-frame detector)")
+    print(f"{'setting':>14} {'skipped':>8} {'cropped':>8} {'ms/frame':>9} {'agree':>6} {'missed':>7}" + (f" {'labeled acc':>12}" if labels else ""))
+
+    row = f"{'no prefilter':>14} {'0%':>8} {'0%':>8} {full_time / len(samples) * 1000:>9.1f} {'100%':>6} {0:>7}"
+    if labels:
+        row += f" {agreement(reference, labels):>12.1%}"
+    print(row)
+
+    for threshold, min_area in SETTINGS:
+        prefilter = MotionPrefilter(threshold, min_area)
+        verdicts, elapsed = run(detector, samples, prefilter)
+        stats = prefilter.stats()
+        row = (f"{f'{threshold}/{min_area}':>14} {stats['still'] / len(samples):>8.1%} {stats['cropped'] / len(samples):>8.1%}"
+               f" {elapsed / len(samples) * 1000:>9.1f} {agreement(verdicts, reference):>6.1%} {missed(verdicts, reference):>7}")
+        if labels:
+            row += f" {agreement(verdicts, labels):>12.1%}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
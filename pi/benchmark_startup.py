@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import hashlib
+import subprocess
+import httpx
+
+# Configuration
+PORT = 8765
+BASE_URL = f"http://127.0.0.1:{PORT}"
+IMAGE_FILE = "test.jpg"
+CYCLE_ID = "BENCHSTARTUP-00000001"
+POLL_INTERVAL = 0.05
+TIMEOUT = 300
+
+def wait_for(predicate):
+    deadline = time.perf_counter() + TIMEOUT
+    while time.perf_counter() < deadline:
+        try:
+            if predicate():
+                return True
+        except httpx.TransportError:
+            pass
+        time.sleep(POLL_INTERVAL)
+    return False
+
+def main():
+    if not os.path.exists(IMAGE_FILE):
+        print(f"Error: '{IMAGE_FILE}' not found in current directory.")
+        sys.exit(1)
+    with open(IMAGE_FILE, "rb") as f:
+        data = f.read()
+
+    start_time = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=BASE_URL, timeout=5.0) as client:
+            # Listening: /healthz answers (the model may still be loading)
+            if not wait_for(lambda: client.get("/healthz").status_code == 200):
+                print("Server did not start listening")
+                sys.exit(1)
+            listening = time.perf_counter() - start_time
+
+            # Upload straight away; it waits in the queue until the model is ready
+            headers = {"X-Cycle-Id": CYCLE_ID, "X-Img-Index": "1", "X-File-Name": f"{CYCLE_ID}-1n.jpg",
+                       "X-Content-SHA256": hashlib.sha256(data).hexdigest()}
+            response = client.post("/upload", content=data, headers=headers)
+            print(f"Upload during startup: HTTP {response.status_code}")
+
+            wait_for(lambda: client.get("/healthz").json()["ready"])
+            ready = time.perf_counter() - start_time
+            wait_for(lambda: client.get("/stats").json()["scheduler"]["inferred"] >= 1)
+            first_inference = time.perf_counter() - start_time
+            reported = client.get("/healthz").json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"time to listen:          {listening:6.2f}s")
+    print(f"time to model ready:     {ready:6.2f}s")
+    print(f"time to first inference: {first_inference:6.2f}s")
+    print(f"reported by the server (since import of main): {reported}")
+
+if __name__ == "__main__":
+    main()
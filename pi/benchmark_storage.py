@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from wild_animals_shared.storage import ImageStore, CLASS_ANIMAL, CLASS_EMPTY
+
+# Configuration
+# Frames stored per layout; pass a smaller count as the first argument for a quick run
+NUM_FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+# Stand-in for a JPEG; small so the run measures file system and index overhead, not bandwidth
+FRAME_BYTES = 1024
+NUM_CAMERAS = 20
+NUM_DAYS = 30
+ANIMAL_SHARE = 0.1
+NUM_LOOKUPS = 10000
+# Put this on the SD card to measure the card; defaults to a temporary directory
+BENCH_DIR = os.getenv("BENCH_DIR")
+
+def frames():
+    """(filename, camera, stored_at) spread over NUM_DAYS, as NUM_CAMERAS cameras would produce them."""
+    start = time.time() - NUM_DAYS * 86400
+    for i in range(NUM_FRAMES):
+        camera = f"CAM{i % NUM_CAMERAS:02d}"
+        stored_at = start + i * NUM_DAYS * 86400 / NUM_FRAMES
+        yield f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(stored_at))}_{i:07d}_{camera}-{i // 3}-{i % 3}.jpg", camera, stored_at
+
+def rate(count, seconds):
+    return count / seconds if seconds else float("inf")
+
+def lookups(read, names):
+    latencies = []
+    for name in random.sample(names, min(NUM_LOOKUPS, len(names))):
+        start_time = time.perf_counter()
+        read(name)
+        latencies.append((time.perf_counter() - start_time) * 1e6)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+def count_files(root):
+    return sum(len(files) for _, _, files in os.walk(root))
+
+def report(layout, ingest_s, tail_rate, files, p50, p99):
+    tail = f"{tail_rate:>10.0f}" if tail_rate is not None else f"{'-':>10}"
+    print(f"{layout:>8} {rate(NUM_FRAMES, ingest_s):>10.0f} {tail} {files:>9} {p50:>9.0f} {p99:>9.0f}")
+
+def ingest(write):
+    """Write every frame; returns (total seconds, frames/s over the last 10%, as the layout fills up)."""
+    tail_from = NUM_FRAMES - NUM_FRAMES // 10
+    start_time = time.perf_counter()
+    for i, (name, camera, stored_at) in enumerate(frames()):
+        if i == tail_from:
+            tail_start = time.perf_counter()
+        write(name, camera, stored_at)
+    end_time = time.perf_counter()
+    return end_time - start_time, rate(NUM_FRAMES - tail_from, end_time - tail_start)
+
+def bench_flat(root, payload):
+    """The old layout: every upload in one directory, looked up by name."""
+    directory = os.path.join(root, "flat")
+    os.makedirs(directory)
+
+    def write(name, camera, stored_at):
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(payload)
+
+    def read(name):
+        with open(os.path.join(directory, name), "rb") as f:
+            return f.read()
+
+    ingest_s, tail_rate = ingest(write)
+    names = os.listdir(directory)
+    report("flat", ingest_s, tail_rate, len(names), *lookups(read, names))
+    shutil.rmtree(directory)
+
+def bench_store(root, payload):
+    """ImageStore: sharded loose files, then the same frames packed into segments."""
+    directory = os.path.join(root, "store")
+    store = ImageStore(directory, os.path.join(root, "store.sqlite3"), pack_after=0, grace=0, batch=5000)
+    names = []
+
+    def write(name, camera, stored_at):
+        path = store.path_for(name, camera, stored_at)
+        with open(path, "wb") as f:
+            f.write(payload)
+        store.add(name, path, camera, stored_at=stored_at)
+        names.append(name)
+
+    ingest_s, tail_rate = ingest(write)
+    report("sharded", ingest_s, tail_rate, count_files(directory), *lookups(store.read, names))
+
+    animals = set(random.sample(names, int(len(names) * ANIMAL_SHARE)))
+    store.classify(animals, CLASS_ANIMAL)
+    store.classify([name for name in names if name not in animals], CLASS_EMPTY)
+    start_time = time.perf_counter()
+    store.sweep()
+    pack_s = time.perf_counter() - start_time
+    report("packed", ingest_s + pack_s, None, count_files(directory), *lookups(store.read, names))
+    print(f"packing took {pack_s:.1f}s ({rate(NUM_FRAMES, pack_s):.0f} frames/s)")
+    store.close()
+    shutil.rmtree(directory)
+
+def main():
+    root = tempfile.mkdtemp(prefix="storage_bench_", dir=BENCH_DIR)
+    payload = os.urandom(FRAME_BYTES)
+    random.seed(0)
+    print(f"{NUM_FRAMES} frames of {FRAME_BYTES} bytes, {NUM_CAMERAS} cameras over {NUM_DAYS} days in {root}")
+    print("(lookups hit the page cache unless it is dropped between runs)")
+    print(f"{'layout':>8} {'ingest/s':>10} {'tail/s':>10} {'files':>9} {'p50 us':>9} {'p99 us':>9}")
+    try:
+        bench_flat(root, payload)
+        bench_store(root, payload)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+class BufferPool:
+    """
+    Bounded in-memory store for uploaded image bytes, keyed by filename.
+
+    Uploads are kept here from receipt until their cycle is decided, so the
+    detector and the forwarder never have to read them back from the SD card.
+    put() refuses data that would exceed max_bytes; callers then fall back to disk.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.buffers = {}
+        self.counters = {"stored": 0, "rejected": 0, "released": 0}
+
+    def has_room(self, size):
+        return self.used_bytes + size <= self.max_bytes
+
+    def put(self, key, data):
+        if key in self.buffers:
+            return True
+        if self.used_bytes + len(data) > self.max_bytes:
+            self.counters["rejected"] += 1
+            return False
+        self.buffers[key] = data
+        self.used_bytes += len(data)
+        self.counters["stored"] += 1
+        return True
+
+    def get(self, key):
+        return self.buffers.get(key)
+
+    def release(self, key):
+        data = self.buffers.pop(key, None)
+        if data is not None:
+            self.used_bytes -= len(data)
+            self.counters["released"] += 1
+
+    def stats(self):
+        return {
+            **self.counters,
+            "buffers": len(self.buffers),
+            "used_bytes": self.used_bytes,
+            "max_bytes": self.max_bytes,
+        }
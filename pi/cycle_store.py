@@ -0,0 +1,107 @@
+import time
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CycleStore:
+    """
+    Durable record of the frames of cycles that are still open.
+
+    Every admitted frame is written here (pending until its verdict arrives),
+    and a cycle's rows are deleted once it is decided, so the database only
+    ever holds open cycles. After a crash or restart, load() returns the
+    verdicts collected so far and the frames that still need inference.
+    SQLite in WAL mode, so each update is a small append to the log on the SD card.
+    add_pending(commit=False) leaves the write for the next commit(), which may
+    run in another thread, so a burst of uploads shares one commit.
+    """
+    def __init__(self, path):
+        self.path = path
+        # Used from the event loop, and by commit() from a worker thread
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            " filename TEXT PRIMARY KEY, cycle_id TEXT NOT NULL, path TEXT NOT NULL, img_index INTEGER,"
+            " digest TEXT, inferred INTEGER NOT NULL DEFAULT 0, is_animal INTEGER, label TEXT,"
+            " updated_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS frames_cycle ON frames (cycle_id)")
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def commit(self):
+        with self._lock:
+            self.db.commit()
+
+    def add_pending(self, cycle_id, filename, path, img_index=None, digest=None, commit=True):
+        """A frame was admitted and waits for its verdict."""
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO frames (filename, cycle_id, path, img_index, digest, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, cycle_id, path, img_index, digest, time.time()),
+            )
+            if commit:
+                self.db.commit()
+
+    def set_verdict(self, cycle_id, filename, path, is_animal, label, img_index=None, digest=None):
+        """The frame's verdict (None if its inference was skipped) joined its open cycle."""
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT INTO frames (filename, cycle_id, path, img_index, digest, inferred, is_animal, label, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)"
+                " ON CONFLICT (filename) DO UPDATE SET inferred = 1, is_animal = excluded.is_animal,"
+                " label = excluded.label, digest = COALESCE(excluded.digest, digest), updated_at = excluded.updated_at",
+                (filename, cycle_id, path, img_index, digest, None if is_animal is None else int(is_animal),
+                 label, time.time()),
+            )
+
+    def remove_frame(self, filename):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM frames WHERE filename = ?", (filename,))
+
+    def remove_cycle(self, cycle_id):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM frames WHERE cycle_id = ?", (cycle_id,))
+
+    def load(self):
+        """
+        Returns (cycles, pending):
+        cycles: { cycle_id: {'files': [file_info, ...], 'started': ..., 'last_update': epoch seconds} } with the inferred frames
+        pending: [{'cycle_id', 'path', 'filename', 'index', 'digest'}, ...] frames admitted but never inferred
+        """
+        cycles, pending = {}, []
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT cycle_id, filename, path, img_index, digest, inferred, is_animal, label, updated_at"
+                " FROM frames ORDER BY updated_at"
+            ).fetchall()
+        for cycle_id, filename, path, img_index, digest, inferred, is_animal, label, updated_at in rows:
+            if not inferred:
+                pending.append({'cycle_id': cycle_id, 'path': path, 'filename': filename,
+                                'index': img_index, 'digest': digest})
+                continue
+            cycle = cycles.setdefault(cycle_id, {'files': [], 'started': updated_at, 'last_update': updated_at})
+            cycle['last_update'] = max(cycle['last_update'], updated_at)
+            cycle['files'].append({
+                'path': path,
+                'filename': filename,
+                'index': img_index,
+                'is_animal': None if is_animal is None else bool(is_animal),
+                'label': label,
+                'digest': digest,
+            })
+        return cycles, pending
+
+    def stats(self):
+        with self._lock:
+            (frames, cycles) = self.db.execute("SELECT COUNT(*), COUNT(DISTINCT cycle_id) FROM frames").fetchone()
+        return {"frames": frames, "cycles": cycles}
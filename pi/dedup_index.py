@@ -0,0 +1,170 @@
+import time
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Lifecycle of an indexed upload
+STATE_PENDING = "pending"    # admitted, verdict not known yet
+STATE_INFERRED = "inferred"  # verdict known and held by an open cycle in memory
+STATE_CACHED = "cached"      # verdict known, but its open cycle was lost in a restart
+STATE_DECIDED = "decided"    # its cycle has been decided (and forwarded if it passed)
+
+
+class DedupRecord:
+    def __init__(self, sha256, cycle_id, img_index, filename, file_path, is_animal, label, state):
+        self.sha256 = sha256
+        self.cycle_id = cycle_id
+        self.img_index = img_index
+        self.filename = filename
+        self.file_path = file_path
+        self.is_animal = is_animal
+        self.label = label
+        self.state = state
+
+    @property
+    def has_verdict(self):
+        return self.state != STATE_PENDING
+
+
+class DedupIndex:
+    """
+    Persistent content-addressed index of uploads, keyed by SHA-256.
+
+    The ESP32 re-uploads a whole cycle if any part of it was not acknowledged,
+    so the gateway sees the same JPEG more than once. The index remembers each
+    upload's cycle and verdict in SQLite so duplicates can be acknowledged
+    without saving or inferring them again, across restarts too. It holds at
+    most max_entries uploads; the least recently seen are evicted first.
+    A lookup only notes the time in memory; it is written with the next change.
+    add(commit=False) leaves the write for the next commit(), which may run in
+    another thread, so a burst of uploads shares one commit.
+    """
+    def __init__(self, path, max_entries=20000):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.counters = {"indexed": 0, "duplicates": 0, "verdicts_reused": 0, "evicted": 0}
+        # Used from the event loop, and by commit() from a worker thread
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # WAL: commits append to the log instead of rewriting pages on the SD card
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " sha256 TEXT PRIMARY KEY, cycle_id TEXT, img_index INTEGER, filename TEXT, file_path TEXT,"
+            " is_animal INTEGER, label TEXT, state TEXT NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS uploads_cycle ON uploads (cycle_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS uploads_last_seen ON uploads (last_seen)")
+        # { sha256: last_seen } of lookups since the last write
+        self._seen = {}
+        self._recover()
+        # Kept up to date by every insert and delete, so eviction never counts the table
+        (self._entries,) = self.db.execute("SELECT COUNT(*) FROM uploads").fetchone()
+
+    def _recover(self):
+        with self.db:
+            # Inference that was in flight at shutdown is lost; let retries run it again
+            dropped = self.db.execute("DELETE FROM uploads WHERE state = ?", (STATE_PENDING,)).rowcount
+            # Open cycles were only held in memory
+            cached = self.db.execute("UPDATE uploads SET state = ? WHERE state = ?",
+                                     (STATE_CACHED, STATE_INFERRED)).rowcount
+        if dropped or cached:
+            logger.info(f"Dedup index: dropped {dropped} unfinished upload(s), {cached} verdict(s) kept from open cycles")
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def commit(self):
+        """Commit the writes left pending, with the last_seen times of lookups since the last one."""
+        with self._lock, self.db:
+            self._write_seen()
+
+    def _write_seen(self):
+        """Write the last_seen times noted by lookups; call inside a transaction."""
+        if self._seen:
+            self.db.executemany("UPDATE uploads SET last_seen = ? WHERE sha256 = ?",
+                                [(seen, sha256) for sha256, seen in self._seen.items()])
+            self._seen.clear()
+
+    def lookup(self, sha256):
+        with self._lock:
+            row = self.db.execute(
+                "SELECT sha256, cycle_id, img_index, filename, file_path, is_animal, label, state"
+                " FROM uploads WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        if row is None:
+            return None
+        self._seen[sha256] = time.time()
+        is_animal = None if row[5] is None else bool(row[5])
+        return DedupRecord(*row[:5], is_animal, row[6], row[7])
+
+    def add(self, sha256, cycle_id, img_index, filename, file_path, verdict=None, commit=True):
+        """
+        Index a newly admitted upload. verdict is (is_animal, label) if it is
+        already known (reused from an identical upload), else the upload is pending.
+        """
+        is_animal, label = verdict if verdict is not None else (None, None)
+        state = STATE_INFERRED if verdict is not None else STATE_PENDING
+        with self._lock:
+            known = self.db.execute("SELECT 1 FROM uploads WHERE sha256 = ?", (sha256,)).fetchone() is not None
+            self._seen.pop(sha256, None)
+            self.db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (sha256, cycle_id, img_index, filename, file_path, _as_int(is_animal), label, state, time.time()),
+            )
+            if not known:
+                self._entries += 1
+            self._evict()
+            if commit:
+                self.db.commit()
+        self.counters["indexed"] += 1
+
+    def record_verdict(self, sha256, is_animal, label):
+        with self._lock, self.db:
+            self.db.execute("UPDATE uploads SET is_animal = ?, label = ?, state = ? WHERE sha256 = ?",
+                            (_as_int(is_animal), label, STATE_INFERRED, sha256))
+
+    def mark_inferred(self, sha256):
+        """A cached verdict has been put back into an open cycle."""
+        with self._lock, self.db:
+            self.db.execute("UPDATE uploads SET state = ? WHERE sha256 = ?", (STATE_INFERRED, sha256))
+
+    def mark_decided(self, cycle_id):
+        with self._lock, self.db:
+            self.db.execute("UPDATE uploads SET state = ? WHERE cycle_id = ?", (STATE_DECIDED, cycle_id))
+
+    def discard(self, sha256):
+        """Forget an upload that was not processed, so a retry is treated as new."""
+        with self._lock, self.db:
+            self._seen.pop(sha256, None)
+            self._entries -= self.db.execute("DELETE FROM uploads WHERE sha256 = ?", (sha256,)).rowcount
+
+    def count_duplicate(self, reused_verdict=False):
+        self.counters["duplicates"] += 1
+        if reused_verdict:
+            self.counters["verdicts_reused"] += 1
+
+    def _evict(self):
+        """Delete the least recently seen uploads over max_entries; call holding the lock, commits are up to the caller."""
+        excess = self._entries - self.max_entries
+        if excess <= 0:
+            return
+        # Uploads looked up lately must not look older than they are
+        self._write_seen()
+        evicted = self.db.execute(
+            "DELETE FROM uploads WHERE sha256 IN (SELECT sha256 FROM uploads ORDER BY last_seen LIMIT ?)",
+            (excess,),
+        ).rowcount
+        self._entries -= evicted
+        self.counters["evicted"] += evicted
+
+    def stats(self):
+        return {**self.counters, "entries": self._entries, "max_entries": self.max_entries}
+
+
+def _as_int(is_animal):
+    return None if is_animal is None else int(is_animal)
@@ -1,39 +1,220 @@
-from ultralytics import YOLO
+import time
 import cv2
+import numpy as np
+from backends import load_backend, Detections, BACKEND_TORCH, IMAGE_SIZE, CONF_THRESHOLD
+from wild_animals_shared.jpeg import REDUCED_DECODE_FLAGS, jpeg_size, reduction_for
+
+# COCO classes: 14: bird, 15: cat, 16: dog, 17: horse, 18: sheep,
+# 19: cow, 20: elephant, 21: bear, 22: zebra, 23: giraffe
+ANIMAL_CLASSES = [14, 15, 16, 17, 18, 19, 20, 21, 22, 23]
+
+
+def decode_image(data):
+    """Decode JPEG bytes into a BGR numpy array, as cv2.imread would."""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image bytes")
+    return image
+
+
+def decode_reduced(data, target):
+    """
+    Decode JPEG bytes straight to the smallest 1/2, 1/4 or 1/8 scale whose long
+    side still reaches target pixels; libjpeg then never builds the full-size image.
+    Returns (image, scale): multiply image coordinates by scale for full-resolution pixels.
+    """
+    size = jpeg_size(data)
+    factor = reduction_for(*size, target) if size else 1
+    if factor == 1:
+        return decode_image(data), 1.0
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_DECODE_FLAGS[factor])
+    if image is None:
+        raise ValueError("Could not decode image bytes")
+    # Long sides, since EXIF orientation may have rotated the decoded image
+    return image, max(size) / max(image.shape[:2])
+
+
+def load_image_for_inference(source, target):
+    """Like load_image, but JPEG sources are decoded at reduced size; returns (image, scale)."""
+    if isinstance(source, np.ndarray):
+        return source, 1.0
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        with open(source, "rb") as f:
+            source = f.read()
+    return decode_reduced(bytes(source), target)
+
+
+def load_image(source):
+    """Accept a file path, encoded bytes or an already decoded array."""
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(source)
+    image = cv2.imread(source)
+    if image is None:
+        raise ValueError(f"Could not read image {source}")
+    return image
+
+
+def draw_detections(image, detections, names):
+    """Draw every detection onto a copy of the image (animals in red)."""
+    annotated = image.copy()
+    for (x1, y1, x2, y2), cls, conf in zip(detections.boxes, detections.classes, detections.confidences):
+        color = (0, 0, 255) if cls in ANIMAL_CLASSES else (255, 128, 0)
+        cv2.rectangle(annotated, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+        text = f"{names.get(int(cls), cls)} {conf:.2f}"
+        cv2.putText(annotated, text, (int(x1), max(int(y1) - 6, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    return annotated
+
+
+def empty_detections():
+    return Detections(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int))
+
 
 class Detector:
-    def __init__(self):
-        # Load a model
-        # The model will be downloaded automatically on first use
-        self.model = YOLO("yolov8n.pt") 
+    """
+    YOLOv8n animal detector.
+
+    backend is "torch" (ultralytics + PyTorch), "onnx" (ONNX Runtime) or
+    "openvino"; the exported models are created once from weights and cached
+    in cache_dir. int8 selects an INT8-quantized export. If the backend cannot
+    be used, PyTorch is used instead. Detections below conf are discarded.
+    With a prefilter (see prefilter.MotionPrefilter), predict() only runs the
+    network on the changed region of frames whose camera is known.
+    With reduced_decode, JPEGs are decoded at the smallest DCT scale that still
+    covers the network input size; boxes are always in full-resolution pixels.
+    set_image_size() and set_num_threads() change the input size and thread
+    count between batches, where the backend allows it (can_resize, can_set_threads).
+    observe(stage, seconds), if given, receives the decode time of every image
+    and the inference time of every batch.
+    """
+    def __init__(self, backend=BACKEND_TORCH, weights="yolov8n.pt", int8=False, cache_dir="models", num_threads=0,
+                 prefilter=None, reduced_decode=True, observe=None, conf=CONF_THRESHOLD):
+        # The .pt weights are downloaded automatically on first use
+        self.backend = load_backend(backend, weights, int8=int8, cache_dir=cache_dir, conf=conf, num_threads=num_threads)
+        self.names = self.backend.names
+        self.prefilter = prefilter
+        self.reduced_decode = reduced_decode
+        self.observe = observe
+        self.input_size = getattr(self.backend, "image_size", IMAGE_SIZE)
+
+    @property
+    def can_resize(self):
+        return getattr(self.backend, "resizable", False)
+
+    @property
+    def can_set_threads(self):
+        return getattr(self.backend, "threads_adjustable", False)
+
+    def set_image_size(self, size):
+        """Network input size (a multiple of 32) from the next batch on."""
+        if not self.can_resize:
+            raise ValueError(f"The {self.backend.name} model has a fixed input size")
+        self.backend.image_size = size
+        self.input_size = size
+
+    def set_num_threads(self, num_threads):
+        """Inference threads from the next batch on. Blocking (ONNX Runtime builds a new session)."""
+        if not self.can_set_threads:
+            raise ValueError(f"The {self.backend.name} backend's thread count cannot be changed")
+        self.backend.set_num_threads(num_threads)
+
+    def warm_up(self, shape=(480, 640, 3)):
+        """Run one inference on a blank image so the first real one is not slowed down by setup."""
+        self.detect_batch([np.zeros(shape, dtype=np.uint8)])
 
     def detect(self, image_path, save_path=None):
-        results = self.model(image_path)
-        is_animal_detected = False
-        label_detected = None
+        return self.detect_batch([image_path], [save_path])[0]
 
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                cls = int(box.cls[0])
-                label = self.model.names[cls]
-                # Filter for animals
-                # COCO classes: 14: bird, 15: cat, 16: dog, 17: horse, 18: sheep, 
-                # 19: cow, 20: elephant, 21: bear, 22: zebra, 23: giraffe
-                animal_classes = [14, 15, 16, 17, 18, 19, 20, 21, 22, 23]
-                if cls in animal_classes: 
-                    is_animal_detected = True
-                    label_detected = label
-                    break # Return first detected animal
-            
-            # Save result image if requested
+    def detect_batch(self, sources, save_paths=None):
+        """
+        Run one batched forward pass over several images.
+        Each source is a file path or the uploaded JPEG bytes (decoded once here,
+        without touching the SD card).
+        Returns a list of (is_animal_detected, label_detected), one per input,
+        identical to what detect() returns for each image on its own.
+        An annotated image is only written for inputs with a save path.
+        """
+        if not sources:
+            return []
+        if save_paths is None:
+            save_paths = [None] * len(sources)
+
+        detections = self.predict(sources)
+        for result, source, save_path in zip(detections, sources, save_paths):
             if save_path:
-                # plot() returns a numpy array (BGR)
-                annotated_frame = result.plot()
-                cv2.imwrite(save_path, annotated_frame)
+                cv2.imwrite(save_path, draw_detections(load_image(source), result, self.names))
+        return [self.verdict(result) for result in detections]
 
-            if is_animal_detected:
-                break
+    def predict(self, sources, cameras=None):
+        """
+        Raw detections (boxes, classes, confidences) for a batch of images, without rendering anything.
+        cameras gives the camera of each image for the prefilter (None: always run the network).
+        """
+        if not sources:
+            return []
+        images, scales = [], []
+        for source in sources:
+            start_time = time.perf_counter()
+            if self.reduced_decode:
+                image, scale = load_image_for_inference(source, self.input_size)
+            else:
+                image, scale = load_image(source), 1.0
+            self._observe("decode", start_time)
+            images.append(image)
+            scales.append(scale)
 
-        return is_animal_detected, label_detected
+        start_time = time.perf_counter()
+        detections = self._predict(images, cameras)
+        self._observe("inference", start_time)
+        for result, scale in zip(detections, scales):
+            if scale != 1.0:
+                result.boxes *= scale
+        return detections
 
+    def _observe(self, stage, start_time):
+        if self.observe is not None:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def _predict(self, images, cameras):
+        if self.prefilter is None or cameras is None:
+            return self.backend.predict(list(images))
+
+        regions, samples = [], []
+        for camera, image in zip(cameras, images):
+            region, sample = (self.prefilter.region(camera, image) if camera is not None
+                              else ((0, 0, image.shape[1], image.shape[0]), None))
+            regions.append(region)
+            samples.append(sample)
+        # Frames without significant change are empty; the rest run on their changed region only
+        detections = [empty_detections() if region is None else None for region in regions]
+        run = [i for i, region in enumerate(regions) if region is not None]
+        if run:
+            crops = [images[i][regions[i][1]:regions[i][3], regions[i][0]:regions[i][2]] for i in run]
+            for i, result in zip(run, self.backend.predict(crops)):
+                x1, y1 = regions[i][:2]
+                result.boxes[:, [0, 2]] += x1
+                result.boxes[:, [1, 3]] += y1
+                detections[i] = result
+        # Only empty frames update the background, so an animal that stays put is still seen
+        for camera, sample, result in zip(cameras, samples, detections):
+            if sample is not None and not any(int(cls) in ANIMAL_CLASSES for cls in result.classes):
+                self.prefilter.learn(camera, sample)
+        return detections
+
+    def verdict(self, detections):
+        """(is_animal_detected, label_detected) for one image's detections."""
+        is_animal_detected = False
+        label_detected = None
+
+        # Detections are sorted by confidence
+        for cls in detections.classes:
+            cls = int(cls)
+            label = self.names[cls]
+            # Filter for animals
+            if cls in ANIMAL_CLASSES:
+                is_animal_detected = True
+                label_detected = label
+                break # Return first detected animal
+
+        return is_animal_detected, label_detected
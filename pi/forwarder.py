@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import httpx
+from wild_animals_shared.telemetry import TRACE_HEADER, trace_id, traced
+
+logger = logging.getLogger(__name__)
+
+
+# Forwarding modes
+MODE_BUNDLE = "bundle"  # one multipart request per cycle to /upload_cycle
+MODE_IMAGE = "image"    # one request per image to /upload
+
+
+def bundle_url_for(url):
+    """Derive the analysis server's /upload_cycle endpoint from its /upload URL."""
+    if url and url.rstrip("/").endswith("/upload"):
+        return url.rstrip("/") + "_cycle"
+    return None
+
+
+class Forwarder:
+    """
+    Forwards the images of passing cycles to the analysis server.
+
+    In bundle mode a cycle goes out as a single multipart request carrying all of
+    its images plus the gateway's verdicts; in image mode (or if the server has no
+    bundle endpoint) the images are sent separately, in parallel, at most
+    max_concurrency at a time. One long-lived httpx client (keep-alive, optionally
+    HTTP/2) is shared by all sends. Cycles that could not be delivered are written
+    to a durable retry queue in retry_dir and retried with exponential backoff
+    until the uplink is back. Every request carries the Cycle ID as its trace ID.
+    """
+    def __init__(self, url, retry_dir, read_image, max_concurrency=3, http2=False, timeout=30.0,
+                 retry_initial=10.0, retry_max=1800.0, retry_poll=5.0, mode=MODE_BUNDLE, bundle_url=None, on_sent=None):
+        self.url = url
+        self.bundle_url = bundle_url or bundle_url_for(url)
+        self.mode = mode if self.bundle_url else MODE_IMAGE
+        self.retry_dir = retry_dir
+        # async read_image(path, filename) -> bytes
+        self.read_image = read_image
+        # on_sent(filename), once an image has reached the server
+        self.on_sent = on_sent
+        self.max_concurrency = max(1, max_concurrency)
+        self.http2 = http2
+        self.timeout = timeout
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.retry_poll = retry_poll
+        self.counters = {"sent": 0, "bundles_sent": 0, "failed": 0, "dropped": 0, "queued_for_retry": 0, "retried": 0,
+                         "set_aside": 0}
+        self.client = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._retry_task = None
+        os.makedirs(self.retry_dir, exist_ok=True)
+
+    async def start(self):
+        if not self.url:
+            logger.info("MAIN_SERVER_URL not set, forwarding disabled.")
+            return
+
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401  (httpx needs it for HTTP/2)
+            except ImportError:
+                logger.warning("FORWARD_HTTP2 requested but the 'h2' package is not installed, using HTTP/1.1")
+                http2 = False
+
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        self.client = httpx.AsyncClient(http2=http2, limits=limits, timeout=self.timeout)
+        self._retry_task = asyncio.create_task(self._retry_loop())
+
+    async def stop(self):
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            try:
+                await self._retry_task
+            except asyncio.CancelledError:
+                pass
+            self._retry_task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def stats(self):
+        return {**self.counters, "retry_queue": len(self._retry_files())}
+
+    async def forward_cycle(self, cycle_id, files):
+        """
+        Send every image of a cycle.
+        files: [{'path': str, 'filename': str, 'index': int, 'is_animal': bool, 'label': str}, ...]
+        Images that fail with a retryable error are queued for retry.
+        """
+        if self.client is None:
+            logger.info("MAIN_SERVER_URL not set, skipping forwarding.")
+            return
+
+        failed = await self._deliver(cycle_id, files)
+        if failed:
+            self._enqueue_retry(cycle_id, failed)
+
+    async def _deliver(self, cycle_id, files):
+        """Send a cycle and return the images that should be retried later."""
+        with traced(cycle_id):
+            if self.mode == MODE_BUNDLE:
+                ok = await self._send_bundle(cycle_id, files)
+                if ok is not False:
+                    return [] if ok else files
+                # The server has no bundle endpoint (or refused the bundle); fall back to single images
+
+            results = await asyncio.gather(*(self._send(f['path'], f['filename']) for f in files))
+            return [f for f, ok in zip(files, results) if ok is None]
+
+    async def _send_bundle(self, cycle_id, files):
+        """
+        Returns True on success, False if the server cannot take bundles
+        and None if the send should be retried later.
+        """
+        logger.info(f"Forwarding cycle {cycle_id} ({len(files)} images) to {self.bundle_url}")
+        try:
+            contents = await asyncio.gather(*(self.read_image(f['path'], f['filename']) for f in files))
+        except (OSError, ValueError) as e:
+            # Sent one by one instead, so only the unreadable images are dropped
+            logger.error(f"Cannot bundle cycle {cycle_id}: {e}")
+            return False
+
+        manifest = {
+            "cycle_id": cycle_id,
+            "images": [
+                {"filename": f['filename'], "index": f.get('index'), "is_animal": f.get('is_animal'), "label": f.get('label')}
+                for f in files
+            ],
+        }
+        multipart = [("files", (f['filename'], content, "image/jpeg")) for f, content in zip(files, contents)]
+        try:
+            response = await self.client.post(self.bundle_url, data={"manifest": json.dumps(manifest)}, files=multipart,
+                                              headers={TRACE_HEADER: cycle_id})
+            response.raise_for_status()
+            logger.info(f"Successfully forwarded cycle {cycle_id}. Status: {response.status_code}")
+            self.counters["bundles_sent"] += 1
+            self.counters["sent"] += len(files)
+            for f in files:
+                self._sent(f['filename'])
+            return True
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code < 500:
+                logger.warning(f"Server rejected bundle for cycle {cycle_id} ({e.response.status_code}), sending images separately")
+                return False
+            self.counters["failed"] += 1
+            logger.error(f"Failed to forward cycle {cycle_id}: {e}")
+            return None
+        except httpx.HTTPError as e:
+            self.counters["failed"] += 1
+            logger.error(f"Failed to forward cycle {cycle_id}: {e}")
+            return None
+
+    def _sent(self, filename):
+        if self.on_sent is not None:
+            self.on_sent(filename)
+
+    async def _send(self, file_path, filename):
+        """
+        Returns True on success, False if the server rejected the image for good
+        and None if the send should be retried later.
+        """
+        async with self._semaphore:
+            logger.info(f"Forwarding {filename} to {self.url}")
+            try:
+                content = await self.read_image(file_path, filename)
+            except FileNotFoundError:
+                logger.error(f"Cannot forward {filename}: {file_path} no longer exists")
+                self.counters["dropped"] += 1
+                return False
+            except (OSError, ValueError) as e:
+                # Unreadable (permissions, a damaged segment, an undecodable image); retrying will not help
+                logger.error(f"Cannot forward {filename}: {e}")
+                self.counters["dropped"] += 1
+                return False
+
+            try:
+                files = {"file": (filename, content, "image/jpeg")}
+                # Note: External server (server.py) expects just the file.
+                response = await self.client.post(self.url, files=files, headers={TRACE_HEADER: trace_id.get()})
+                response.raise_for_status()
+                logger.info(f"Successfully forwarded {filename}. Status: {response.status_code}")
+                self.counters["sent"] += 1
+                self._sent(filename)
+                return True
+            except httpx.HTTPStatusError as e:
+                self.counters["failed"] += 1
+                if e.response.status_code < 500:
+                    # Retrying will not change a client error
+                    logger.error(f"Server rejected {filename}: {e}")
+                    self.counters["dropped"] += 1
+                    return False
+                logger.error(f"Failed to forward {filename}: {e}")
+                return None
+            except httpx.HTTPError as e:
+                self.counters["failed"] += 1
+                logger.error(f"Failed to forward {filename}: {e}")
+                return None
+
+    def _retry_path(self, cycle_id):
+        return os.path.join(self.retry_dir, f"{cycle_id}.json")
+
+    def _retry_files(self):
+        try:
+            return [name for name in os.listdir(self.retry_dir) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+
+    def _write_record(self, path, record):
+        # Write-then-rename so a crash never leaves a truncated record behind
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def _enqueue_retry(self, cycle_id, files):
+        path = self._retry_path(cycle_id)
+        keys = ('path', 'filename', 'index', 'is_animal', 'label')
+        entries = [{key: f.get(key) for key in keys} for f in files]
+        record = {"cycle_id": cycle_id, "files": [], "attempts": 0}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                pass
+        known = {f['filename'] for f in record["files"]}
+        record["files"] += [f for f in entries if f['filename'] not in known]
+        record["next_attempt"] = time.time() + self.retry_initial
+        self._write_record(path, record)
+        self.counters["queued_for_retry"] += len(files)
+        logger.warning(f"Queued {len(files)} image(s) of cycle {cycle_id} for retry")
+
+    async def _retry_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.retry_poll)
+                for name in self._retry_files():
+                    try:
+                        await self._retry(name)
+                    except Exception as e:
+                        # One bad record must not stop the queue
+                        logger.error(f"Retry record {name} failed, setting it aside: {e!r}")
+                        self._set_aside(name)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            logger.critical(f"Forward retry loop stopped, queued cycles will not be retried: {e!r}")
+            raise
+
+    async def _retry(self, name):
+        path = os.path.join(self.retry_dir, name)
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Discarding unreadable retry record {name}: {e}")
+            os.remove(path)
+            return
+
+        if record["next_attempt"] > time.time():
+            return
+
+        self.counters["retried"] += len(record["files"])
+        remaining = await self._deliver(record["cycle_id"], record["files"])
+        if not remaining:
+            logger.info(f"Retry of cycle {record['cycle_id']} complete")
+            os.remove(path)
+            return
+
+        record["files"] = remaining
+        record["attempts"] += 1
+        delay = min(self.retry_max, self.retry_initial * 2 ** record["attempts"])
+        record["next_attempt"] = time.time() + delay
+        self._write_record(path, record)
+        logger.warning(f"Retry of cycle {record['cycle_id']} failed ({len(remaining)} image(s) left), next attempt in {delay:.0f}s")
+
+    def _set_aside(self, name):
+        """Rename a record the retry loop cannot handle to *.bad, out of the queue but kept for inspection."""
+        path = os.path.join(self.retry_dir, name)
+        self.counters["set_aside"] += 1
+        try:
+            os.replace(path, f"{path}.bad")
+        except OSError as e:
+            logger.error(f"Could not set aside retry record {name}: {e}")
@@ -1,14 +1,35 @@
+import time
+
+# Process start, for the startup timings reported by /healthz
+STARTED_AT = time.perf_counter()
+
 import os
 import datetime
 import asyncio
 import logging
 import re
-from collections import defaultdict
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks
+import hashlib
+import sqlite3
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, Response
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from dotenv import load_dotenv
 import aiofiles
-import httpx
 from detector import Detector
+from backends import BACKEND_ONNX
+from scheduler import InferenceScheduler, ConcurrencyLimit, QueueFullError, JobShedError, decide_cycle, camera_of, CYCLE_SIZE
+from adaptive import AdaptiveController, ThermalSource, Knob, THERMAL_ZONE, CPUFREQ_DIR
+from buffer_pool import BufferPool
+from forwarder import Forwarder
+from transcoder import Transcoder
+from wild_animals_shared.storage import ImageStore, CLASS_ANIMAL, CLASS_EMPTY
+from dedup_index import DedupIndex, STATE_CACHED
+from annotations import AnnotationStore
+from cycle_store import CycleStore
+from prefilter import MotionPrefilter
+from wild_animals_shared.telemetry import Registry, setup_logging, trace_id, traced
 
 # Load environment variables
 load_dotenv()
@@ -18,79 +39,583 @@ load_dotenv()
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 # Optional: URL to forward images to (if not set in .env, forwarding is skipped)
 MAIN_SERVER_URL = os.getenv("MAIN_SERVER_URL")
+# Detector backend: "onnx" (ONNX Runtime), "openvino" or "torch" (PyTorch, also the
+# fallback). Exported models are created once and cached in MODEL_CACHE_DIR
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "onnx")
+DETECTOR_INT8 = os.getenv("DETECTOR_INT8", "false").lower() in ("1", "true", "yes")
+DETECTOR_THREADS = int(os.getenv("DETECTOR_THREADS", 0))
+# Decode uploads at 1/2, 1/4 or 1/8 scale (whichever still covers the model input) instead of full size
+DETECTOR_REDUCED_DECODE = os.getenv("DETECTOR_REDUCED_DECODE", "true").lower() in ("1", "true", "yes")
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "models")
+# Motion prefilter (off by default, as the frames it drops are never seen by YOLO):
+# frames that differ from the camera's recent empty frames by less than MOTION_MIN_AREA
+# (share of pixels changed by more than MOTION_THRESHOLD grey levels) are treated as
+# empty without running YOLO; the rest run on the changed region only
+MOTION_PREFILTER = os.getenv("MOTION_PREFILTER", "false").lower() in ("1", "true", "yes")
+MOTION_THRESHOLD = int(os.getenv("MOTION_THRESHOLD", 25))
+MOTION_MIN_AREA = float(os.getenv("MOTION_MIN_AREA", 0.002))
+# Micro-batching: up to BATCH_MAX_SIZE pending images, or whatever arrived
+# within BATCH_MAX_WAIT_MS of the first one, go through YOLO as one batch
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 4))
+BATCH_MAX_WAIT_MS = int(os.getenv("BATCH_MAX_WAIT_MS", 50))
+# Bounded inference queue: at most QUEUE_MAX_DEPTH images wait for the detector.
+# When full, QUEUE_POLICY is "reject", "drop-oldest-cycle" or "prefer-complete-cycles";
+# refused uploads get 503 with Retry-After: QUEUE_RETRY_AFTER seconds
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", 32))
+QUEUE_POLICY = os.getenv("QUEUE_POLICY", "prefer-complete-cycles")
+QUEUE_RETRY_AFTER = int(os.getenv("QUEUE_RETRY_AFTER", 30))
+# Adaptive inference: every ADAPTIVE_INTERVAL seconds, one of the detector threads,
+# batch size, input size and concurrent batches moves one step within the bounds below.
+# Down when the CPU reaches THERMAL_HIGH_C or is throttled (below THROTTLE_FREQ_RATIO of
+# its maximum clock), up when it is at most THERMAL_LOW_C and the queue is at least
+# ADAPTIVE_QUEUE_HIGH full (or inference takes over ADAPTIVE_LATENCY_TARGET_MS per image),
+# back to DETECTOR_THREADS / BATCH_MAX_SIZE / the model's input size / 1 otherwise.
+# THERMAL_ZONE and CPUFREQ_DIR are read from sysfs (point them elsewhere to test)
+ADAPTIVE_INFERENCE = os.getenv("ADAPTIVE_INFERENCE", "true").lower() in ("1", "true", "yes")
+ADAPTIVE_INTERVAL = float(os.getenv("ADAPTIVE_INTERVAL", 15))
+THERMAL_ZONE_PATH = os.getenv("THERMAL_ZONE", THERMAL_ZONE)
+CPUFREQ_PATH = os.getenv("CPUFREQ_DIR", CPUFREQ_DIR)
+THERMAL_HIGH_C = float(os.getenv("THERMAL_HIGH_C", 75))
+THERMAL_LOW_C = float(os.getenv("THERMAL_LOW_C", 65))
+THROTTLE_FREQ_RATIO = float(os.getenv("THROTTLE_FREQ_RATIO", 0.9))
+ADAPTIVE_QUEUE_HIGH = float(os.getenv("ADAPTIVE_QUEUE_HIGH", 0.5))
+ADAPTIVE_LATENCY_TARGET_MS = float(os.getenv("ADAPTIVE_LATENCY_TARGET_MS", 0))
+ADAPTIVE_THREADS_MIN = int(os.getenv("ADAPTIVE_THREADS_MIN", 1))
+ADAPTIVE_THREADS_MAX = int(os.getenv("ADAPTIVE_THREADS_MAX", os.cpu_count() or 1))
+ADAPTIVE_BATCH_MIN = int(os.getenv("ADAPTIVE_BATCH_MIN", 1))
+ADAPTIVE_BATCH_MAX = int(os.getenv("ADAPTIVE_BATCH_MAX", BATCH_MAX_SIZE * 2))
+# Input sizes are multiples of 32, stepped by ADAPTIVE_IMAGE_SIZE_STEP
+ADAPTIVE_IMAGE_SIZE_MIN = int(os.getenv("ADAPTIVE_IMAGE_SIZE_MIN", 320))
+ADAPTIVE_IMAGE_SIZE_STEP = int(os.getenv("ADAPTIVE_IMAGE_SIZE_STEP", 64))
+# Concurrent batches above 1 need a thread-safe backend (ONNX Runtime); others stay at 1
+ADAPTIVE_CONCURRENCY_MAX = int(os.getenv("ADAPTIVE_CONCURRENCY_MAX", 1))
+# Uploads are kept in memory (up to this many MB) until their cycle is decided,
+# so inference and forwarding never re-read them from the SD card
+BUFFER_POOL_MB = int(os.getenv("BUFFER_POOL_MB", 64))
+# Forwarding: parallel sends per cycle over one pooled client, with a durable retry queue
+FORWARD_CONCURRENCY = int(os.getenv("FORWARD_CONCURRENCY", 3))
+FORWARD_HTTP2 = os.getenv("FORWARD_HTTP2", "false").lower() in ("1", "true", "yes")
+FORWARD_RETRY_DIR = os.getenv("FORWARD_RETRY_DIR", os.path.join(UPLOAD_DIR, "forward_queue"))
+# "bundle": one request per cycle (images + verdicts) to the server's /upload_cycle,
+# "image": one request per image to MAIN_SERVER_URL
+FORWARD_MODE = os.getenv("FORWARD_MODE", "bundle")
+# Defaults to MAIN_SERVER_URL with /upload replaced by /upload_cycle
+MAIN_SERVER_BUNDLE_URL = os.getenv("MAIN_SERVER_BUNDLE_URL")
+# Re-encoding of forwarded images to save uplink bytes: "original" (as uploaded),
+# "megadetector" (1280 px, quality 80), "compact" (960 px, quality 70) or
+# "crop" (animal boxes plus FORWARD_CROP_MARGIN, 1280 px, quality 80).
+# Originals stay on the gateway and are served on /original/{filename}
+FORWARD_PROFILE = os.getenv("FORWARD_PROFILE", "megadetector")
+FORWARD_CROP_MARGIN = float(os.getenv("FORWARD_CROP_MARGIN", 0.2))
+FORWARD_TRANSCODE_WORKERS = int(os.getenv("FORWARD_TRANSCODE_WORKERS", 1))
+
+# Content-hash index of uploads (survives restarts): re-sent images are acknowledged
+# without being saved or inferred again. Holds at most DEDUP_MAX_ENTRIES uploads
+DEDUP_DB = os.getenv("DEDUP_DB", os.path.join(UPLOAD_DIR, "dedup.sqlite3"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", 20000))
+
+# Open cycles are kept in CYCLE_DB so a restart loses no verdict. A cycle that gets
+# no image for CYCLE_TTL seconds is decided with what it has (checked every
+# CYCLE_SWEEP_INTERVAL seconds); at most CYCLE_MAX_OPEN cycles are held at once
+CYCLE_DB = os.getenv("CYCLE_DB", os.path.join(UPLOAD_DIR, "cycles.sqlite3"))
+CYCLE_TTL = int(os.getenv("CYCLE_TTL", 300))
+CYCLE_SWEEP_INTERVAL = int(os.getenv("CYCLE_SWEEP_INTERVAL", 30))
+CYCLE_MAX_OPEN = int(os.getenv("CYCLE_MAX_OPEN", 256))
+# The index rows (dedup, storage, open cycles) of uploads arriving within this many
+# ms of each other are committed together, off the event loop
+INDEX_COMMIT_DELAY_MS = int(os.getenv("INDEX_COMMIT_DELAY_MS", 20))
+
+# Image storage: uploads go to IMAGE_DIR/YYYYMMDD/<camera>/, indexed in STORAGE_DB.
+# Images of cycles with animals are kept RETAIN_ANIMAL_DAYS, empty ones RETAIN_EMPTY_HOURS,
+# never decided ones RETAIN_UNCLASSIFIED_DAYS (0 keeps them); below STORAGE_MIN_FREE_MB
+# free, the oldest are deleted early, empty ones first. Decided images older than
+# STORAGE_PACK_AFTER_HOURS are packed into one segment file per day (0 disables packing)
+IMAGE_DIR = os.getenv("IMAGE_DIR", os.path.join(UPLOAD_DIR, "images"))
+STORAGE_DB = os.getenv("STORAGE_DB", os.path.join(UPLOAD_DIR, "storage.sqlite3"))
+RETAIN_ANIMAL_DAYS = float(os.getenv("RETAIN_ANIMAL_DAYS", 90))
+RETAIN_EMPTY_HOURS = float(os.getenv("RETAIN_EMPTY_HOURS", 24))
+RETAIN_UNCLASSIFIED_DAYS = float(os.getenv("RETAIN_UNCLASSIFIED_DAYS", 7))
+STORAGE_MIN_FREE_MB = int(os.getenv("STORAGE_MIN_FREE_MB", 512))
+STORAGE_PACK_AFTER_HOURS = float(os.getenv("STORAGE_PACK_AFTER_HOURS", 6))
+STORAGE_SWEEP_INTERVAL = int(os.getenv("STORAGE_SWEEP_INTERVAL", 600))
+# Decision latencies of this many recent cycles are kept for the p50/p99 in /stats
+LATENCY_SAMPLES = 1000
+
+# ESP32 log chunks (POST /esp_log) are stored here
+ESP_LOG_DIR = os.path.join(UPLOAD_DIR, "esp_logs")
+# Raw detections per image (daily JSONL sidecars), and annotated images rendered from them on demand
+DETECTIONS_DIR = os.path.join(UPLOAD_DIR, "detections")
+ANNOTATED_DIR = os.path.join(UPLOAD_DIR, "annotated")
+
+# Header carrying the SHA-256 of the upload body (see HDR_HASH in camera.ino)
+HASH_HEADER = "X-Content-SHA256"
+# Cycle IDs are "{MAC}-{SEQ}", e.g. "AABBCCDDEEFF-00000001"
+CYCLE_ID_PATTERN = re.compile(r"[0-9A-Za-z]+(-[0-9A-Za-z]+)*")
 
 LOG_FILE = "server.log"
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
+# Setup logging: records are queued and written to the SD card by a background thread
+log_listener = setup_logging(logging.FileHandler(LOG_FILE), logging.StreamHandler())
 logger = logging.getLogger(__name__)
 
+# Prometheus metrics, served on /metrics
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "wild_animals_gateway_stage_seconds",
+    "Time spent per pipeline stage (upload, queue_wait, decode, inference, decision, forward)", ["stage"])
+UPLOADS = metrics.counter("wild_animals_gateway_uploads_total", "Images accepted, per camera", ["camera"])
+VERDICTS = metrics.counter("wild_animals_gateway_verdicts_total",
+                           "Images per camera and verdict (animal, empty, skipped)", ["camera", "verdict"])
+CYCLES = metrics.counter("wild_animals_gateway_cycles_total",
+                         "Decided cycles per camera and outcome (forwarded, dropped)", ["camera", "outcome"])
+FORWARD_BYTES = metrics.counter("wild_animals_gateway_forward_bytes_total",
+                                "Bytes of forwarded images per camera, as uploaded (original) and as sent", ["camera", "kind"])
+metrics.gauge("wild_animals_gateway_queue_depth", "Images waiting for inference",
+              function=lambda: len(inference_scheduler.pending))
+metrics.gauge("wild_animals_gateway_queue_capacity", "Inference queue size limit",
+              function=lambda: inference_scheduler.max_depth)
+metrics.gauge("wild_animals_gateway_inference_busy", "1 while every inference slot is taken",
+              function=lambda: int(processing_semaphore.locked()))
+metrics.gauge("wild_animals_gateway_inference_inflight", "Inference batches running",
+              function=lambda: processing_semaphore.in_use)
+metrics.gauge("wild_animals_gateway_cpu_temperature_celsius", "CPU temperature at the last adaptive sample",
+              function=lambda: thermal_source_value("temp_c"))
+metrics.gauge("wild_animals_gateway_cpu_frequency_hertz", "CPU clock at the last adaptive sample",
+              function=lambda: thermal_source_value("freq_khz", 1000))
+INFERENCE_SETTING = metrics.gauge("wild_animals_gateway_inference_setting",
+                                  "Adaptive inference settings (threads, batch_size, image_size, concurrency)",
+                                  ["setting"])
+INFERENCE_ADJUSTMENTS = metrics.counter("wild_animals_gateway_inference_adjustments_total",
+                                        "Adaptive changes per setting and direction (up, down)",
+                                        ["setting", "direction"])
+metrics.gauge("wild_animals_gateway_buffer_pool_bytes", "Upload bytes held in memory",
+              function=lambda: buffer_pool.used_bytes)
+metrics.gauge("wild_animals_gateway_open_cycles", "Cycles waiting for more images",
+              function=lambda: cycle_manager.open_cycles())
+metrics.gauge("wild_animals_gateway_forward_retry_queue", "Cycles waiting to be forwarded again",
+              function=lambda: forwarder.stats()["retry_queue"])
+metrics.gauge("wild_animals_gateway_storage_free_bytes", "Free space on the image storage volume",
+              function=lambda: image_store.free_bytes())
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
 # Ensure upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(ESP_LOG_DIR, exist_ok=True)
 
-app = FastAPI()
-detector = Detector()
 
-# Semaphore to limit concurrent inference
-# Setting to 1 ensures we process one image at a time to save resources (CPU/RAM) on Pi
-processing_semaphore = asyncio.Semaphore(1)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Listen right away; uploads queue up while the model loads in the background
+    model_task = asyncio.create_task(load_detector())
+    recover_cycles()
+    sweeper_task = asyncio.create_task(sweep_cycles())
+    storage_task = asyncio.create_task(maintain_storage())
+    await forwarder.start()
+    startup["listening_s"] = round(time.perf_counter() - STARTED_AT, 3)
+    logger.info(f"Listening after {startup['listening_s']}s, loading model in the background")
+    yield
+    model_task.cancel()
+    sweeper_task.cancel()
+    storage_task.cancel()
+    if adaptive_controller is not None:
+        await adaptive_controller.stop()
+    await inference_scheduler.stop()
+    await forwarder.stop()
+    transcoder.shutdown()
+    # Let write-behind finish so nothing buffered is lost on shutdown
+    if pending_writes:
+        await asyncio.gather(*pending_writes.values(), return_exceptions=True)
+    # close() commits whatever a cancelled group commit left
+    if index_commit is not None:
+        index_commit.cancel()
+    dedup_index.close()
+    cycle_store.close()
+    image_store.close()
+    log_listener.stop()
 
+app = FastAPI(lifespan=lifespan)
+# Set by load_detector() once the model is loaded and warmed up
+detector = None
+# Model state ("loading", "ready" or "failed") and startup timings, in seconds since process start
+startup = {"model": "loading", "listening_s": None, "model_ready_s": None, "first_inference_s": None}
 
-class CycleManager:
+# Limits concurrent inference batches
+# Starts at 1, one batch at a time to save resources (CPU/RAM) on Pi; the adaptive controller may raise it
+processing_semaphore = ConcurrencyLimit(1)
+# Set by load_detector() if ADAPTIVE_INFERENCE is on
+adaptive_controller = None
+
+# Uploaded bytes, shared by inference and forwarding; persisted to SD by write-behind
+buffer_pool = BufferPool(BUFFER_POOL_MB * 1024 * 1024)
+# { file_path: Task } for write-behind persists still in flight
+pending_writes = {}
+# Task that will commit the index rows of recent uploads, if one is scheduled
+index_commit = None
+
+# Sends passing cycles to MAIN_SERVER_URL; undeliverable images wait in FORWARD_RETRY_DIR
+forwarder = Forwarder(MAIN_SERVER_URL, FORWARD_RETRY_DIR, lambda path, name: read_for_forward(path, name),
+                      max_concurrency=FORWARD_CONCURRENCY, http2=FORWARD_HTTP2,
+                      mode=FORWARD_MODE, bundle_url=MAIN_SERVER_BUNDLE_URL, on_sent=lambda name: count_forwarded(name))
+
+def days(value):
+    """Seconds in value days; None (keep forever) for 0."""
+    return value * 86400 if value > 0 else None
+
+# Where uploads are written, how long they are kept, and where they went after packing
+image_store = ImageStore(IMAGE_DIR, STORAGE_DB, retain={
+    CLASS_ANIMAL: days(RETAIN_ANIMAL_DAYS),
+    CLASS_EMPTY: days(RETAIN_EMPTY_HOURS / 24),
+    None: days(RETAIN_UNCLASSIFIED_DAYS),
+}, min_free_bytes=STORAGE_MIN_FREE_MB * 1024 * 1024, pack_after=days(STORAGE_PACK_AFTER_HOURS / 24))
+
+# SHA-256 -> cycle and verdict of every recent upload
+dedup_index = DedupIndex(DEDUP_DB, max_entries=DEDUP_MAX_ENTRIES)
+
+# Detections of every inferred image; annotated images are only drawn when needed
+annotation_store = AnnotationStore(DETECTIONS_DIR, ANNOTATED_DIR)
+
+# Shrinks forwarded images off the event loop; crops use the recorded detections
+transcoder = Transcoder(FORWARD_PROFILE, annotation_store.lookup, workers=FORWARD_TRANSCODE_WORKERS,
+                        margin=FORWARD_CROP_MARGIN)
+
+# Per-camera background model that lets still frames skip the detector
+motion_prefilter = MotionPrefilter(MOTION_THRESHOLD, MOTION_MIN_AREA) if MOTION_PREFILTER else None
+
+# Batches pending images and skips inferences whose cycle outcome is already fixed
+inference_scheduler = InferenceScheduler(lambda sources, filenames: detect_and_record(sources, filenames), processing_semaphore, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+                                         max_depth=QUEUE_MAX_DEPTH, policy=QUEUE_POLICY, observe=observe)
+
+
+async def load_detector():
+    """
+    Load and warm up the detector off the event loop, then start inference.
+    Until then, uploads are admitted to the queue as usual and wait there.
+    """
+    global detector
+    try:
+        detector = await asyncio.to_thread(
+            Detector, DETECTOR_BACKEND, int8=DETECTOR_INT8, cache_dir=MODEL_CACHE_DIR, num_threads=DETECTOR_THREADS,
+            prefilter=motion_prefilter, reduced_decode=DETECTOR_REDUCED_DECODE, observe=observe,
+        )
+        # The first inference pays for graph optimization and allocation; do it on a dummy image
+        await asyncio.to_thread(detector.warm_up)
+    except Exception as e:
+        startup["model"] = "failed"
+        logger.error(f"Failed to load model: {e}")
+        return
+
+    annotation_store.names = detector.names
+    startup["model"] = "ready"
+    startup["model_ready_s"] = round(time.perf_counter() - STARTED_AT, 3)
+    logger.info(f"Detector backend {detector.backend.name} ready after {startup['model_ready_s']}s")
+    inference_scheduler.start()
+    if ADAPTIVE_INFERENCE:
+        start_adaptive_controller()
+
+
+def start_adaptive_controller():
+    """Bound each setting the detector's backend can change, and start adjusting them."""
+    global adaptive_controller
+    knobs = [
+        Knob("batch_size", range(ADAPTIVE_BATCH_MIN, ADAPTIVE_BATCH_MAX + 1), BATCH_MAX_SIZE,
+             lambda size: setattr(inference_scheduler, "max_size", size)),
+    ]
+    if detector.can_set_threads:
+        knobs.append(Knob("threads", range(ADAPTIVE_THREADS_MIN, ADAPTIVE_THREADS_MAX + 1),
+                          DETECTOR_THREADS or os.cpu_count() or 1, detector.set_num_threads, blocking=True))
+    if detector.can_resize:
+        sizes = range(detector.input_size, ADAPTIVE_IMAGE_SIZE_MIN - 1, -max(32, ADAPTIVE_IMAGE_SIZE_STEP))
+        knobs.append(Knob("image_size", [size // 32 * 32 for size in sizes], detector.input_size,
+                          detector.set_image_size))
+    if detector.backend.name == BACKEND_ONNX:
+        knobs.append(Knob("concurrency", range(1, ADAPTIVE_CONCURRENCY_MAX + 1), 1, processing_semaphore.set_limit))
+    elif ADAPTIVE_CONCURRENCY_MAX > 1:
+        logger.warning(f"The {detector.backend.name} backend runs one batch at a time, ignoring ADAPTIVE_CONCURRENCY_MAX")
+    adaptive_controller = AdaptiveController(
+        ThermalSource(THERMAL_ZONE_PATH, CPUFREQ_PATH), knobs,
+        lambda: (len(inference_scheduler.pending), inference_scheduler.max_depth),
+        interval=ADAPTIVE_INTERVAL, temp_high=THERMAL_HIGH_C, temp_low=THERMAL_LOW_C, freq_ratio=THROTTLE_FREQ_RATIO,
+        queue_high=ADAPTIVE_QUEUE_HIGH, latency_target=ADAPTIVE_LATENCY_TARGET_MS / 1000 or None,
+        on_adjust=record_adjustment,
+    )
+    for name, value in adaptive_controller.settings().items():
+        INFERENCE_SETTING.set(value, setting=name)
+    adaptive_controller.start()
+
+
+def record_adjustment(name, old, new, reason):
+    INFERENCE_SETTING.set(new, setting=name)
+    INFERENCE_ADJUSTMENTS.inc(setting=name, direction="up" if new > old else "down")
+
+
+def thermal_source_value(key, scale=1):
+    """A value of the adaptive controller's last sample, for /metrics (NaN if none)."""
+    value = adaptive_controller.sample.get(key) if adaptive_controller is not None else None
+    return value * scale if value is not None else float("nan")
+
+
+def detect_and_record(sources, filenames):
+    """
+    Inference for one scheduler batch (runs in a worker thread). Detections go
+    to the sidecar; no annotated image is drawn or written here.
+    """
+    start_time = time.perf_counter()
+    detections = detector.predict(sources, [camera_for(filename) for filename in filenames])
+    if adaptive_controller is not None:
+        adaptive_controller.record(len(sources), time.perf_counter() - start_time)
+    annotation_store.record(filenames, detections)
+    return [detector.verdict(result) for result in detections]
+
+async def annotate(file_path: str, filename: str):
+    """Render (and cache) the annotated image of an upload; None if it was never inferred."""
+    cached = annotation_store.cached(filename)
+    if cached is not None:
+        return cached
+    try:
+        data = await read_image(file_path, filename)
+    except FileNotFoundError:
+        return None
+    return await asyncio.to_thread(annotation_store.render, filename, data)
+
+
+class CycleShard:
+    """The open cycles of one camera, with their own lock."""
     def __init__(self):
-        # Stores cycle data: { cycle_id: { 'files': [{'path': str, 'filename': str, 'is_animal': bool}], 'last_update': timestamp } }
-        self.cycles = defaultdict(lambda: {'files': [], 'last_update': datetime.datetime.now()})
+        self.cycles = {}
         self.lock = asyncio.Lock()
 
-    async def add_result(self, cycle_id, file_path, filename, is_animal):
-        async with self.lock:
-            self.cycles[cycle_id]['files'].append({
+
+class CycleManager:
+    """
+    Collects the verdicts of each cycle until it can be decided.
+
+    Cycles are sharded by camera (the MAC prefix of the Cycle ID), each shard
+    with its own lock, so cameras never wait on each other's bookkeeping.
+    Every verdict is also written to the cycle store, so open cycles survive a
+    restart (see recover_cycles()). Cycles that stop receiving images (an ESP32
+    that lost Wi-Fi halfway through) are decided by sweep() after ttl seconds
+    with the verdicts collected so far, and at most max_open cycles are held:
+    beyond that, the least recently updated one is decided early.
+    """
+    def __init__(self, store, ttl=300, max_open=256):
+        self.store = store
+        self.ttl = ttl
+        self.max_open = max(1, max_open)
+        # { camera: CycleShard }, each holding
+        # { cycle_id: { 'files': [{'path': str, 'filename': str, 'index': int, 'is_animal': bool, 'label': str, 'digest': str}], 'started': epoch seconds, 'last_update': epoch seconds } }
+        # is_animal is None for images the scheduler did not need to infer
+        self.shards = {}
+        self.counters = {"decided": 0, "expired": 0, "evicted": 0, "restored": 0}
+        # Seconds from a cycle's first upload to its decision, for the most recent cycles
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def _shard(self, cycle_id):
+        camera = camera_of(cycle_id)
+        shard = self.shards.get(camera)
+        if shard is None:
+            shard = self.shards[camera] = CycleShard()
+        return shard
+
+    def open_cycles(self):
+        return sum(len(shard.cycles) for shard in self.shards.values())
+
+    def restore(self, cycles):
+        """Put cycles loaded from the store back, before any upload arrives."""
+        for cycle_id, cycle in cycles.items():
+            self._shard(cycle_id).cycles[cycle_id] = cycle
+        self.counters["restored"] += len(cycles)
+
+    def admit(self, cycle_id):
+        """An image of the cycle was accepted; its decision latency counts from the first one."""
+        now = time.time()
+        self._shard(cycle_id).cycles.setdefault(cycle_id, {'files': [], 'started': now, 'last_update': now})
+
+    async def add_result(self, cycle_id, file_path, filename, is_animal, img_index=None, label=None, digest=None):
+        shard = self._shard(cycle_id)
+        files = None
+        async with shard.lock:
+            now = time.time()
+            cycle = shard.cycles.setdefault(cycle_id, {'files': [], 'started': now, 'last_update': now})
+            cycle['files'].append({
                 'path': file_path,
                 'filename': filename,
-                'is_animal': is_animal
+                'index': img_index,
+                'is_animal': is_animal,
+                'label': label,
+                'digest': digest,
             })
-            self.cycles[cycle_id]['last_update'] = datetime.datetime.now()
-            
-            files = self.cycles[cycle_id]['files']
-            count = len(files)
-            
+            cycle['last_update'] = now
+
+            count = len(cycle['files'])
+
             # Check condition if we have 3 images
-            if count >= 3:
-                animal_count = sum(1 for f in files if f['is_animal'])
-                logger.info(f"Cycle {cycle_id} complete. Detected animals: {animal_count}/{count}")
-                
-                if animal_count >= 2:
-                    logger.info(f"Cycle {cycle_id} MET criteria (>=2 animals). Forwarding all strings.")
-                    await self.forward_cycle(files)
-                else:
-                    logger.info(f"Cycle {cycle_id} NOT met criteria. Not forwarding.")
-                
-                # Cleanup
-                del self.cycles[cycle_id]
+            if count >= CYCLE_SIZE:
+                files = self._close(shard, cycle_id)
+                self.counters["decided"] += 1
+            else:
+                self.store.set_verdict(cycle_id, filename, file_path, is_animal, label, img_index, digest)
+                logger.info(f"Cycle {cycle_id} buffered. Count: {count}/{CYCLE_SIZE}")
+
+        # Forward outside the lock so network I/O never stalls the camera's other cycles
+        if files is not None:
+            await self._finish(cycle_id, files, "complete")
+
+        # Bound memory under sustained traffic: decide the stalest cycles early
+        while self.open_cycles() > self.max_open:
+            await self._evict_stalest()
+
+    async def _evict_stalest(self):
+        shard, cycle_id = min(
+            ((shard, c) for shard in self.shards.values() for c in shard.cycles),
+            key=lambda item: item[0].cycles[item[1]]['last_update'],
+        )
+        async with shard.lock:
+            if cycle_id not in shard.cycles:
+                return
+            files = self._close(shard, cycle_id)
+            self.counters["evicted"] += 1
+        await self._finish(cycle_id, files, "evicted")
+
+    async def sweep(self):
+        """Decide every cycle that has not received an image for ttl seconds."""
+        for shard in list(self.shards.values()):
+            expired = []
+            async with shard.lock:
+                deadline = time.time() - self.ttl
+                for cycle_id in [c for c, cycle in shard.cycles.items() if cycle['last_update'] < deadline]:
+                    expired.append((cycle_id, self._close(shard, cycle_id)))
+                self.counters["expired"] += len(expired)
+
+            for cycle_id, files in expired:
+                await self._finish(cycle_id, files, "expired")
+
+    def _close(self, shard, cycle_id):
+        """Drop a cycle from memory and the store (called with the shard's lock held); returns its files."""
+        cycle = shard.cycles.pop(cycle_id)
+        latency = time.time() - cycle.get('started', cycle['last_update'])
+        self.latencies.append(latency)
+        observe("decision", latency)
+        self.store.remove_cycle(cycle_id)
+        inference_scheduler.forget_cycle(cycle_id)
+        # Re-sent images of this cycle are acknowledged from now on
+        dedup_index.mark_decided(cycle_id)
+        return cycle['files']
+
+    async def _finish(self, cycle_id, files, reason):
+        with traced(cycle_id):
+            await self._finish_traced(cycle_id, files, reason)
+
+    async def _finish_traced(self, cycle_id, files, reason):
+        animal_count = sum(1 for f in files if f['is_animal'])
+        skipped_count = sum(1 for f in files if f['is_animal'] is None)
+        logger.info(f"Cycle {cycle_id} {reason}. Detected animals: {animal_count}/{len(files)} ({skipped_count} inference(s) skipped)")
+
+        # Images skipped by the scheduler are only skipped once the outcome is fixed.
+        # An incomplete cycle only passes if its missing images could not have changed that.
+        passed = decide_cycle(f['is_animal'] for f in files) is True
+
+        try:
+            if passed:
+                logger.info(f"Cycle {cycle_id} MET criteria (>=2 animals). Forwarding all strings.")
+                CYCLES.inc(camera=camera_of(cycle_id), outcome="forwarded")
+                start_time = time.perf_counter()
+                await forwarder.forward_cycle(cycle_id, files)
+                observe("forward", time.perf_counter() - start_time)
+                # Forwarded cycles are the ones people look at; render them while the images are still in memory
+                for file_info in files:
+                    await annotate(file_info['path'], file_info['filename'])
             else:
-                 logger.info(f"Cycle {cycle_id} buffered. Count: {count}/3")
+                logger.info(f"Cycle {cycle_id} NOT met criteria. Not forwarding.")
+                CYCLES.inc(camera=camera_of(cycle_id), outcome="dropped")
+        finally:
+            # Frames of a forwarded cycle, and any frame with an animal, are kept the longest
+            image_store.classify([f['filename'] for f in files if passed or f['is_animal']], CLASS_ANIMAL)
+            image_store.classify([f['filename'] for f in files if not (passed or f['is_animal'])], CLASS_EMPTY)
+
+            # Cleanup
+            for file_info in files:
+                buffer_pool.release(file_info['filename'])
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            **self.counters,
+            "open_cycles": self.open_cycles(),
+            "cameras": len(self.shards),
+            "ttl": self.ttl,
+            "max_open": self.max_open,
+            "decision_p50_s": round(percentile(latencies, 50), 3),
+            "decision_p95_s": round(percentile(latencies, 95), 3),
+            "decision_p99_s": round(percentile(latencies, 99), 3),
+        }
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+# Open cycles' verdicts and admitted frames, kept across restarts
+cycle_store = CycleStore(CYCLE_DB)
+
+cycle_manager = CycleManager(cycle_store, ttl=CYCLE_TTL, max_open=CYCLE_MAX_OPEN)
 
-    async def forward_cycle(self, files):
-        if not MAIN_SERVER_URL:
-             logger.info("MAIN_SERVER_URL not set, skipping forwarding.")
-             return
 
-        for file_info in files:
-            await forward_image(file_info['path'], file_info['filename'])
+def recover_cycles():
+    """
+    Reload the open cycles of the previous run. Their verdicts go back into
+    CycleManager and the scheduler, so none of those images is inferred again;
+    frames that were admitted but never inferred are queued again from disk.
+    """
+    cycles, pending = cycle_store.load()
+    cycle_manager.restore(cycles)
+    for cycle_id, cycle in cycles.items():
+        inference_scheduler.restore_verdicts(cycle_id, [f['is_animal'] for f in cycle['files']])
+        for file_info in cycle['files']:
+            if file_info['digest']:
+                dedup_index.mark_inferred(file_info['digest'])
+
+    requeued = 0
+    for frame in pending:
+        # Write-behind may not have reached the SD card before the crash; the ESP32 re-sends it then
+        if not os.path.exists(frame['path']):
+            cycle_store.remove_frame(frame['filename'])
+            continue
+        try:
+            cycle_id, future = enqueue_image(frame['path'], frame['filename'], frame['cycle_id'])
+        except QueueFullError:
+            logger.warning(f"Inference queue full, dropping recovered frame {frame['filename']}")
+            cycle_store.remove_frame(frame['filename'])
+            continue
+        if frame['digest']:
+            dedup_index.add(frame['digest'], cycle_id, frame['index'], frame['filename'], frame['path'])
+        cycle_manager.admit(cycle_id)
+        asyncio.create_task(process_image(future, frame['path'], frame['filename'], cycle_id,
+                                          frame['index'], frame['digest']))
+        requeued += 1
+
+    if cycles or pending:
+        logger.info(f"Recovered {len(cycles)} open cycle(s), re-queued {requeued}/{len(pending)} uninferred frame(s)")
 
-    async def cleanup_old_cycles(self, max_age_seconds=300):
-        # Potentially clean up incomplete cycles that are too old
-        # Not implemented for simplicity in this phase, but good practice
-        pass
+async def sweep_cycles():
+    """Periodically decide cycles that stopped receiving images."""
+    while True:
+        await asyncio.sleep(CYCLE_SWEEP_INTERVAL)
+        try:
+            await cycle_manager.sweep()
+        except Exception as e:
+            logger.error(f"Cycle sweep failed: {e}")
 
-cycle_manager = CycleManager()
+async def maintain_storage():
+    """Periodically apply image retention and pack decided images, off the event loop."""
+    while True:
+        try:
+            await asyncio.to_thread(image_store.sweep)
+        except Exception as e:
+            logger.error(f"Storage sweep failed: {e}")
+        await asyncio.sleep(STORAGE_SWEEP_INTERVAL)
 
 
 def extract_cycle_id(filename: str):
@@ -171,92 +696,521 @@ def extract_cycle_id(filename: str):
     return "unknown"
 
 
-async def process_image(file_path: str, filename: str):
+def camera_for(filename: str):
+    cycle_id = extract_cycle_id(filename)
+    return camera_of(cycle_id) if cycle_id != "unknown" else None
+
+
+def enqueue_image(file_path: str, filename: str, cycle_id: str = None, verdict=None):
+    """
+    Admit an image into the bounded inference queue.
+    Returns (cycle_id, future); raises QueueFullError if the queue refuses it.
+    If verdict, an (is_animal, label) reused from an identical upload, is given,
+    the detector is not involved and the future is already resolved.
+    """
+    # Raw uploads carry the Cycle ID in a header; multipart ones need it parsed from the name
+    if cycle_id is None:
+        cycle_id = extract_cycle_id(filename)
+    logger.info(f"Cycle ID for {filename}: {cycle_id}")
+
+    scheduler_cycle_id = cycle_id if cycle_id != "unknown" else None
+    if verdict is not None:
+        # Still counts toward deciding the cycle, so its other images can be skipped
+        inference_scheduler.record_verdict(scheduler_cycle_id, verdict[0])
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(verdict)
+        return cycle_id, future
+
+    # Detection is skipped if the cycle is already decided.
+    # Bytes still in the buffer pool are decoded directly, without an SD read.
+    data = buffer_pool.get(filename)
+    future = inference_scheduler.enqueue(scheduler_cycle_id, file_path, filename, data)
+    return cycle_id, future
+
+async def process_image(future, file_path: str, filename: str, cycle_id: str, img_index: int = None, digest: str = None):
     """
     Background task to process the image:
-    1. Run object detection
+    1. Wait for object detection (batched, skipped once the cycle is decided)
     2. Add to cycle buffer
     3. Forward if cycle complete and condition met
     """
-    async with processing_semaphore:
-        logger.info(f"Starting processing for {filename}")
-        try:
-            # Define path for saving the inference result (annotated image)
-            # Not strictly required to save annotated image on Pi if we just filter,
-            # but good for debugging.
-            result_filename = f"{os.path.splitext(filename)[0]}_result.jpg"
-            result_path = os.path.join(UPLOAD_DIR, result_filename)
-
-            # Run detection
-            is_animal, label = await asyncio.to_thread(detector.detect, file_path, result_path)
-            if is_animal:
-                logger.info(f"Animal detected in {filename}: {label}")
-            else:
-                logger.info(f"No animal detected in {filename}")
-
-            # Extract Cycle ID
-            cycle_id = extract_cycle_id(filename)
-            logger.info(f"Cycle ID for {filename}: {cycle_id}")
-            
-            if cycle_id != "unknown":
-                await cycle_manager.add_result(cycle_id, file_path, filename, is_animal)
-            else:
-                logger.warning(f"Could not extract Cycle ID from {filename}, skipping buffering.")
+    # Runs after the upload's response (or as its own task after a restart); tag its logs with the cycle
+    trace_id.set(cycle_id)
+    logger.info(f"Starting processing for {filename}")
+    try:
+        is_animal, label = await future
+        verdict = "skipped" if is_animal is None else ("animal" if is_animal else "empty")
+        VERDICTS.inc(camera=camera_of(cycle_id) if cycle_id != "unknown" else "unknown", verdict=verdict)
+        if startup["first_inference_s"] is None and is_animal is not None:
+            startup["first_inference_s"] = round(time.perf_counter() - STARTED_AT, 3)
+        if is_animal is None:
+            logger.info(f"Inference skipped for {filename}: cycle {cycle_id} already decided")
+        elif is_animal:
+            logger.info(f"Animal detected in {filename}: {label}")
+        else:
+            logger.info(f"No animal detected in {filename}")
 
-        except Exception as e:
-            logger.error(f"Error processing {filename}: {e}")
+        if digest:
+            dedup_index.record_verdict(digest, is_animal, label)
+        
+        if cycle_id != "unknown":
+            await cycle_manager.add_result(cycle_id, file_path, filename, is_animal, img_index, label, digest)
+        else:
+            logger.warning(f"Could not extract Cycle ID from {filename}, skipping buffering.")
+            buffer_pool.release(filename)
+
+    except JobShedError as e:
+        logger.warning(f"Dropped {filename} under load: {e}")
+        buffer_pool.release(filename)
+        cycle_store.remove_frame(filename)
+        if digest:
+            dedup_index.discard(digest)
+    except Exception as e:
+        logger.error(f"Error processing {filename}: {e}")
+        buffer_pool.release(filename)
+        cycle_store.remove_frame(filename)
+        if digest:
+            dedup_index.discard(digest)
 
-async def forward_image(file_path: str, filename: str):
+def check_duplicate(digest: str, cycle_id: str, background_tasks: BackgroundTasks):
     """
-    Forward the image to the main server
+    Look an upload up in the dedup index by its SHA-256.
+    Returns (response, verdict): response is set if the upload is a re-send to
+    acknowledge without processing it; verdict is a cached (is_animal, label)
+    to use instead of running the detector.
     """
-    logger.info(f"Forwarding {filename} to {MAIN_SERVER_URL}")
+    if cycle_id == "unknown":
+        return None, None
+    record = dedup_index.lookup(digest)
+    if record is None:
+        return None, None
+
+    if record.cycle_id != cycle_id:
+        # Same image in another cycle: only its verdict can be reused
+        if record.has_verdict and record.is_animal is not None:
+            dedup_index.count_duplicate(reused_verdict=True)
+            logger.info(f"Reusing verdict of {record.filename} for identical upload in cycle {cycle_id}")
+            return None, (record.is_animal, record.label)
+        return None, None
+
+    if record.state == STATE_CACHED:
+        # Its cycle was still open when we restarted; put the known verdict back into it
+        if not os.path.exists(record.file_path):
+            dedup_index.discard(digest)
+            return None, None
+        dedup_index.mark_inferred(digest)
+        background_tasks.add_task(cycle_manager.add_result, cycle_id, record.file_path, record.filename,
+                                  record.is_animal, record.img_index, record.label, digest)
+        dedup_index.count_duplicate(reused_verdict=True)
+    else:
+        dedup_index.count_duplicate()
+
+    logger.info(f"Duplicate of {record.filename} (cycle {cycle_id}, {record.state}), acknowledging")
+    return {"status": "ok", "filename": record.filename, "duplicate": True,
+            "message": "Image already received"}, None
+
+def queue_full_response():
+    """
+    503 with Retry-After; the ESP32 keeps the cycle and retries it on a later wake-up.
+    """
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(QUEUE_RETRY_AFTER)},
+        content={"status": "busy", "message": "Inference queue full, retry later"},
+    )
+
+async def persist(file_path: str, data: bytes):
     try:
-        async with httpx.AsyncClient() as client:
-            # Open file asynchronously for reading
-            async with aiofiles.open(file_path, "rb") as f:
-                content = await f.read()
-                
-            files = {"file": (filename, content, "image/jpeg")}
-            
-            # Note: External server (server.py) expects just the file.
-            response = await client.post(MAIN_SERVER_URL, files=files)
-            response.raise_for_status()
-            logger.info(f"Successfully forwarded {filename}. Status: {response.status_code}")
-            
-    except httpx.HTTPError as e:
-        logger.error(f"Failed to forward {filename}: {e}")
+        async with aiofiles.open(file_path, "wb") as f:
+            await f.write(data)
     except Exception as e:
-        logger.error(f"Unexpected error forwarding {filename}: {e}")
+        logger.error(f"Failed to persist {file_path}: {e}")
+    finally:
+        pending_writes.pop(file_path, None)
+
+def persist_later(file_path: str, data: bytes):
+    """
+    Write-behind: the upload is acknowledged and processed from memory while
+    it is written to the SD card in the background.
+    """
+    pending_writes[file_path] = asyncio.create_task(persist(file_path, data))
+
+def commit_indexes():
+    for index in (dedup_index, image_store, cycle_store):
+        try:
+            index.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to commit {type(index).__name__}: {e}")
+
+async def commit_indexes_soon():
+    global index_commit
+    # Uploads of the same burst arriving meanwhile share the commit
+    await asyncio.sleep(INDEX_COMMIT_DELAY_MS / 1000)
+    index_commit = None
+    await asyncio.to_thread(commit_indexes)
+
+def commit_indexes_later():
+    """
+    Group commit: an upload's rows in the dedup, storage and cycle indexes are
+    written at once (visible to lookups right away) and committed together with
+    those of the uploads around it, in a worker thread.
+    """
+    global index_commit
+    if index_commit is None:
+        index_commit = asyncio.create_task(commit_indexes_soon())
+
+async def read_image(file_path: str, filename: str):
+    """
+    Image bytes from the buffer pool, or from disk if they were not kept in memory.
+    """
+    data = buffer_pool.get(filename)
+    if data is not None:
+        return data
+    write = pending_writes.get(file_path)
+    if write is not None:
+        await write
+    try:
+        async with aiofiles.open(file_path, "rb") as f:
+            return await f.read()
+    except FileNotFoundError:
+        # Packed into a segment since
+        return await asyncio.to_thread(image_store.read, filename)
+
+def stored_path(filename: str):
+    """Where an upload was written; images from before the storage index are directly in UPLOAD_DIR."""
+    return image_store.path_of(filename) or os.path.join(UPLOAD_DIR, filename)
+
+async def read_for_forward(file_path: str, filename: str):
+    """
+    Image bytes as sent to the analysis server: re-encoded by the forward profile.
+    Retries reuse the bytes of the previous attempt while the transcoder still has them.
+    """
+    sent = transcoder.cached(filename)
+    if sent is None:
+        data = await read_image(file_path, filename)
+        sent = await transcoder.transcode(data, filename)
+    return sent
+
+def count_forwarded(filename: str):
+    """Count an image's bytes once, when it has reached the analysis server."""
+    sizes = transcoder.forwarded(filename)
+    if sizes is None:
+        return
+    camera = camera_for(filename) or "unknown"
+    FORWARD_BYTES.inc(sizes[0], camera=camera, kind="original")
+    FORWARD_BYTES.inc(sizes[1], camera=camera, kind="sent")
+
+async def read_body(request: Request):
+    """
+    Read a raw request body into memory, hashing it as it arrives.
+    Returns (bytes, hex SHA-256).
+    """
+    sha256 = hashlib.sha256()
+    body = bytearray()
+    async for chunk in request.stream():
+        if chunk:
+            sha256.update(chunk)
+            body.extend(chunk)
+    return bytes(body), sha256.hexdigest()
+
+async def save_stream(request: Request, file_path: str):
+    """
+    Stream a raw request body straight to disk, hashing it while writing.
+    Returns the hex SHA-256 of what was written.
+    """
+    sha256 = hashlib.sha256()
+    async with aiofiles.open(file_path, "wb") as buffer:
+        async for chunk in request.stream():
+            if chunk:
+                sha256.update(chunk)
+                await buffer.write(chunk)
+    return sha256.hexdigest()
+
+
+def hash_matches(request: Request, digest: str):
+    expected = request.headers.get(HASH_HEADER)
+    return not expected or expected.strip().lower() == digest
+
 
 @app.post("/upload")
-async def upload_image(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_image(request: Request, background_tasks: BackgroundTasks):
     """
     Handle image upload:
     1. Save image to disk asynchronously (fast, non-blocking)
     2. Return 200 OK immediately
     3. Schedule processing in background
+
+    The ESP32 firmware sends the JPEG as the raw request body with
+    X-Cycle-Id / X-Img-Index / X-File-Name / X-Content-SHA256 headers.
+    multipart/form-data uploads (field "file") are still accepted.
     """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        return await upload_multipart(request, background_tasks)
+    return await upload_raw(request, background_tasks)
+
+
+async def upload_raw(request: Request, background_tasks: BackgroundTasks):
+    start_time = time.perf_counter()
+    cycle_id = request.headers.get("x-cycle-id", "")
+    img_index = request.headers.get("x-img-index", "")
+    original_name = os.path.basename(request.headers.get("x-file-name", ""))
+
+    if not CYCLE_ID_PATTERN.fullmatch(cycle_id) or not img_index.isdigit() or not original_name:
+        logger.warning(f"Rejected raw upload with headers cycle={cycle_id!r} index={img_index!r} name={original_name!r}")
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Missing or invalid X-Cycle-Id / X-Img-Index / X-File-Name"})
+    # The Cycle ID is the trace ID of everything this upload leads to
+    trace_id.set(cycle_id)
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    filename = f"{timestamp}_{original_name}"
+    file_path = image_store.path_for(filename, camera_of(cycle_id))
+
+    logger.info(f"Receiving upload: {filename} (cycle {cycle_id}, image {img_index})")
+
+    # With the firmware's hash header, re-sent images are acknowledged before reading the body
+    header_digest = request.headers.get(HASH_HEADER, "").strip().lower()
+    verdict = None
+    if header_digest:
+        duplicate, verdict = check_duplicate(header_digest, cycle_id, background_tasks)
+        if duplicate is not None:
+            return duplicate
+
+    # Refuse before reading the body if the queue has no room for this image
+    if verdict is None and not inference_scheduler.can_admit(cycle_id):
+        logger.warning(f"Inference queue full, refusing {filename}")
+        return queue_full_response()
+
+    # Keep the upload in memory if the pool has room for it, otherwise stream it to disk
+    content_length = request.headers.get("content-length", "")
+    in_memory = content_length.isdigit() and buffer_pool.has_room(int(content_length))
+
+    try:
+        if in_memory:
+            data, digest = await read_body(request)
+        else:
+            digest = await save_stream(request, file_path)
+    except Exception as e:
+        logger.error(f"Failed to save upload {filename}: {e}")
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+    observe("upload", time.perf_counter() - start_time)
+
+    if not hash_matches(request, digest):
+        logger.warning(f"SHA-256 mismatch for {filename}, discarding")
+        if not in_memory:
+            os.remove(file_path)
+        return JSONResponse(status_code=400, content={"status": "error", "message": "SHA-256 mismatch"})
+
+    if not header_digest:
+        duplicate, verdict = check_duplicate(digest, cycle_id, background_tasks)
+        if duplicate is not None:
+            if not in_memory:
+                os.remove(file_path)
+            return duplicate
+
+    if in_memory and not buffer_pool.put(filename, data):
+        # Pool filled up while we were receiving; write through instead
+        async with aiofiles.open(file_path, "wb") as f:
+            await f.write(data)
+        in_memory = False
+
+    try:
+        cycle_id, future = enqueue_image(file_path, filename, cycle_id, verdict)
+    except QueueFullError:
+        logger.warning(f"Inference queue full, refusing {filename}")
+        if in_memory:
+            buffer_pool.release(filename)
+        else:
+            os.remove(file_path)
+        return queue_full_response()
+    dedup_index.add(digest, cycle_id, int(img_index), filename, file_path, verdict, commit=False)
+    image_store.add(filename, file_path, camera_of(cycle_id), commit=False)
+    UPLOADS.inc(camera=camera_of(cycle_id))
+    cycle_store.add_pending(cycle_id, filename, file_path, int(img_index), digest, commit=False)
+    commit_indexes_later()
+    cycle_manager.admit(cycle_id)
+
+    if in_memory:
+        persist_later(file_path, data)
+        logger.info(f"Buffered {filename} in memory ({len(data)} bytes)")
+    else:
+        logger.info(f"Saved {filename}")
+
+    # Schedule background processing
+    background_tasks.add_task(process_image, future, file_path, filename, cycle_id, int(img_index), digest)
+
+    return {"status": "ok", "filename": filename, "message": "Image received and queued for processing"}
+
+
+async def upload_multipart(request: Request, background_tasks: BackgroundTasks):
+    start_time = time.perf_counter()
+    form = await request.form()
+    file = form.get("file")
+    if not isinstance(file, StarletteUploadFile):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Missing 'file' field"})
+
     # Generate timestamp for storage, but we must handle it in CycleID extraction
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    filename = f"{timestamp}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    filename = f"{timestamp}_{os.path.basename(file.filename)}"
+    file_path = image_store.path_for(filename, camera_for(filename))
     
     logger.info(f"Receiving upload: {filename}")
     
     try:
-        # Save file asynchronously
-        async with aiofiles.open(file_path, "wb") as buffer:
-            while content := await file.read(1024 * 1024): # Read in chunks
-                await buffer.write(content)
-        
-        logger.info(f"Saved {filename}")
+        # The form parser has spooled the file already; keep it in memory if the pool has room,
+        # as for raw uploads, otherwise save it in chunks. Either way hash it for the dedup index
+        sha256 = hashlib.sha256()
+        in_memory = file.size is not None and buffer_pool.has_room(file.size)
+        if in_memory:
+            data = await file.read()
+            sha256.update(data)
+        else:
+            async with aiofiles.open(file_path, "wb") as buffer:
+                while content := await file.read(1024 * 1024): # Read in chunks
+                    sha256.update(content)
+                    await buffer.write(content)
+        digest = sha256.hexdigest()
+        observe("upload", time.perf_counter() - start_time)
+
+        cycle_id = extract_cycle_id(filename)
+        trace_id.set(cycle_id)
+
+        duplicate, verdict = check_duplicate(digest, cycle_id, background_tasks)
+        if duplicate is not None:
+            if not in_memory:
+                os.remove(file_path)
+            return duplicate
+
+        if in_memory and not buffer_pool.put(filename, data):
+            # Pool filled up in the meantime; write through instead
+            async with aiofiles.open(file_path, "wb") as f:
+                await f.write(data)
+            in_memory = False
+
+        try:
+            cycle_id, future = enqueue_image(file_path, filename, cycle_id, verdict)
+        except QueueFullError:
+            logger.warning(f"Inference queue full, refusing {filename}")
+            if in_memory:
+                buffer_pool.release(filename)
+            else:
+                os.remove(file_path)
+            return queue_full_response()
+        image_store.add(filename, file_path, camera_for(filename), commit=False)
+        UPLOADS.inc(camera=camera_for(filename) or "unknown")
+        if cycle_id != "unknown":
+            dedup_index.add(digest, cycle_id, None, filename, file_path, verdict, commit=False)
+            cycle_store.add_pending(cycle_id, filename, file_path, None, digest, commit=False)
+            cycle_manager.admit(cycle_id)
+        commit_indexes_later()
+
+        if in_memory:
+            persist_later(file_path, data)
+            logger.info(f"Buffered {filename} in memory ({len(data)} bytes)")
+        else:
+            logger.info(f"Saved {filename}")
         
         # Schedule background processing
-        background_tasks.add_task(process_image, file_path, filename)
+        background_tasks.add_task(process_image, future, file_path, filename, cycle_id, None, digest)
         
         return {"status": "ok", "filename": filename, "message": "Image received and queued for processing"}
         
     except Exception as e:
         logger.error(f"Failed to save upload {filename}: {e}")
-        return {"status": "error", "message": str(e)}
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Health check used by the ESP32 before it starts uploading.
+    Uploads are accepted (and queued) while the model is still loading, so this
+    only fails if the model could not be loaded at all; "ready" tells whether
+    inference is running yet.
+    """
+    if startup["model"] == "failed":
+        return JSONResponse(status_code=503, content={"status": "error", "ready": False, **startup})
+    return {"status": "ok", "ready": startup["model"] == "ready", **startup}
+
+@app.post("/esp_log")
+async def esp_log(request: Request):
+    """
+    Store the per-cycle log chunk the ESP32 uploads after its images
+    """
+    cycle_id = request.headers.get("x-cycle-id", "")
+    if not CYCLE_ID_PATTERN.fullmatch(cycle_id):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Missing or invalid X-Cycle-Id"})
+
+    file_path = os.path.join(ESP_LOG_DIR, f"{cycle_id}.log")
+    try:
+        digest = await save_stream(request, file_path)
+    except Exception as e:
+        logger.error(f"Failed to save ESP log for {cycle_id}: {e}")
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+    if not hash_matches(request, digest):
+        logger.warning(f"SHA-256 mismatch for ESP log of {cycle_id}, discarding")
+        os.remove(file_path)
+        return JSONResponse(status_code=400, content={"status": "error", "message": "SHA-256 mismatch"})
+
+    logger.info(f"Saved ESP log for cycle {cycle_id}")
+    return {"status": "ok"}
+
+@app.get("/annotated/{filename}")
+async def annotated(filename: str):
+    """
+    Annotated version of an uploaded image (boxes and labels drawn on it),
+    rendered from its recorded detections on first request and then cached.
+    """
+    filename = os.path.basename(filename)
+    file_path = stored_path(filename)
+    if buffer_pool.get(filename) is None and not os.path.exists(file_path) and not image_store.contains(filename):
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"Unknown image {filename}"})
+
+    path = await annotate(file_path, filename)
+    if path is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"No detections recorded for {filename}"})
+    return FileResponse(path, media_type="image/jpeg")
+
+@app.get("/original/{filename}")
+async def original(filename: str):
+    """
+    An uploaded image as the camera sent it, at full resolution, for when the
+    transcoded copy the analysis server received is not enough.
+    """
+    filename = os.path.basename(filename)
+    file_path = stored_path(filename)
+    try:
+        data = await read_image(file_path, filename)
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"Unknown image {filename}"})
+    return Response(content=data, media_type="image/jpeg")
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Metrics in the Prometheus text format: per-stage latency histograms,
+    per-camera upload/verdict/cycle counters and queue saturation gauges.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+async def stats():
+    """
+    Pipeline counters (inferences run/skipped by the cycle-aware scheduler, etc.)
+    """
+    return {
+        "scheduler": inference_scheduler.stats(),
+        "adaptive": adaptive_controller.stats() if adaptive_controller else None,
+        "buffer_pool": {**buffer_pool.stats(), "pending_writes": len(pending_writes)},
+        "forwarder": forwarder.stats(),
+        "dedup": dedup_index.stats(),
+        "cycles": {**cycle_manager.stats(), "store": cycle_store.stats()},
+        "annotations": annotation_store.stats(),
+        "prefilter": motion_prefilter.stats() if motion_prefilter else None,
+        "transcoder": transcoder.stats(),
+        "storage": image_store.stats(),
+        "startup": startup,
+    }
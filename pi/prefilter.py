@@ -0,0 +1,104 @@
+import time
+import threading
+import cv2
+import numpy as np
+
+
+class MotionPrefilter:
+    """
+    Cheap change detector run before YOLO, one rolling background per camera.
+
+    Each frame is reduced to a small blurred grayscale copy (width pixels wide,
+    mean brightness removed so exposure changes do not count) and compared
+    with the camera's background, a running average of its empty frames.
+    region() returns (region, sample): region is None when less than min_area
+    of the frame changed by more than threshold grey levels, and the frame is
+    then treated as empty without running the network. Otherwise it is the
+    changed region, padded by margin, for the network to run on; the whole
+    frame if there is no usable background yet (first frame, or none for
+    max_age seconds). Only frames judged empty are passed back to learn(), so
+    an animal that stays in view never becomes part of the background.
+    Lower threshold / min_area make it more sensitive.
+    """
+    def __init__(self, threshold=25, min_area=0.002, width=160, alpha=0.2, margin=0.25, min_crop=0.3, max_age=900):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.width = width
+        self.alpha = alpha
+        self.margin = margin
+        # Crops are at least this share of each side, so the network keeps some context
+        self.min_crop = min_crop
+        self.max_age = max_age
+        # { camera: (background, updated_at) }
+        self.backgrounds = {}
+        self.counters = {"frames": 0, "still": 0, "cropped": 0, "full": 0}
+        self._lock = threading.Lock()
+
+    def _small(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        h, w = gray.shape
+        small = cv2.resize(gray, (self.width, max(1, round(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0).astype(np.float32)
+        return small - small.mean()
+
+    def region(self, camera, image):
+        """
+        ((x1, y1, x2, y2) of the image to run the detector on, or None if nothing
+        changed; the frame's sample to pass to learn() if it turns out empty).
+        """
+        h, w = image.shape[:2]
+        full = (0, 0, w, h)
+        small = self._small(image)
+        now = time.monotonic()
+
+        with self._lock:
+            self.counters["frames"] += 1
+            background, updated_at = self.backgrounds.get(camera, (None, None))
+            if background is None or background.shape != small.shape or now - updated_at > self.max_age:
+                # Replaced by the first frame judged empty
+                self.backgrounds.pop(camera, None)
+                self.counters["full"] += 1
+                return full, small
+
+            mask = np.abs(small - background) > self.threshold
+            if mask.mean() < self.min_area:
+                self.counters["still"] += 1
+                return None, small
+
+            ys, xs = np.nonzero(mask)
+            scale = w / small.shape[1]
+            box = self._pad(xs.min() * scale, ys.min() * scale, (xs.max() + 1) * scale, (ys.max() + 1) * scale, w, h)
+            if (box[2] - box[0]) * (box[3] - box[1]) > 0.8 * w * h:
+                self.counters["full"] += 1
+                return full, small
+            self.counters["cropped"] += 1
+            return box, small
+
+    def learn(self, camera, sample):
+        """Blend a frame judged empty (its sample from region()) into the camera's background."""
+        now = time.monotonic()
+        with self._lock:
+            background, updated_at = self.backgrounds.get(camera, (None, None))
+            if background is None or background.shape != sample.shape or now - updated_at > self.max_age:
+                self.backgrounds[camera] = (sample, now)
+            else:
+                self.backgrounds[camera] = ((1 - self.alpha) * background + self.alpha * sample, now)
+
+    def _pad(self, x1, y1, x2, y2, w, h):
+        bw = max((x2 - x1) * (1 + 2 * self.margin), self.min_crop * w)
+        bh = max((y2 - y1) * (1 + 2 * self.margin), self.min_crop * h)
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        # Shift rather than shrink a crop that sticks out of the frame
+        x1 = int(min(max(cx - bw / 2, 0), max(w - bw, 0)))
+        y1 = int(min(max(cy - bh / 2, 0), max(h - bh, 0)))
+        return x1, y1, min(w, int(x1 + bw)), min(h, int(y1 + bh))
+
+    def stats(self):
+        frames = self.counters["frames"]
+        return {
+            **self.counters,
+            "cameras": len(self.backgrounds),
+            "skipped_ratio": round(self.counters["still"] / frames, 3) if frames else 0.0,
+            "threshold": self.threshold,
+            "min_area": self.min_area,
+        }
@@ -0,0 +1,345 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from scheduler import decide_cycle, camera_of, CYCLE_SIZE
+
+# "[TIMESTAMP_...]{MAC}-{SEQ}-{Index}[n|d].jpg": the gateway prefixes one timestamp, and the analysis
+# server another to the images the gateway forwards
+NAME_PATTERN = re.compile(r"^(?:\d{8}_\d{6}_\d{6}_)*(?P<cycle>[0-9A-Za-z]+(?:-[0-9A-Za-z]+)*)-(?P<index>\d)[nd]?\.jpe?g$",
+                          re.IGNORECASE)
+# MegaDetector's worker code lives with the analysis server
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "original_server")
+MEGADETECTOR_URL = "https://github.com/ecology-tech/MegaDetector/releases/download/v5.0/md_v5a.0.0.pt"
+MEGADETECTOR_PATH = "md_v5a.0.0.pt"
+
+REPORT_COLUMNS = ["filename", "cycle_id", "camera", "index", "is_animal", "label", "detections", "top_confidence",
+                  "cycle_animals", "cycle_passed", "error"]
+
+# Loaded once per worker process by _init_yolo
+_detector = None
+
+
+def _init_yolo(backend, conf, num_threads):
+    global _detector
+    from detector import Detector
+    _detector = Detector(backend, conf=conf, num_threads=num_threads)
+
+
+def _yolo_names():
+    return dict(_detector.names)
+
+
+def _yolo_inference(sources, conf):
+    """Same plain detections as the analysis server's workers return, for the same verdict code."""
+    return [{"classes": [int(c) for c in result.classes], "confidences": [float(c) for c in result.confidences]}
+            for result in _detector.predict(sources)]
+
+
+def worker_functions(model, backend, conf, workers):
+    """(initializer, initargs, names job, inference job) of the process pool for the chosen model."""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if model == "yolo":
+        return _init_yolo, (backend, conf, threads), _yolo_names, _yolo_inference
+    sys.path.insert(0, os.path.abspath(SERVER_DIR))
+    import inference_pool
+    inference_pool.download_model(MEGADETECTOR_PATH, MEGADETECTOR_URL)
+    return inference_pool._init_worker, (MEGADETECTOR_PATH, threads), inference_pool._model_names, inference_pool._run_inference
+
+
+def default_animal_classes(model, names):
+    if model == "yolo":
+        from detector import ANIMAL_CLASSES
+        return list(ANIMAL_CLASSES)
+    import inference_pool
+    return inference_pool.animal_classes(names)
+
+
+def parse_classes(value, names):
+    """Class ids from a comma-separated list of ids or names."""
+    ids = {name.lower(): cls for cls, name in names.items()}
+    classes = []
+    for item in value.split(","):
+        item = item.strip()
+        if item.isdigit():
+            classes.append(int(item))
+        elif item.lower() in ids:
+            classes.append(ids[item.lower()])
+        else:
+            raise SystemExit(f"Unknown class {item!r}; the model has {sorted(names.values())}")
+    return classes
+
+
+def scan(source, index=None):
+    """
+    Stored image names in name order (capture order, thanks to the timestamp
+    prefix), their total count and a function reading an image's bytes.
+    With index, the images of an ImageStore (including packed ones); otherwise
+    every JPEG under source.
+    """
+    if index:
+        from wild_animals_shared.storage import ImageStore
+        store = ImageStore(source, index)
+
+        def names():
+            after = None
+            while page := store.filenames(after, limit=5000):
+                yield from page
+                after = page[-1]
+        return names(), store.count(), store.read
+
+    paths = {}
+    for directory, _, files in os.walk(source):
+        for name in files:
+            if name.lower().endswith((".jpg", ".jpeg")):
+                paths[name] = os.path.join(directory, name)
+
+    def read(name):
+        with open(paths[name], "rb") as f:
+            return f.read()
+    return iter(sorted(paths)), len(paths), read
+
+
+def cycles(names, window=1000):
+    """
+    Group a name-ordered stream of images into cycles. Images of one cycle are
+    stored seconds apart, so a cycle is complete at CYCLE_SIZE images, or once
+    window more images have gone by without another of its images.
+    Yields (key, cycle_id, [(index, filename), ...]); the key (the cycle's first
+    image) is unique even if a cycle was re-sent. Images not named after a
+    cycle come as cycles of their own with cycle_id None.
+    """
+    # cycle_id -> (position of its last image, files), least recently extended first
+    open_cycles = OrderedDict()
+    for position, filename in enumerate(names):
+        match = NAME_PATTERN.match(filename)
+        if match is None:
+            yield filename, None, [(None, filename)]
+        else:
+            cycle_id = match["cycle"]
+            files = open_cycles.pop(cycle_id, (None, []))[1]
+            files.append((int(match["index"]), filename))
+            if len(files) >= CYCLE_SIZE:
+                yield files[0][1], cycle_id, files
+            else:
+                open_cycles[cycle_id] = (position, files)
+        while open_cycles:
+            cycle_id, (last, files) = next(iter(open_cycles.items()))
+            if position - last < window:
+                break
+            del open_cycles[cycle_id]
+            yield files[0][1], cycle_id, files
+    for cycle_id, (_, files) in open_cycles.items():
+        yield files[0][1], cycle_id, files
+
+
+class Checkpoint:
+    """
+    Results of a run so far, in SQLite. A cycle is committed together with all
+    of its images, so an interrupted run resumes after the last finished cycle.
+    A checkpoint only resumes a run with the same settings.
+    """
+    def __init__(self, path, settings):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cycles ("
+            " key TEXT PRIMARY KEY, cycle_id TEXT, camera TEXT, images INTEGER, animals INTEGER, passed INTEGER)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " filename TEXT PRIMARY KEY, cycle_key TEXT NOT NULL, img_index INTEGER, is_animal INTEGER, label TEXT,"
+            " detections INTEGER, top_confidence REAL, error TEXT)"
+        )
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+        if row is None:
+            with self.db:
+                self.db.execute("INSERT INTO meta VALUES ('settings', ?)", (json.dumps(settings, sort_keys=True),))
+        elif json.loads(row[0]) != settings:
+            raise SystemExit(f"{path} holds a run with other settings ({row[0]}); remove it or use another --checkpoint")
+
+    def done(self, key):
+        return self.db.execute("SELECT 1 FROM cycles WHERE key = ?", (key,)).fetchone() is not None
+
+    def record(self, key, cycle_id, images, passed):
+        """images: [(filename, index, is_animal, label, detections, top_confidence, error), ...]"""
+        animals = sum(1 for image in images if image[2])
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO cycles VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, cycle_id, camera_of(cycle_id), len(images), animals,
+                             None if passed is None else int(passed)))
+            self.db.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(filename, key, index, None if is_animal is None else int(is_animal), label,
+                                  detections, top_confidence, error)
+                                 for filename, index, is_animal, label, detections, top_confidence, error in images])
+
+    def totals(self):
+        return self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(images), 0), COALESCE(SUM(passed), 0) FROM cycles"
+        ).fetchone()
+
+    def export(self, path):
+        """Write every image's result, with its cycle's, as CSV in name order."""
+        rows = self.db.execute(
+            "SELECT i.filename, c.cycle_id, c.camera, i.img_index, i.is_animal, i.label, i.detections,"
+            " i.top_confidence, c.animals, c.passed, i.error"
+            " FROM images i JOIN cycles c ON c.key = i.cycle_key ORDER BY i.filename"
+        )
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_COLUMNS)
+            writer.writerows(rows)
+
+    def close(self):
+        self.db.close()
+
+
+def verdict(detections, names, animal_classes):
+    """(is_animal, label, detections, top_confidence) for one image; detections come highest confidence first."""
+    for cls, conf in zip(detections["classes"], detections["confidences"]):
+        if cls in animal_classes:
+            return True, names.get(cls, str(cls)), len(detections["classes"]), round(conf, 4)
+    top = max(detections["confidences"], default=None)
+    return False, None, len(detections["classes"]), None if top is None else round(top, 4)
+
+
+class Progress:
+    """Prints images/s and the ETA every interval seconds."""
+    def __init__(self, total, already_done, interval):
+        self.total = total
+        self.already_done = already_done
+        self.interval = interval
+        self.images = 0
+        self.cycles = 0
+        self.passed = 0
+        self.started = time.perf_counter()
+        self.printed = self.started
+
+    def add(self, images, passed):
+        self.images += images
+        self.cycles += 1
+        self.passed += int(bool(passed))
+        if time.perf_counter() - self.printed >= self.interval:
+            self.print()
+
+    def print(self):
+        self.printed = time.perf_counter()
+        elapsed = self.printed - self.started
+        rate = self.images / elapsed if elapsed else 0.0
+        remaining = self.total - self.already_done - self.images
+        eta = f"{remaining / rate / 60:.1f} min" if rate else "-"
+        print(f"{self.already_done + self.images}/{self.total} images, {rate:.1f} images/s, "
+              f"{self.cycles} cycles ({self.passed} passed), ETA {eta}", flush=True)
+
+
+def run(args):
+    settings = {"model": args.model, "backend": args.backend if args.model == "yolo" else None,
+                "conf": args.conf, "classes": args.classes, "source": os.path.abspath(args.source)}
+    checkpoint = Checkpoint(args.checkpoint or f"{os.path.splitext(args.report)[0]}.checkpoint.sqlite3", settings)
+    names, total, read = scan(args.source, args.index)
+    _, already_done, _ = checkpoint.totals()
+
+    initializer, initargs, names_job, inference_job = worker_functions(args.model, args.backend, args.conf, args.workers)
+    # spawn: workers must not inherit the parent's threads
+    executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=initializer, initargs=initargs)
+    model_names = executor.submit(names_job).result()
+    animal_classes = set(parse_classes(args.classes, model_names) if args.classes
+                         else default_animal_classes(args.model, model_names))
+    print(f"{total} images in {args.source}, {already_done} already done; "
+          f"animal classes {sorted(model_names.get(c, c) for c in animal_classes)}, conf {args.conf}", flush=True)
+
+    progress = Progress(total, already_done, args.progress_interval)
+    in_flight = {}
+
+    def submit(batch):
+        sources = [read(filename) for _, _, files in batch for _, filename in files]
+        in_flight[executor.submit(inference_job, sources, args.conf)] = batch
+
+    def infer_alone(filename):
+        """Run one image on its own after its batch failed; (detections, error)."""
+        try:
+            return executor.submit(inference_job, [read(filename)], args.conf).result()[0], None
+        except Exception as e:
+            return None, str(e)
+
+    def collect(futures):
+        for future in futures:
+            batch = in_flight.pop(future)
+            files = [(filename, index) for _, _, cycle_files in batch for index, filename in cycle_files]
+            try:
+                results = [(detections, None) for detections in future.result()]
+            except Exception as e:
+                print(f"Batch failed ({e}), retrying its {len(files)} images one by one", flush=True)
+                results = [infer_alone(filename) for filename, _ in files]
+            results = iter(results)
+            for key, cycle_id, cycle_files in batch:
+                images = []
+                for index, filename in cycle_files:
+                    detections, error = next(results)
+                    if detections is None:
+                        images.append((filename, index, None, None, None, None, error))
+                    else:
+                        images.append((filename, index, *verdict(detections, model_names, animal_classes), None))
+                # The gateway's 2-of-3 rule; a cycle cut short only passes if its missing images could not change that
+                passed = decide_cycle(image[2] for image in images) is True if cycle_id is not None else None
+                checkpoint.record(key, cycle_id, images, passed)
+                progress.add(len(images), passed)
+
+    try:
+        batch, batch_images = [], 0
+        for key, cycle_id, files in cycles(names):
+            if checkpoint.done(key):
+                continue
+            batch.append((key, cycle_id, files))
+            batch_images += len(files)
+            if batch_images >= args.batch:
+                submit(batch)
+                batch, batch_images = [], 0
+                # Keep every worker busy, with the next batch already read
+                while len(in_flight) >= 2 * args.workers:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+        if batch:
+            submit(batch)
+        while in_flight:
+            collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", flush=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown()
+    progress.print()
+    checkpoint.export(args.report)
+    cycles_done, images_done, passed = checkpoint.totals()
+    print(f"Report: {args.report} ({images_done} images, {cycles_done} cycles, {passed} passed)")
+    checkpoint.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-run detection and the 2-of-3 cycle rule over archived images, resumably.")
+    parser.add_argument("source", help="Image directory (e.g. uploads/images or ../original_server/received_images)")
+    parser.add_argument("--index", help="Storage index of source (e.g. uploads/storage.sqlite3), to include packed images")
+    parser.add_argument("--model", choices=["yolo", "megadetector"], default="yolo")
+    parser.add_argument("--backend", default=os.getenv("DETECTOR_BACKEND", "onnx"), help="Detector backend for yolo")
+    parser.add_argument("--conf", type=float, default=0.25, help="Confidence threshold")
+    parser.add_argument("--classes", help="Animal classes, comma-separated ids or names (default: the servers' own)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--batch", type=int, default=8, help="Images per inference batch (whole cycles)")
+    parser.add_argument("--report", default="reprocess.csv")
+    parser.add_argument("--checkpoint", help="Progress database (default: next to the report)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
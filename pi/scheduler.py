@@ -0,0 +1,416 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Cycle rule: a cycle of CYCLE_SIZE images is forwarded when at least
+# MIN_ANIMAL_FRAMES of them contain an animal (the "2-of-3" rule)
+CYCLE_SIZE = 3
+MIN_ANIMAL_FRAMES = 2
+
+# Upper bound on cycles whose verdicts the scheduler remembers
+MAX_TRACKED_CYCLES = 1024
+
+# What to do with a new image when the queue is full
+POLICY_REJECT = "reject"                                   # refuse the new image
+POLICY_DROP_OLDEST_CYCLE = "drop-oldest-cycle"             # shed every queued image of the oldest cycle
+POLICY_PREFER_COMPLETE_CYCLES = "prefer-complete-cycles"   # shed from the cycle with the fewest images so far
+QUEUE_POLICIES = (POLICY_REJECT, POLICY_DROP_OLDEST_CYCLE, POLICY_PREFER_COMPLETE_CYCLES)
+
+
+class QueueFullError(Exception):
+    """The inference queue is saturated and the new image was not admitted."""
+
+
+class JobShedError(Exception):
+    """A queued image was dropped to make room for others."""
+
+
+def decide_cycle(verdicts, cycle_size=CYCLE_SIZE, min_animals=MIN_ANIMAL_FRAMES):
+    """
+    Return True/False as soon as the outcome of a cycle is fixed, None while it is still open.
+    verdicts holds True/False per inferred image; None entries (not inferred) count as unknown.
+    """
+    verdicts = list(verdicts)
+    animals = sum(1 for v in verdicts if v is True)
+    known = sum(1 for v in verdicts if v is not None)
+
+    if animals >= min_animals:
+        return True
+    if animals + max(0, cycle_size - known) < min_animals:
+        return False
+    return None
+
+
+def camera_of(cycle_id):
+    """Camera a cycle belongs to: the MAC prefix of "{MAC}-{SEQ}" (None if unknown)."""
+    if cycle_id is None:
+        return None
+    return cycle_id.split("-", 1)[0]
+
+
+class ConcurrencyLimit:
+    """
+    Like asyncio.Semaphore(limit), but the limit can be changed while it is in
+    use: raising it lets waiters through at once, lowering it takes effect as
+    holders release. Only use it from the event loop.
+    """
+    def __init__(self, limit=1):
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self._waiters = deque()
+
+    def locked(self):
+        return self.in_use >= self.limit
+
+    async def acquire(self):
+        while self.in_use >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass on a wakeup this waiter will not use
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_use += 1
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def set_limit(self, limit):
+        self.limit = max(1, limit)
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.in_use
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class InferenceJob:
+    def __init__(self, seq, cycle_id, file_path, key, future, data=None, enqueued_at=None):
+        self.seq = seq
+        self.enqueued_at = enqueued_at
+        self.cycle_id = cycle_id
+        self.file_path = file_path
+        # Handed to detect_batch together with the image
+        self.key = key
+        self.future = future
+        # Uploaded bytes, if still in memory; the detector then never reads file_path
+        self.data = data
+
+    @property
+    def source(self):
+        return self.data if self.data is not None else self.file_path
+
+
+class InferenceScheduler:
+    """
+    Cycle-aware micro-batching scheduler in front of the detector.
+
+    Pending images are collected into batches of up to max_size, or whatever
+    arrived within max_wait_ms of the first one. Batches are filled round-robin
+    across cameras, starting with the least recently served, so one busy camera
+    cannot starve the others. Within a camera, images from cycles that already
+    have verdicts go first, since they are closest to a decision. Once the 2-of-3
+    outcome of a cycle is fixed, its remaining images are not inferred at all:
+    their result is (None, None).
+
+    A batch is only collected once semaphore (an asyncio.Semaphore or a
+    ConcurrencyLimit) admits it, so with a limit of 1 each batch forms while the
+    previous one runs and goes in as soon as it is done; max_size and the
+    semaphore's limit may be changed at any time and apply to the next batch.
+
+    The queue holds at most max_depth images. When it is full, policy decides
+    whether the new image is refused (QueueFullError) or queued images are shed
+    to make room (their futures fail with JobShedError).
+    observe(stage, seconds), if given, receives the queue wait of every image
+    sent to the detector.
+    """
+    def __init__(self, detect_batch, semaphore, max_size, max_wait_ms, max_depth=64, policy=POLICY_REJECT,
+                 observe=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {QUEUE_POLICIES}")
+        self.detect_batch = detect_batch
+        self.semaphore = semaphore
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_depth = max(1, max_depth)
+        self.policy = policy
+        self.observe = observe
+        self.pending = []
+        # { cycle_id: [verdict, ...] } for inferred images
+        self.verdicts = OrderedDict()
+        self.counters = {"submitted": 0, "inferred": 0, "skipped": 0, "batches": 0, "rejected": 0, "shed": 0}
+        # Queue wait of images that reached the detector
+        self.wait_stats = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+        self._seq = 0
+        # { camera: serve number } of the last image taken from each camera
+        self._last_served = {}
+        self._served = 0
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        # Batches being inferred
+        self._inflight = set()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in list(self._inflight):
+            task.cancel()
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def stats(self):
+        count = self.wait_stats["count"]
+        return {
+            **self.counters,
+            "pending": len(self.pending),
+            "inflight_batches": len(self._inflight),
+            "max_batch_size": self.max_size,
+            "max_depth": self.max_depth,
+            "policy": self.policy,
+            "avg_wait_ms": round(self.wait_stats["total_ms"] / count, 1) if count else 0.0,
+            "max_wait_ms": round(self.wait_stats["max_ms"], 1),
+            "tracked_cycles": len(self.verdicts),
+        }
+
+    def is_decided(self, cycle_id):
+        if cycle_id not in self.verdicts:
+            return False
+        return decide_cycle(self.verdicts[cycle_id]) is not None
+
+    def forget_cycle(self, cycle_id):
+        """Drop verdict bookkeeping once CycleManager has finished with a cycle."""
+        self.verdicts.pop(cycle_id, None)
+
+    def restore_verdicts(self, cycle_id, verdicts):
+        """Verdicts of an open cycle recovered after a restart."""
+        self.verdicts[cycle_id] = list(verdicts)
+
+    def record_verdict(self, cycle_id, is_animal):
+        """
+        A verdict reached without the detector (e.g. reused from an identical
+        upload); counts toward the cycle's decision like an inferred one.
+        """
+        self._record(cycle_id, is_animal)
+        self._skip_decided()
+
+    def can_admit(self, cycle_id):
+        """
+        Whether an image of this cycle would be accepted right now, so uploads can
+        be refused before their body is read. A refusal counts as rejected.
+        """
+        if cycle_id is not None and self.is_decided(cycle_id):
+            return True
+        if self._make_room(cycle_id) is None:
+            self.counters["rejected"] += 1
+            return False
+        return True
+
+    def enqueue(self, cycle_id, file_path, key=None, data=None):
+        """
+        Queue an image and return a future for its (is_animal, label) result.
+        The result is (None, None) if the image's cycle was decided without it.
+        Raises QueueFullError if the queue is full and the policy refuses the image.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if cycle_id is not None and self.is_decided(cycle_id):
+            self.counters["submitted"] += 1
+            self.counters["skipped"] += 1
+            logger.info(f"Cycle {cycle_id} already decided, skipping inference for {file_path}")
+            future.set_result((None, None))
+            return future
+
+        victims = self._make_room(cycle_id)
+        if victims is None:
+            self.counters["rejected"] += 1
+            raise QueueFullError(f"Inference queue full ({len(self.pending)}/{self.max_depth})")
+        for job in victims:
+            self._shed(job)
+
+        self.counters["submitted"] += 1
+        self._seq += 1
+        self.pending.append(InferenceJob(self._seq, cycle_id, file_path, key, future, data, loop.time()))
+        self._wakeup.set()
+        return future
+
+    async def submit(self, cycle_id, file_path, key=None, data=None):
+        """Queue an image and wait for its (is_animal, label) result."""
+        return await self.enqueue(cycle_id, file_path, key, data)
+
+    def _frames_seen(self, cycle_id):
+        if cycle_id is None:
+            return 0
+        queued = sum(1 for job in self.pending if job.cycle_id == cycle_id)
+        return len(self.verdicts.get(cycle_id, ())) + queued
+
+    def _make_room(self, cycle_id):
+        """
+        Jobs to shed so one more image fits: [] if there is room already,
+        None if the policy refuses the new image instead.
+        """
+        if len(self.pending) < self.max_depth:
+            return []
+        if not self.pending or self.policy == POLICY_REJECT:
+            return None
+
+        if self.policy == POLICY_DROP_OLDEST_CYCLE:
+            oldest = min(self.pending, key=lambda job: job.seq)
+            if oldest.cycle_id is None:
+                return [oldest]
+            return [job for job in self.pending if job.cycle_id == oldest.cycle_id]
+
+        # POLICY_PREFER_COMPLETE_CYCLES: give up the image whose cycle is least
+        # likely to complete (fewest images seen), newest first among equals
+        victim = min(self.pending, key=lambda job: (self._frames_seen(job.cycle_id), -job.seq))
+        if self._frames_seen(cycle_id) + 1 <= self._frames_seen(victim.cycle_id):
+            return None
+        return [victim]
+
+    def _shed(self, job):
+        self.pending.remove(job)
+        self.counters["shed"] += 1
+        logger.warning(f"Inference queue full, shedding {job.file_path} (cycle {job.cycle_id})")
+        if not job.future.done():
+            job.future.set_exception(JobShedError(f"Shed from full inference queue: {job.file_path}"))
+
+    def _priority(self, job):
+        # More verdicts already in the cycle -> closer to a decision -> earlier
+        known = len(self.verdicts.get(job.cycle_id, ())) if job.cycle_id is not None else 0
+        return (-known, job.seq)
+
+    def _record(self, cycle_id, is_animal):
+        if cycle_id is None:
+            return
+        self.verdicts.setdefault(cycle_id, []).append(is_animal)
+        self.verdicts.move_to_end(cycle_id)
+        while len(self.verdicts) > MAX_TRACKED_CYCLES:
+            self.verdicts.popitem(last=False)
+
+    def _skip_decided(self):
+        """Resolve pending images whose cycle no longer needs them."""
+        remaining = []
+        for job in self.pending:
+            if job.cycle_id is not None and self.is_decided(job.cycle_id):
+                self.counters["skipped"] += 1
+                logger.info(f"Cycle {job.cycle_id} decided early, skipping inference for {job.file_path}")
+                if not job.future.done():
+                    job.future.set_result((None, None))
+            else:
+                remaining.append(job)
+        self.pending = remaining
+
+    def _take_batch(self):
+        """Remove and return up to max_size pending jobs, one camera at a time in turn."""
+        queues = {}
+        for job in sorted(self.pending, key=self._priority):
+            queues.setdefault(camera_of(job.cycle_id), []).append(job)
+        order = sorted(queues, key=lambda camera: self._last_served.get(camera, 0))
+
+        batch = []
+        while len(batch) < self.max_size and any(queues.values()):
+            for camera in order:
+                if queues[camera] and len(batch) < self.max_size:
+                    batch.append(queues[camera].pop(0))
+                    self._served += 1
+                    self._last_served[camera] = self._served
+
+        taken = set(map(id, batch))
+        self.pending = [job for job in self.pending if id(job) not in taken]
+        return batch
+
+    async def _collect(self):
+        while not self.pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(self.pending) < self.max_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        batch = self._take_batch()
+
+        now = loop.time()
+        for job in batch:
+            wait_ms = (now - job.enqueued_at) * 1000
+            self.wait_stats["count"] += 1
+            self.wait_stats["total_ms"] += wait_ms
+            self.wait_stats["max_ms"] = max(self.wait_stats["max_ms"], wait_ms)
+            if self.observe is not None:
+                self.observe("queue_wait", wait_ms / 1000)
+        return batch
+
+    async def _run(self):
+        while True:
+            await self.semaphore.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self.semaphore.release()
+                raise
+            if not batch:
+                # Skipped while we waited (its cycle was decided by another batch); wait again
+                self.semaphore.release()
+                continue
+            task = asyncio.create_task(self._infer(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _infer(self, batch):
+        """Run one batch (holding a semaphore slot, released when done) and resolve its futures."""
+        try:
+            sources = [job.source for job in batch]
+            keys = [job.key for job in batch]
+            logger.info(f"Running inference batch of {len(batch)} image(s)")
+            try:
+                results = await asyncio.to_thread(self.detect_batch, sources, keys)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                return
+
+            self.counters["batches"] += 1
+            self.counters["inferred"] += len(batch)
+            for job, result in zip(batch, results):
+                self._record(job.cycle_id, result[0])
+                if not job.future.done():
+                    job.future.set_result(result)
+
+            self._skip_decided()
+        finally:
+            self.semaphore.release()
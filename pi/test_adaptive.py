@@ -0,0 +1,103 @@
+import os
+import asyncio
+import tempfile
+from adaptive import AdaptiveController, ThermalSource, Knob
+from scheduler import ConcurrencyLimit
+from wild_animals_shared.checks import Checks
+
+# Configuration
+MAX_FREQ_KHZ = 1800000
+QUEUE_CAPACITY = 32
+check = Checks()
+
+class FakeSysfs:
+    """Thermal zone and cpufreq files in a temporary directory, written by the test."""
+    def __init__(self):
+        root = tempfile.mkdtemp()
+        self.thermal_zone = os.path.join(root, "temp")
+        self.cpufreq_dir = os.path.join(root, "cpufreq")
+        os.makedirs(self.cpufreq_dir)
+        self._write(os.path.join(self.cpufreq_dir, "cpuinfo_max_freq"), MAX_FREQ_KHZ)
+        self.set(50.0, MAX_FREQ_KHZ)
+
+    def set(self, temp_c, freq_khz):
+        self._write(self.thermal_zone, int(temp_c * 1000))
+        self._write(os.path.join(self.cpufreq_dir, "scaling_cur_freq"), freq_khz)
+
+    def _write(self, path, value):
+        with open(path, "w") as f:
+            f.write(f"{value}\n")
+
+async def main():
+    sysfs = FakeSysfs()
+    applied = {}
+    knobs = [
+        Knob("threads", range(1, 5), 4, lambda n: applied.__setitem__("threads", n), blocking=True),
+        Knob("batch_size", range(1, 9), 4, lambda n: applied.__setitem__("batch_size", n)),
+        Knob("image_size", [320, 384, 448, 512, 576, 640], 640, lambda n: applied.__setitem__("image_size", n)),
+        Knob("concurrency", range(1, 3), 1, lambda n: applied.__setitem__("concurrency", n)),
+    ]
+    depth = [0]
+    adjustments = []
+    controller = AdaptiveController(
+        ThermalSource(sysfs.thermal_zone, sysfs.cpufreq_dir), knobs, lambda: (depth[0], QUEUE_CAPACITY),
+        temp_high=75, temp_low=65, on_adjust=lambda *change: adjustments.append(change),
+    )
+
+    # Cool and idle: nothing to do
+    check("cool and idle keeps the configured settings", await controller.tick() is None)
+    check("sysfs values are read", controller.sample["temp_c"] == 50.0)
+
+    # Hot: threads go down first (concurrency is already at its minimum), one step per tick
+    sysfs.set(80.0, MAX_FREQ_KHZ)
+    change = await controller.tick()
+    check("hot steps threads down", change is not None and change[:3] == ("threads", 4, 3))
+    check("the new value is applied", applied.get("threads") == 3)
+    check("the adjustment is reported", adjustments and adjustments[-1][:3] == ("threads", 4, 3))
+    for _ in range(3):
+        await controller.tick()
+    check("threads stop at their minimum, then resolution goes down",
+          controller.settings()["threads"] == 1 and controller.settings()["image_size"] == 576)
+
+    # Between the thresholds: hold
+    sysfs.set(70.0, MAX_FREQ_KHZ)
+    check("warm holds the settings", await controller.tick() is None)
+
+    # Throttled clock while inferring counts as hot, even below temp_high
+    sysfs.set(70.0, MAX_FREQ_KHZ // 2)
+    controller.record(4, 1.0)
+    change = await controller.tick()
+    check("throttling steps down", change is not None and change[0] == "image_size" and change[2] == 512)
+    # ... but an idle CPU clocking down is not throttling
+    check("a low clock while idle is not throttling", await controller.tick() is None)
+
+    # Cool with a backlog: batch size goes up first
+    sysfs.set(60.0, MAX_FREQ_KHZ)
+    depth[0] = QUEUE_CAPACITY
+    change = await controller.tick()
+    check("backlog raises the batch size", change is not None and change[:3] == ("batch_size", 4, 5))
+
+    # Cool, queue drained: back to the configured values, resolution first
+    depth[0] = 0
+    change = await controller.tick()
+    check("resolution is restored first", change is not None and change[0] == "image_size")
+    for _ in range(20):
+        await controller.tick()
+    check("every setting returns to its configured value",
+          controller.settings() == {"threads": 4, "batch_size": 4, "image_size": 640, "concurrency": 1})
+
+    # The concurrency limit can be raised while a waiter is blocked
+    limit = ConcurrencyLimit(1)
+    await limit.acquire()
+    waiter = asyncio.create_task(limit.acquire())
+    await asyncio.sleep(0)
+    blocked = not waiter.done()
+    limit.set_limit(2)
+    await asyncio.sleep(0)
+    check("raising the limit lets a waiter through", blocked and waiter.done() and limit.in_use == 2)
+
+    print(f"\nStats: {controller.stats()}")
+
+if __name__ == "__main__":
+    with check:
+        asyncio.run(main())
@@ -0,0 +1,77 @@
+import os
+import sys
+
+# Compare on CPU, as on the Pi
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+from detector import Detector, load_image
+from backends import BACKEND_TORCH, BACKEND_ONNX, BACKEND_OPENVINO
+
+# Configuration
+IMAGE_FILE = "test.jpg"
+WEIGHTS = "yolov8n.pt"
+CACHE_DIR = "models"
+# Boxes of the same class must overlap at least this much to count as the same detection
+MIN_IOU = 0.9
+# Backends checked against PyTorch: (backend, int8)
+CANDIDATES = [(BACKEND_ONNX, False), (BACKEND_ONNX, True), (BACKEND_OPENVINO, False)]
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def matched(reference, detections):
+    """Share of reference detections that have a same-class box with IoU >= MIN_IOU."""
+    if len(reference) == 0:
+        return 1.0 if len(detections) == 0 else 0.0
+    hits = 0
+    for box, cls in zip(reference.boxes, reference.classes):
+        candidates = [other for other, other_cls in zip(detections.boxes, detections.classes) if other_cls == cls]
+        if any(iou(box, other) >= MIN_IOU for other in candidates):
+            hits += 1
+    return hits / len(reference)
+
+def main():
+    if not os.path.exists(IMAGE_FILE):
+        print(f"Error: '{IMAGE_FILE}' not found in current directory.")
+        sys.exit(1)
+
+    image = load_image(IMAGE_FILE)
+    reference = Detector(BACKEND_TORCH, WEIGHTS)
+    expected = reference.detect(IMAGE_FILE)
+    expected_detections = reference.backend.predict([image])[0]
+    print(f"torch: {expected}, {len(expected_detections)} detection(s)")
+
+    failures = 0
+    for backend, int8 in CANDIDATES:
+        name = f"{backend}{' int8' if int8 else ''}"
+        detector = Detector(backend, WEIGHTS, int8=int8, cache_dir=CACHE_DIR)
+        if detector.backend.name != backend:
+            print(f"SKIP: {name} (not available)")
+            continue
+
+        result = detector.detect(IMAGE_FILE)
+        detections = detector.backend.predict([image])[0]
+        share = matched(expected_detections, detections)
+        # Quantization may move boxes a little; the verdict must still agree
+        ok = result == expected and (int8 or share == 1.0)
+        failures += not ok
+        print(f"{'PASS' if ok else 'FAIL'}: {name}: {result}, {len(detections)} detection(s), "
+              f"{share:.0%} of torch detections matched")
+
+        # A batch must give the same answers as single images
+        with open(IMAGE_FILE, "rb") as f:
+            data = f.read()
+        batch = detector.detect_batch([IMAGE_FILE, image, data])
+        ok = all(r == result for r in batch)
+        failures += not ok
+        print(f"{'PASS' if ok else 'FAIL'}: {name}: batch matches single image")
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from reprocess import cycles
+from wild_animals_shared.checks import Checks
+
+# Configuration
+CAMERA = "AABBCCDDEEFF"
+# Names as each hop stores them: the ESP's, the gateway's, and the analysis server's for forwarded images
+ESP_NAME = "{camera}-{seq:08d}-{index}n.jpg"
+GATEWAY_NAME = "20250101_115959_{index:06d}_" + ESP_NAME
+SERVER_NAME = "20250101_120000_{index:06d}_" + GATEWAY_NAME
+check = Checks()
+
+def names(pattern, seq=1):
+    return [pattern.format(camera=CAMERA, seq=seq, index=index) for index in range(1, 4)]
+
+def main():
+    for hop, pattern in (("ESP", ESP_NAME), ("gateway", GATEWAY_NAME), ("server", SERVER_NAME)):
+        grouped = list(cycles(names(pattern)))
+        check(f"{hop}-stored names form one cycle", len(grouped) == 1)
+        key, cycle_id, files = grouped[0]
+        check(f"{hop}-stored names carry the cycle id",
+              cycle_id == f"{CAMERA}-00000001" and [index for index, _ in files] == [1, 2, 3])
+
+    # Interleaved cycles of two cameras, as in one directory of server-stored images
+    other = [name.replace(CAMERA, "112233445566") for name in names(SERVER_NAME, seq=7)]
+    mixed = [name for pair in zip(names(SERVER_NAME), other) for name in pair]
+    grouped = {cycle_id: len(files) for _, cycle_id, files in cycles(mixed)}
+    check("interleaved cycles are told apart",
+          grouped == {f"{CAMERA}-00000001": 3, "112233445566-00000007": 3})
+
+    # Images not named after a cycle are cycles of their own
+    grouped = list(cycles(["snapshot.jpg"]))
+    check("other names come alone", grouped == [("snapshot.jpg", None, [(None, "snapshot.jpg")])])
+
+
+if __name__ == "__main__":
+    with check:
+        main()
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from detector import ANIMAL_CLASSES, decode_image, decode_reduced
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardProfile:
+    """How forwarded images are re-encoded: longest edge, JPEG quality, and whether to crop to the animals."""
+    def __init__(self, name, max_edge=None, quality=None, crop=False):
+        self.name = name
+        self.max_edge = max_edge
+        self.quality = quality
+        self.crop = crop
+
+    @property
+    def passthrough(self):
+        return self.max_edge is None and self.quality is None and not self.crop
+
+
+# MegaDetector runs at up to 1280 px, so larger images only cost uplink bytes
+PROFILES = {
+    "original": ForwardProfile("original"),
+    "megadetector": ForwardProfile("megadetector", max_edge=1280, quality=80),
+    "compact": ForwardProfile("compact", max_edge=960, quality=70),
+    "crop": ForwardProfile("crop", max_edge=1280, quality=80, crop=True),
+}
+
+
+class Transcoder:
+    """
+    Re-encodes images on their way to the analysis server, in a thread pool of
+    its own so uploads and inference never wait on it.
+
+    With a cropping profile, an image is cut down to its animal boxes (from the
+    gateway's own detections, via lookup(filename)) plus margin on every side;
+    images without animal boxes are only resized. The original is sent instead
+    whenever re-encoding would not make it smaller.
+
+    Re-encoded images are kept (up to cache_bytes, least recently used out
+    first) until forwarded(filename) reports them sent, so a retried send
+    neither reads nor re-encodes the image again.
+    """
+    def __init__(self, profile, lookup=None, workers=1, margin=0.2, cache_bytes=16 * 1024 * 1024):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown forward profile {profile!r}, expected one of {tuple(PROFILES)}")
+        self.profile = PROFILES[profile]
+        # lookup(filename) -> Detections or None; blocking, called in the pool
+        self.lookup = lookup
+        self.margin = margin
+        self.counters = {"images": 0, "transcoded": 0, "cropped": 0, "kept_original": 0, "failed": 0, "cache_hits": 0}
+        self.cache_bytes = cache_bytes
+        # { filename: (original size, bytes to send) }, on the event loop only
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="transcode")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def cached(self, filename):
+        """The bytes to forward for an image already re-encoded and not yet sent, or None."""
+        entry = self._cache.get(filename)
+        if entry is None:
+            return None
+        self._cache.move_to_end(filename)
+        self.counters["cache_hits"] += 1
+        return entry[1]
+
+    def forwarded(self, filename):
+        """
+        Drop an image that reached the analysis server from the cache.
+        Returns (original size, sent size), or None if it was not cached.
+        """
+        entry = self._cache.pop(filename, None)
+        if entry is None:
+            return None
+        self._cached_bytes -= len(entry[1])
+        return entry[0], len(entry[1])
+
+    async def transcode(self, data, filename):
+        """The bytes to forward for an image (the original ones if the profile keeps them)."""
+        self.counters["images"] += 1
+        if self.profile.passthrough:
+            sent = data
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                sent = await loop.run_in_executor(self._executor, self._transcode, data, filename)
+            except Exception as e:
+                logger.error(f"Could not transcode {filename}, forwarding the original: {e}")
+                self.counters["failed"] += 1
+                sent = data
+        self._store(filename, len(data), sent)
+        return sent
+
+    def _store(self, filename, original_size, sent):
+        previous = self._cache.pop(filename, None)
+        if previous is not None:
+            self._cached_bytes -= len(previous[1])
+        self._cache[filename] = (original_size, sent)
+        self._cached_bytes += len(sent)
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    def _transcode(self, data, filename):
+        profile = self.profile
+        if profile.crop or not profile.max_edge:
+            # Crops keep the full resolution of the animal
+            image, scale = decode_image(data), 1.0
+        else:
+            # The DCT-scaled decode already gets close to max_edge without a full-size image
+            image, scale = decode_reduced(data, profile.max_edge)
+
+        if profile.crop:
+            box = self._crop_box(filename, image.shape, scale)
+            if box is not None:
+                x1, y1, x2, y2 = box
+                image = image[y1:y2, x1:x2]
+                self._count("cropped")
+
+        h, w = image.shape[:2]
+        if profile.max_edge and max(h, w) > profile.max_edge:
+            ratio = profile.max_edge / max(h, w)
+            image = cv2.resize(image, (round(w * ratio), round(h * ratio)), interpolation=cv2.INTER_AREA)
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, profile.quality] if profile.quality else []
+        ok, encoded = cv2.imencode(".jpg", image, params)
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        if len(encoded) >= len(data):
+            self._count("kept_original")
+            return data
+        self._count("transcoded")
+        return encoded.tobytes()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _crop_box(self, filename, shape, scale):
+        """Union of the image's animal boxes plus margin, in decoded pixels; None if it has none."""
+        detections = self.lookup(filename) if self.lookup is not None else None
+        if detections is None:
+            return None
+        boxes = [box for box, cls in zip(detections.boxes, detections.classes) if int(cls) in ANIMAL_CLASSES]
+        if not boxes:
+            return None
+        x1 = min(box[0] for box in boxes) / scale
+        y1 = min(box[1] for box in boxes) / scale
+        x2 = max(box[2] for box in boxes) / scale
+        y2 = max(box[3] for box in boxes) / scale
+        pad_x, pad_y = (x2 - x1) * self.margin, (y2 - y1) * self.margin
+        h, w = shape[:2]
+        return (max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y)),
+                min(w, int(x2 + pad_x + 1)), min(h, int(y2 + pad_y + 1)))
+
+    def stats(self):
+        return {
+            **self.counters,
+            "profile": self.profile.name,
+            "cached": len(self._cache),
+            "cached_bytes": self._cached_bytes,
+        }
@@ -0,0 +1,26 @@
+import sys
+
+
+class Checks:
+    """
+    PASS/FAIL lines for the test_*.py scripts: check(name, ok) prints one and
+    returns ok. Run the script's main() inside `with check:` so that it exits
+    with status 1 if any check failed.
+    """
+    def __init__(self):
+        self.failed = []
+
+    def __call__(self, name, ok):
+        print(f"{'PASS' if ok else 'FAIL'}: {name}")
+        if not ok:
+            self.failed.append(name)
+        return ok
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.failed:
+            print(f"\n{len(self.failed)} check(s) failed: {', '.join(self.failed)}")
+            sys.exit(1)
+        return False
@@ -0,0 +1,320 @@
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Image classes, set once the image's cycle (or the image itself) is decided
+CLASS_ANIMAL = "animal"
+CLASS_EMPTY = "empty"
+
+SEGMENT_DIR = "segments"
+
+
+class ImageStore:
+    """
+    Where images live on disk, and for how long.
+
+    New images are written loose under root/YYYYMMDD/<camera>/, so no directory
+    grows past one camera-day of files. An SQLite index maps every filename to
+    its file, or to its segment, offset and length once it has been packed.
+
+    Images are classified animal or empty when decided. sweep(), run in the
+    background, then:
+    - deletes images older than the retention of their class (retain[CLASS_ANIMAL],
+      retain[CLASS_EMPTY], retain[None] for images never classified; None keeps them),
+    - deletes the oldest images, empty ones first, while less than min_free_bytes
+      of the disk are free (packed images a whole segment at a time, as that is
+      when their space comes back),
+    - if pack_after is set, appends classified images older than that to one
+      segment file per day and class (root/segments/YYYYMMDD-<class>.seg), with
+      one sequential write and one fsync per segment instead of an inode per
+      image; a segment file is deleted once none of its images is kept.
+    Images younger than grace seconds are never deleted, as their cycle may still be open.
+    """
+    def __init__(self, root, index_path, retain=None, min_free_bytes=0, pack_after=None, grace=600, batch=500):
+        self.root = root
+        self.retain = retain or {}
+        self.min_free_bytes = min_free_bytes
+        self.pack_after = pack_after
+        self.grace = grace
+        self.batch = max(1, batch)
+        self.counters = {"stored": 0, "expired": 0, "evicted": 0, "packed": 0, "segments_removed": 0}
+        # Directories known to exist, so storing an image does not stat them every time
+        self._dirs = set()
+        os.makedirs(os.path.join(root, SEGMENT_DIR), exist_ok=True)
+        # Used from the event loop and from the sweep thread
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(index_path, check_same_thread=False)
+        # WAL: commits append to the log instead of rewriting pages in place
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " filename TEXT PRIMARY KEY, camera TEXT, day TEXT NOT NULL, stored_at REAL NOT NULL,"
+            " path TEXT NOT NULL, class TEXT, segment TEXT, offset INTEGER, length INTEGER)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_class_age ON images (class, stored_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_stored_at ON images (stored_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_segment ON images (segment)")
+
+    def close(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
+
+    def path_for(self, filename, camera=None, when=None):
+        """Path to write a new image to, in the directory of its day and camera."""
+        directory = os.path.join(self.root, time.strftime("%Y%m%d", time.localtime(when)), camera or "unknown")
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+        return os.path.join(directory, filename)
+
+    def add(self, filename, path, camera=None, image_class=None, stored_at=None, commit=True):
+        """
+        An image was written to path (from path_for); stored_at defaults to now.
+        With commit=False the row is visible here at once but only committed by
+        the next commit() (or any other write), so a burst of images shares one commit.
+        """
+        stored_at = time.time() if stored_at is None else stored_at
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO images (filename, camera, day, stored_at, path, class) VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, camera, time.strftime("%Y%m%d", time.localtime(stored_at)), stored_at, path, image_class),
+            )
+            if commit:
+                self.db.commit()
+        self.counters["stored"] += 1
+
+    def commit(self):
+        with self._lock:
+            self.db.commit()
+
+    def classify(self, filenames, image_class):
+        """The images' cycle was decided: CLASS_ANIMAL or CLASS_EMPTY."""
+        with self._lock, self.db:
+            self.db.executemany("UPDATE images SET class = ? WHERE filename = ?",
+                                [(image_class, filename) for filename in filenames])
+
+    def contains(self, filename):
+        with self._lock:
+            return self.db.execute("SELECT 1 FROM images WHERE filename = ?", (filename,)).fetchone() is not None
+
+    def path_of(self, filename):
+        """Path the image was stored at (it may since have been packed), or None if unknown."""
+        with self._lock:
+            row = self.db.execute("SELECT path FROM images WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def filenames(self, after=None, limit=1000):
+        """Up to limit stored filenames in name order, starting after the given one; for paging through the archive."""
+        with self._lock:
+            rows = self.db.execute("SELECT filename FROM images WHERE filename > ? ORDER BY filename LIMIT ?",
+                                   (after or "", limit)).fetchall()
+        return [filename for filename, in rows]
+
+    def count(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def read(self, filename):
+        """The image's bytes, from its loose file or its segment. Blocking."""
+        with self._lock:
+            row = self.db.execute("SELECT path, segment, offset, length FROM images WHERE filename = ?",
+                                  (filename,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(filename)
+        path, segment, offset, length = row
+        if segment is None:
+            with open(path, "rb") as f:
+                return f.read()
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.root, SEGMENT_DIR, segment)
+
+    def sweep(self):
+        """Apply retention and free-space limits, then pack cold images. Blocking; returns what was done."""
+        now = time.time()
+        done = {"expired": self._expire(now), "evicted": self._free_space(now), "packed": self._pack(now)}
+        done["segments_removed"] = self._drop_unused_segments()
+        for name, count in done.items():
+            self.counters[name] += count
+        if any(done.values()):
+            logger.info(f"Storage sweep: {done}")
+        return done
+
+    def _expire(self, now):
+        deleted = 0
+        for image_class, age in self.retain.items():
+            if age is None:
+                continue
+            cutoff = min(now - age, now - self.grace)
+            while True:
+                with self._lock:
+                    rows = self.db.execute(
+                        "SELECT filename, path, segment FROM images WHERE class IS ? AND stored_at < ? LIMIT ?",
+                        (image_class, cutoff, self.batch),
+                    ).fetchall()
+                if not rows:
+                    break
+                deleted += self._delete(rows)
+        return deleted
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def _free_space(self, now):
+        if not self.min_free_bytes:
+            return 0
+        deleted = 0
+        while (needed := self.min_free_bytes - self.free_bytes()) > 0:
+            # Empty frames go first, then unclassified ones, animals last; oldest first within each
+            with self._lock:
+                rows = self.db.execute(
+                    "SELECT filename, path, segment FROM images WHERE stored_at < ?"
+                    " ORDER BY CASE class WHEN ? THEN 0 WHEN ? THEN 2 ELSE 1 END, stored_at LIMIT ?",
+                    (now - self.grace, CLASS_EMPTY, CLASS_ANIMAL, self.batch),
+                ).fetchall()
+            if not rows:
+                logger.warning(f"Less than {self.min_free_bytes} bytes free, but nothing left to delete")
+                break
+            # Loose files free their space one by one: delete those up to the first packed
+            # image, and only as many as it takes
+            loose, freed = [], 0
+            for row in rows:
+                if row[2] is not None or freed >= needed:
+                    break
+                loose.append(row)
+                freed += self._size(row[1])
+            if loose:
+                deleted += self._delete(loose)
+            else:
+                # A packed image only frees its space with its whole segment
+                deleted += self._delete_segment(rows[0][2])
+        return deleted
+
+    def _size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _delete(self, rows):
+        with self._lock, self.db:
+            self.db.executemany("DELETE FROM images WHERE filename = ?", [(filename,) for filename, _, _ in rows])
+        for _, path, segment in rows:
+            if segment is None:
+                self._unlink(path)
+        return len(rows)
+
+    def _delete_segment(self, segment):
+        """Delete a segment file and every image packed into it; returns the number of images."""
+        with self._lock, self.db:
+            deleted = self.db.execute("DELETE FROM images WHERE segment = ?", (segment,)).rowcount
+        try:
+            os.remove(self._segment_path(segment))
+        except FileNotFoundError:
+            pass
+        self.counters["segments_removed"] += 1
+        return deleted
+
+    def _unlink(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        # Drop the camera and day directories of past days once they are empty;
+        # today's may be written to (from the cached _dirs) at any moment
+        directory = os.path.dirname(path)
+        if os.path.relpath(directory, self.root).split(os.sep)[0] == time.strftime("%Y%m%d"):
+            return
+        for _ in range(2):
+            if os.path.abspath(directory) == os.path.abspath(self.root):
+                break
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            self._dirs.discard(directory)
+            directory = os.path.dirname(directory)
+
+    def _pack(self, now):
+        if self.pack_after is None:
+            return 0
+        packed = 0
+        cutoff = min(now - self.pack_after, now - self.grace)
+        while True:
+            with self._lock:
+                rows = self.db.execute(
+                    "SELECT filename, path, day, class FROM images"
+                    " WHERE segment IS NULL AND class IS NOT NULL AND stored_at < ? ORDER BY day, class LIMIT ?",
+                    (cutoff, self.batch),
+                ).fetchall()
+            if not rows:
+                return packed
+            groups = {}
+            for filename, path, day, image_class in rows:
+                groups.setdefault(f"{day}-{image_class}.seg", []).append((filename, path))
+            for segment, images in groups.items():
+                packed += self._append(segment, images)
+
+    def _append(self, segment, images):
+        """
+        Append loose images to a segment. The bytes are synced before the index
+        points at them, and the loose files are only removed after that, so a
+        crash at any point leaves every image readable (at worst as unused
+        bytes at the end of the segment).
+        """
+        entries, missing = [], []
+        with open(self._segment_path(segment), "ab") as f:
+            offset = f.tell()
+            for filename, path in images:
+                try:
+                    with open(path, "rb") as image:
+                        data = image.read()
+                except FileNotFoundError:
+                    missing.append((filename,))
+                    continue
+                f.write(data)
+                entries.append((segment, offset, len(data), filename))
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock, self.db:
+            self.db.executemany("UPDATE images SET segment = ?, offset = ?, length = ? WHERE filename = ?", entries)
+            self.db.executemany("DELETE FROM images WHERE filename = ?", missing)
+        if missing:
+            logger.warning(f"{len(missing)} indexed images were missing on disk and were dropped from the index")
+        for filename, path in images:
+            self._unlink(path)
+        return len(entries)
+
+    def _drop_unused_segments(self):
+        removed = 0
+        for segment in os.listdir(os.path.join(self.root, SEGMENT_DIR)):
+            with self._lock:
+                used = self.db.execute("SELECT 1 FROM images WHERE segment = ? LIMIT 1", (segment,)).fetchone()
+            if used is None:
+                os.remove(self._segment_path(segment))
+                removed += 1
+        return removed
+
+    def stats(self):
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT class, COUNT(*), COUNT(segment) FROM images GROUP BY class"
+            ).fetchall()
+        return {
+            **self.counters,
+            "images": {image_class or "unclassified": count for image_class, count, _ in rows},
+            "packed_images": sum(packed for _, _, packed in rows),
+            "segments": len(os.listdir(os.path.join(self.root, SEGMENT_DIR))),
+            "free_bytes": self.free_bytes(),
+        }